@@ -2,11 +2,16 @@
 MERGE AIR QUALITY + WEATHER + STATION COORDINATES
 Phiên bản đã thêm kiểm tra timezone, duplicate, dtype
 """
+import importlib
 import pandas as pd
 import os
 import sys
 from datetime import datetime
 
+# profiling / timestamps là module của pipelineDataViaSupabase/: import lúc gọi hàm, đường dẫn do người gọi
+# (cli.py merge) hoặc khối __main__ bên dưới thêm vào sys.path. Import combineData từ notebook/script khác
+# mà không có đường dẫn đó thì các hàm vẫn chạy: không profile, parse datetime bằng pd.to_datetime.
+
 # CONFIGURATION
 CONFIG = {
     'air_quality_file': 'hanoi_air_quality_from04Aug_CAMS_COMBINED.csv',
@@ -34,6 +39,13 @@ FINAL_COLUMN_ORDER = [
 
 # UTILITY FUNCTIONS
 
+def _pipeline_module(name):
+    """Module dùng chung trong pipelineDataViaSupabase/, hoặc None nếu không import được."""
+    try:
+        return importlib.import_module(name)
+    except ImportError:
+        return None
+
 def print_header(text):
     print("\n" + "="*60)
     print(f"  {text}")
@@ -41,6 +53,10 @@ def print_header(text):
 
 def print_step(step_num, text):
     print(f"\n[Bước {step_num}] {text}")
+    # --profile: mỗi bước là một stage riêng (không làm gì khi không profile)
+    profiling = _pipeline_module("profiling")
+    if profiling is not None:
+        profiling.step(f"Bước {step_num}: {text}", caller_depth=2)
 
 def print_info(text, indent=1):
     prefix = "  " * indent + "→ "
@@ -87,16 +103,18 @@ def validate_dataframe(df, df_name, required_cols):
     print_info(f" {df_name}: Đủ các cột cần thiết")
 
 def parse_datetime_column(df, col_name='datetime'):
-    """Parse cột datetime với timezone kiểm soát"""
+    """Parse cột datetime về UTC (chỉ parse các chuỗi khác nhau, định dạng cố định)"""
+    timestamps = _pipeline_module("timestamps")
+
     try:
-        df[col_name] = pd.to_datetime(df[col_name], utc=True)
-        print_info("Parse datetime với UTC timezone")
-    except:
-        try:
-            df[col_name] = pd.to_datetime(df[col_name])
-            print_info("Parse datetime không timezone (tz-naive)")
-        except Exception as e:
-            raise ValueError(f" Không thể parse cột '{col_name}': {e}")
+        n_unique = df[col_name].nunique()
+        if timestamps is not None:
+            df[col_name] = timestamps.parse_timestamps(df[col_name], naive_tz='UTC', tz='UTC')
+        else:
+            df[col_name] = pd.to_datetime(df[col_name], utc=True)
+        print_info(f"Parse datetime với UTC timezone ({n_unique:,} giá trị khác nhau)")
+    except Exception as e:
+        raise ValueError(f" Không thể parse cột '{col_name}': {e}")
     return df
 
 def check_data_quality(df, df_name):
@@ -220,6 +238,10 @@ def main():
         df_final.to_csv(CONFIG['output_file'], index=False, encoding='utf-8-sig')
         print_info(f" Lưu thành công → {CONFIG['output_file']} ({os.path.getsize(CONFIG['output_file'])/1024/1024:.2f} MB)", indent=2)
 
+        profiling = _pipeline_module("profiling")
+        if profiling is not None:
+            profiling.end_stage()
+
         # Tổng kết
         end_time = datetime.now()
         duration = (end_time - start_time).total_seconds()
@@ -240,8 +262,13 @@ def main():
         print("="*60)
         print(str(e))
         import traceback; traceback.print_exc()
+        profiling = _pipeline_module("profiling")
+        if profiling is not None:
+            profiling.end_stage()
         sys.exit(1)
 
 # RUN
 if __name__ == "__main__":
+    # Chạy trực tiếp `python combineData.py`: các module dùng chung nằm trong pipelineDataViaSupabase/
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pipelineDataViaSupabase'))
     df_result = main()
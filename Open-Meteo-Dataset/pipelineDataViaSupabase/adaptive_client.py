@@ -0,0 +1,228 @@
+"""
+HTTP SESSION TỰ ĐIỀU CHỈNH TỐC ĐỘ CHO OPEN-METEO / OPENAQ
+- Mỗi host có một giới hạn số request đồng thời theo kiểu AIMD:
+  thành công thì tăng dần (+1/limit), bị 429 / lỗi / latency tăng vọt thì giảm một nửa.
+- Tôn trọng header Retry-After của 429/503 (cả host cùng chờ, không chỉ request đó).
+- Circuit breaker: sau nhiều lỗi liên tiếp thì "mở mạch" và từ chối ngay (CircuitOpenError)
+  trong `reset_timeout` giây, sau đó cho một request thăm dò (half-open) trước khi đóng mạch lại.
+- metrics() trả về trạng thái hiện tại của từng host để log cùng kết quả job.
+
+Dùng thay cho `retry(requests.Session(), ...)`:
+    openmeteo = openmeteo_requests.Client(session=AdaptiveSession())
+"""
+import email.utils
+import logging
+import random
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+
+
+logger = logging.getLogger("adaptive_client")
+
+
+class CircuitOpenError(requests.ConnectionError):
+    """Mạch của host đang mở: request bị từ chối ngay, không gửi lên upstream."""
+
+
+def parse_retry_after(value) -> float | None:
+    """Header Retry-After có thể là số giây hoặc một HTTP-date. Trả về số giây phải chờ (hoặc None)."""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(email.utils.parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class HostLimiter:
+    """Giới hạn đồng thời (AIMD) + circuit breaker cho một host."""
+
+    def __init__(self, host: str, initial_limit: int = 4, min_limit: int = 1, max_limit: int = 16,
+                 failure_threshold: int = 5, reset_timeout: float = 60.0, latency_factor: float = 3.0):
+        self.host = host
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.latency_factor = latency_factor
+
+        self.cond = threading.Condition()
+        self.in_flight = 0
+        self.state = "closed"
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+        self.consecutive_failures = 0
+        self.blocked_until = 0.0
+        self.ewma_latency = None
+        self.counts = {"requests": 0, "ok": 0, "errors": 0, "throttled": 0, "rejected": 0, "circuit_opens": 0}
+
+    def _decrease(self):
+        self.limit = max(float(self.min_limit), self.limit / 2)
+
+    def _open(self, now):
+        if self.state != "open":
+            self.counts["circuit_opens"] += 1
+            logger.warning(f"  - Circuit breaker MỞ cho host {self.host} sau {self.consecutive_failures} lỗi liên tiếp.")
+        self.state = "open"
+        self.opened_at = now
+
+    def acquire(self) -> bool:
+        """
+        Chờ tới lượt gửi request. Raise CircuitOpenError nếu mạch đang mở.
+        Trả về True nếu request này là request thăm dò của trạng thái half-open
+        (phải truyền lại cho release(probe=...)).
+        """
+        probe = False
+        with self.cond:
+            now = time.time()
+            if self.state == "open":
+                if now - self.opened_at < self.reset_timeout:
+                    self.counts["rejected"] += 1
+                    raise CircuitOpenError(f"Circuit breaker đang mở cho {self.host}")
+                self.state = "half_open"
+            if self.state == "half_open":
+                # Chỉ một request thăm dò được đi qua khi mạch nửa mở
+                if self.probe_in_flight:
+                    self.counts["rejected"] += 1
+                    raise CircuitOpenError(f"Circuit breaker đang thăm dò {self.host}")
+                self.probe_in_flight = True
+                probe = True
+
+            while self.in_flight >= int(self.limit):
+                self.cond.wait()
+            self.in_flight += 1
+            self.counts["requests"] += 1
+            wait = self.blocked_until - time.time()
+
+        if wait > 0:
+            time.sleep(wait)
+        return probe
+
+    def release(self, outcome: str, latency: float = 0.0, retry_after: float | None = None, probe: bool = False):
+        """
+        outcome: 'ok' | 'throttled' | 'error'. `probe`: giá trị acquire() đã trả về.
+        Khi mạch nửa mở, chỉ kết quả của request thăm dò mới đóng/mở lại mạch: request cũ
+        (gửi đi trước khi mạch mở) kết thúc muộn không được giải phóng lượt thăm dò.
+        """
+        with self.cond:
+            now = time.time()
+            self.in_flight -= 1
+            if probe:
+                self.probe_in_flight = False
+            # Request cũ kết thúc trong lúc nửa mở không quyết định trạng thái mạch
+            decides = self.state != "half_open" or probe
+
+            if outcome == "ok":
+                self.counts["ok"] += 1
+                self.consecutive_failures = 0
+                if self.state == "half_open" and decides:
+                    logger.info(f"  - Circuit breaker ĐÓNG lại cho host {self.host}.")
+                    self.state = "closed"
+                if self.ewma_latency is not None and latency > self.latency_factor * self.ewma_latency:
+                    self._decrease()
+                else:
+                    self.limit = min(float(self.max_limit), self.limit + 1.0 / self.limit)
+                self.ewma_latency = latency if self.ewma_latency is None else 0.8 * self.ewma_latency + 0.2 * latency
+            elif outcome == "throttled":
+                self.counts["throttled"] += 1
+                self._decrease()
+                if retry_after:
+                    self.blocked_until = max(self.blocked_until, now + retry_after)
+                if self.state == "half_open" and decides:
+                    self._open(now)
+            else:
+                self.counts["errors"] += 1
+                self.consecutive_failures += 1
+                self._decrease()
+                if decides and (self.state == "half_open" or self.consecutive_failures >= self.failure_threshold):
+                    self._open(now)
+
+            self.cond.notify_all()
+
+    def snapshot(self) -> dict:
+        with self.cond:
+            return {
+                "limit": round(self.limit, 2),
+                "in_flight": self.in_flight,
+                "state": self.state,
+                "ewma_latency_s": round(self.ewma_latency, 3) if self.ewma_latency is not None else None,
+                **self.counts,
+            }
+
+
+class AdaptiveSession(requests.Session):
+    """
+    requests.Session với giới hạn đồng thời theo host, retry có backoff cho lỗi mạng/5xx,
+    chờ theo Retry-After cho 429/503 và circuit breaker.
+    Retry-After dài hơn `max_retry_after` thì trả response luôn để job không bị treo.
+    """
+
+    def __init__(self, max_retries: int = 3, backoff_factor: float = 0.5,
+                 max_retry_after: float = 60.0, **limiter_kwargs):
+        super().__init__()
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_retry_after = max_retry_after
+        self.limiter_kwargs = limiter_kwargs
+        self._limiters = {}
+        self._limiters_lock = threading.Lock()
+
+    def limiter(self, url: str) -> HostLimiter:
+        host = urlparse(url).netloc
+        with self._limiters_lock:
+            if host not in self._limiters:
+                self._limiters[host] = HostLimiter(host, **self.limiter_kwargs)
+            return self._limiters[host]
+
+    def _backoff(self, attempt: int) -> float:
+        return self.backoff_factor * (2 ** attempt) * (1 + random.random() * 0.25)
+
+    def request(self, method, url, *args, **kwargs):
+        limiter = self.limiter(url)
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+            probe = limiter.acquire()
+            start = time.monotonic()
+            try:
+                response = super().request(method, url, *args, **kwargs)
+            except requests.RequestException:
+                limiter.release("error", time.monotonic() - start, probe=probe)
+                if last_attempt or limiter.state == "open":
+                    raise
+                time.sleep(self._backoff(attempt))
+                continue
+
+            latency = time.monotonic() - start
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            if response.status_code == 429 or (response.status_code == 503 and retry_after is not None):
+                limiter.release("throttled", latency, retry_after, probe=probe)
+                wait = retry_after if retry_after is not None else self._backoff(attempt)
+                if last_attempt or wait > self.max_retry_after:
+                    return response
+                logger.info(f"  - {limiter.host} trả về {response.status_code}, chờ {wait:.1f}s rồi thử lại...")
+                if retry_after is None:
+                    time.sleep(wait)
+                continue
+            if response.status_code >= 500:
+                limiter.release("error", latency, probe=probe)
+                if last_attempt or limiter.state == "open":
+                    return response
+                time.sleep(self._backoff(attempt))
+                continue
+
+            limiter.release("ok", latency, probe=probe)
+            return response
+
+    def metrics(self) -> dict:
+        """Trạng thái hiện tại của từng host: limit, in_flight, state, số lần ok/lỗi/429/bị từ chối."""
+        with self._limiters_lock:
+            limiters = list(self._limiters.values())
+        return {lim.host: lim.snapshot() for lim in limiters}
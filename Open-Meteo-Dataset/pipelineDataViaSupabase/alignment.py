@@ -0,0 +1,292 @@
+"""
+SO SÁNH DỮ LIỆU MÔ HÌNH (OPEN-METEO) VỚI TRẠM THAM CHIẾU METEOSTAT
+- Mỗi OpenAQ location được gán một trạm Meteostat theo station_mapping_meteostat.csv.
+- Thời gian được quy về chỉ số giờ nguyên (số giờ kể từ epoch, UTC). Chuỗi tham chiếu nằm trong
+  một mảng dày (trạm tham chiếu x biến x giờ), nên giá trị tham chiếu của mọi dòng mô hình được
+  lấy bằng một phép index mảng: ref[ref_row[location], :, giờ - giờ_đầu] (không merge theo từng trạm).
+- Thống kê được tích luỹ dưới dạng tổng đủ (n, Σm, Σr, Σm², Σr², Σmr, Σd²) theo
+  (location, biến, ngày giờ VN) bằng np.bincount; bias / RMSE / tương quan trượt N ngày
+  tính từ hiệu của tổng cộng dồn theo trục ngày.
+- Cập nhật tăng dần: mỗi location có watermark = giờ cuối đã tính. Lần sau chỉ cộng các giờ
+  > watermark và <= min(giờ cuối của mô hình, giờ cuối của trạm tham chiếu), nên giờ nào
+  Meteostat chưa có dữ liệu sẽ được tính ở lần chạy sau chứ không bị bỏ qua.
+
+    python alignment.py update [--merged ../hanoi_aq_weather_MERGED.csv] [--window-days 30]
+    python alignment.py reset
+"""
+import argparse
+import glob
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+from timestamps import parse_timestamps
+
+
+logger = logging.getLogger("alignment")
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(os.path.dirname(BASE_DIR))
+METEOSTAT_DIR = os.path.join(REPO_DIR, "weatherData", "meteostat")
+REFERENCE_DIR = os.path.join(METEOSTAT_DIR, "hanoi_weather_meteostat_ref_raw")
+STATION_MAPPING_FILE = os.path.join(METEOSTAT_DIR, "station_mapping_meteostat.csv")
+MERGED_FILE = os.path.join(os.path.dirname(BASE_DIR), "hanoi_aq_weather_MERGED.csv")
+STATE_FILE = os.path.join(BASE_DIR, "alignment_state.npz")
+ROLLING_OUTPUT_FILE = os.path.join(BASE_DIR, "alignment_rolling_stats.csv")
+
+# cột mô hình -> cột tham chiếu (cùng đơn vị: °C, %, km/h, hPa)
+VARIABLE_PAIRS = {
+    "temperature_2m": "temp_ref",
+    "relative_humidity_2m": "rhum_ref",
+    "wind_speed_10m": "wspd_ref",
+    "pressure_msl": "pres_ref",
+}
+STAT_FIELDS = ("n", "sum_m", "sum_r", "sum_mm", "sum_rr", "sum_mr", "sum_dd")
+VN_UTC_OFFSET_HOURS = 7
+NO_WATERMARK = np.iinfo(np.int64).min
+
+
+def hour_index(values, naive_tz: str = "UTC") -> np.ndarray:
+    """Chuỗi/datetime -> số giờ nguyên kể từ epoch (UTC), int64."""
+    ts = parse_timestamps(values, naive_tz=naive_tz, tz="UTC")
+    return ts.dt.tz_localize(None).to_numpy("datetime64[h]").astype(np.int64)
+
+
+# --- CHUỖI THAM CHIẾU ---
+
+class ReferenceGrid:
+    """Các chuỗi tham chiếu trên cùng một trục giờ: values[trạm, biến, giờ - h0] (NaN = thiếu)."""
+
+    def __init__(self, frames: dict, columns: list):
+        self.station_ids = [str(s) for s in frames]
+        self.columns = list(columns)
+        hours = {sid: hour_index(df.index.to_series(), naive_tz="UTC") for sid, df in frames.items()}
+        non_empty = [h for h in hours.values() if len(h)]
+        self.h0 = int(min(h.min() for h in non_empty)) if non_empty else 0
+        h1 = int(max(h.max() for h in non_empty)) if non_empty else -1
+        self.values = np.full((len(frames), len(columns), h1 - self.h0 + 1), np.nan, dtype=np.float32)
+        self.last_hour = np.full(len(frames), NO_WATERMARK, dtype=np.int64)
+
+        for row, (sid, df) in enumerate(frames.items()):
+            h = hours[sid]
+            if not len(h):
+                continue
+            block = df.reindex(columns=self.columns).to_numpy(dtype=np.float32).T
+            self.values[row][:, h - self.h0] = block
+            has_value = ~np.isnan(block).all(axis=0)
+            if has_value.any():
+                self.last_hour[row] = h[has_value].max()
+
+    def lookup(self, rows: np.ndarray, hours: np.ndarray) -> np.ndarray:
+        """Giá trị tham chiếu (n x số biến) cho các cặp (trạm tham chiếu, giờ); ngoài khoảng -> NaN."""
+        offset = hours - self.h0
+        inside = (rows >= 0) & (offset >= 0) & (offset < self.values.shape[2])
+        out = np.full((len(hours), len(self.columns)), np.nan, dtype=np.float32)
+        out[inside] = self.values[rows[inside], :, offset[inside]]
+        return out
+
+
+def load_reference_grid(station_ids, reference_dir: str = REFERENCE_DIR) -> ReferenceGrid:
+    frames = {}
+    for sid in station_ids:
+        paths = sorted(glob.glob(os.path.join(reference_dir, f"weather_{sid}_*.csv")))
+        if not paths:
+            logger.warning(f"  - Không tìm thấy file tham chiếu cho trạm Meteostat {sid}.")
+            frames[str(sid)] = pd.DataFrame(columns=list(VARIABLE_PAIRS.values()))
+            continue
+        frames[str(sid)] = pd.read_csv(paths[0], index_col="time", encoding="utf-8-sig")
+    return ReferenceGrid(frames, list(VARIABLE_PAIRS.values()))
+
+
+def read_station_mapping(path: str = STATION_MAPPING_FILE) -> pd.Series:
+    """location_id (OpenAQ) -> id trạm Meteostat (chuỗi)."""
+    mapping = pd.read_csv(path, encoding="utf-8-sig", dtype={"assigned_weather_station_id": str})
+    return mapping.drop_duplicates("aq_station_id").set_index("aq_station_id")["assigned_weather_station_id"]
+
+
+# --- ENGINE ---
+
+class AlignmentEngine:
+    """
+    Tích luỹ tổng đủ theo (location, biến, ngày) và watermark theo location.
+    stats có shape (số location, số biến, số ngày, len(STAT_FIELDS)), ngày tính từ day0.
+    """
+
+    def __init__(self, mapping: pd.Series, variables: dict = VARIABLE_PAIRS):
+        self.location_ids = mapping.index.to_numpy(dtype=np.int64)
+        self.ref_ids = mapping.astype(str).to_numpy()
+        self.variables = list(variables)
+        self.day0 = None
+        self.stats = np.zeros((len(self.location_ids), len(self.variables), 0, len(STAT_FIELDS)))
+        self.watermark = np.full(len(self.location_ids), NO_WATERMARK, dtype=np.int64)
+
+    # --- lưu / nạp trạng thái ---
+
+    def save(self, path: str = STATE_FILE):
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path, location_ids=self.location_ids, ref_ids=self.ref_ids.astype(str),
+                 variables=np.array(self.variables, dtype=str), day0=np.int64(self.day0 if self.day0 is not None else 0),
+                 has_day0=self.day0 is not None, stats=self.stats, watermark=self.watermark)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, mapping: pd.Series, path: str = STATE_FILE) -> "AlignmentEngine":
+        engine = cls(mapping)
+        if not os.path.exists(path):
+            return engine
+        with np.load(path) as data:
+            same = (np.array_equal(data["location_ids"], engine.location_ids)
+                    and list(data["ref_ids"]) == list(engine.ref_ids)
+                    and list(data["variables"]) == engine.variables)
+            if not same:
+                # Mapping hoặc danh sách biến đã đổi -> thống kê cũ không còn khớp
+                logger.warning(" -> Mapping/biến đã thay đổi so với state cũ, tính lại từ đầu.")
+                return engine
+            engine.day0 = int(data["day0"]) if bool(data["has_day0"]) else None
+            engine.stats = data["stats"]
+            engine.watermark = data["watermark"]
+        return engine
+
+    def _ensure_days(self, day_min: int, day_max: int):
+        """Mở rộng trục ngày của stats để chứa [day_min, day_max]."""
+        if self.day0 is None:
+            self.day0 = day_min
+        n_days = self.stats.shape[2]
+        pad_before = max(0, self.day0 - day_min)
+        pad_after = max(0, day_max - (self.day0 + n_days - 1))
+        if pad_before or pad_after:
+            self.stats = np.pad(self.stats, ((0, 0), (0, 0), (pad_before, pad_after), (0, 0)))
+            self.day0 -= pad_before
+
+    # --- cập nhật ---
+
+    def update(self, model_df: pd.DataFrame, reference: ReferenceGrid) -> int:
+        """
+        Cộng các giờ mới của model_df (location_id, datetime, các cột mô hình) vào thống kê.
+        Trả về số cặp (location, giờ) đã được tính.
+        """
+        loc_idx = pd.Index(self.location_ids).get_indexer(model_df["location_id"].to_numpy())
+        known = loc_idx >= 0
+        if not known.any():
+            return 0
+        loc_idx = loc_idx[known]
+        hours = hour_index(model_df["datetime"][known], naive_tz="UTC")
+        model = model_df.loc[known, self.variables].to_numpy(dtype=np.float64)
+
+        # Trùng (location, giờ) -> giữ dòng cuối
+        key = loc_idx.astype(np.int64) * (1 << 40) + (hours - hours.min())
+        _, last = np.unique(key[::-1], return_index=True)
+        keep = np.sort(len(key) - 1 - last)
+        loc_idx, hours, model = loc_idx[keep], hours[keep], model[keep]
+
+        # Giờ đủ điều kiện: sau watermark cũ, không vượt quá dữ liệu của cả mô hình lẫn tham chiếu
+        ref_rows = pd.Index(reference.station_ids).get_indexer(self.ref_ids)
+        model_last = np.full(len(self.location_ids), NO_WATERMARK, dtype=np.int64)
+        np.maximum.at(model_last, loc_idx, hours)
+        ref_last = np.where(ref_rows >= 0, reference.last_hour[np.maximum(ref_rows, 0)], NO_WATERMARK)
+        new_watermark = np.minimum(model_last, ref_last)
+        take = (hours > self.watermark[loc_idx]) & (hours <= new_watermark[loc_idx])
+        if not take.any():
+            return 0
+        loc_idx, hours, model = loc_idx[take], hours[take], model[take]
+        ref = reference.lookup(ref_rows[loc_idx], hours).astype(np.float64)
+
+        days = (hours + VN_UTC_OFFSET_HOURS) // 24
+        self._ensure_days(int(days.min()), int(days.max()))
+        n_days = self.stats.shape[2]
+        group = loc_idx * n_days + (days - self.day0)
+        size = len(self.location_ids) * n_days
+
+        for j in range(len(self.variables)):
+            m, r = model[:, j], ref[:, j]
+            valid = ~np.isnan(m) & ~np.isnan(r)
+            g, m, r = group[valid], m[valid], r[valid]
+            d = m - r
+            for k, weights in enumerate((None, m, r, m * m, r * r, m * r, d * d)):
+                self.stats[:, j, :, k] += np.bincount(g, weights=weights, minlength=size).reshape(-1, n_days)
+
+        self.watermark = np.maximum(self.watermark, new_watermark)
+        return int(take.sum())
+
+    # --- kết quả ---
+
+    @staticmethod
+    def _metrics(s: np.ndarray, min_hours: int) -> dict:
+        n, sm, sr, smm, srr, smr, sdd = (s[..., k] for k in range(len(STAT_FIELDS)))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            enough = n >= min_hours
+            bias = np.where(enough, (sm - sr) / n, np.nan)
+            rmse = np.where(enough, np.sqrt(sdd / n), np.nan)
+            cov = n * smr - sm * sr
+            var_m, var_r = n * smm - sm * sm, n * srr - sr * sr
+            corr = np.where(enough & (var_m > 0) & (var_r > 0), cov / np.sqrt(var_m * var_r), np.nan)
+        return {"n_hours": n.astype(np.int64), "bias": bias, "rmse": rmse, "corr": corr}
+
+    def rolling(self, window_days: int = 30, min_hours: int = 24) -> pd.DataFrame:
+        """Bias/RMSE/tương quan trong cửa sổ `window_days` ngày kết thúc tại mỗi ngày có dữ liệu."""
+        if self.day0 is None:
+            return pd.DataFrame()
+        csum = np.cumsum(self.stats, axis=2)
+        window = csum.copy()
+        window[:, :, window_days:] -= csum[:, :, :-window_days]
+        metrics = self._metrics(window, min_hours)
+
+        # Chỉ xuất các ngày có dữ liệu mới trong ngày đó
+        has_day = self.stats[..., 0] > 0
+        loc, var, day = np.nonzero(has_day)
+        return pd.DataFrame({
+            "location_id": self.location_ids[loc],
+            "reference_station": self.ref_ids[loc],
+            "variable": np.array(self.variables)[var],
+            "date": pd.to_datetime(self.day0 + day, unit="D").date,
+            **{name: values[loc, var, day] for name, values in metrics.items()},
+        })
+
+    def summary(self, min_hours: int = 24) -> pd.DataFrame:
+        """Thống kê trên toàn bộ lịch sử đã tích luỹ, theo location và biến."""
+        metrics = self._metrics(self.stats.sum(axis=2), min_hours)
+        loc, var = np.indices(metrics["n_hours"].shape).reshape(2, -1)
+        return pd.DataFrame({
+            "location_id": self.location_ids[loc],
+            "reference_station": self.ref_ids[loc],
+            "variable": np.array(self.variables)[var],
+            **{name: values[loc, var] for name, values in metrics.items()},
+        })
+
+
+def main():
+    parser = argparse.ArgumentParser(description="So sánh Open-Meteo với trạm tham chiếu Meteostat (tăng dần).")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_update = sub.add_parser("update", help="Cộng các giờ mới và ghi thống kê trượt")
+    p_update.add_argument("--merged", default=MERGED_FILE, help="File dữ liệu mô hình (location_id, datetime, biến)")
+    p_update.add_argument("--window-days", type=int, default=30)
+    p_update.add_argument("--out", default=ROLLING_OUTPUT_FILE)
+    sub.add_parser("reset", help="Xoá state, lần update sau tính lại từ đầu")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    if args.command == "reset":
+        if os.path.exists(STATE_FILE):
+            os.remove(STATE_FILE)
+        logger.info(f" -> Đã xoá {STATE_FILE}.")
+        return
+
+    mapping = read_station_mapping()
+    reference = load_reference_grid(sorted(set(mapping)))
+    engine = AlignmentEngine.load(mapping)
+
+    model_df = pd.read_csv(args.merged, usecols=["location_id", "datetime", *VARIABLE_PAIRS])
+    added = engine.update(model_df, reference)
+    engine.save()
+    logger.info(f" -> Đã cộng {added} giờ mới (location x giờ) vào thống kê.")
+
+    engine.rolling(args.window_days).to_csv(args.out, index=False)
+    logger.info(f" -> Đã ghi thống kê trượt {args.window_days} ngày vào '{args.out}'.")
+    with pd.option_context("display.width", 200, "display.max_rows", 200):
+        print(engine.summary().groupby(["reference_station", "variable"])[["n_hours", "bias", "rmse", "corr"]].mean().round(3))
+
+
+if __name__ == "__main__":
+    main()
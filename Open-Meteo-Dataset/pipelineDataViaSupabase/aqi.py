@@ -0,0 +1,242 @@
+"""
+TÍNH AQI (VN_AQI VÀ US EPA) CHO CẢ BATCH TRONG BƯỚC TRANSFORM
+- Chỉ số phụ (sub-index) của từng chất = nội suy tuyến tính theo bảng breakpoint,
+  tra bảng bằng np.searchsorted trên toàn bộ cột (không lặp theo dòng).
+- Trung bình trượt 24h (PM) / 8h (O3, CO) theo từng location_id bằng groupby().rolling theo thời gian.
+- Nồng độ thô của STATE_HOURS giờ gần nhất được lưu lại; batch sau (luôn fetch lại `past_days` ngày
+  từ 0h) lấy các giờ trước đầu batch từ đó để trung bình trượt liền mạch.
+- Giờ không có đủ lịch sử cho cửa sổ trượt (đầu chuỗi dữ liệu của trạm) -> chỉ số dùng cửa sổ đó = NaN,
+  để dòng đã có giá trị đầy đủ không bị ghi đè bởi giá trị tính trên nửa cửa sổ.
+- Kết quả được thêm thành cột: aqi_vn, aqi_us, aqi_vn_main, aqi_us_main, aqi_vn_<chất>, aqi_us_<chất>.
+
+Breakpoint:
+- VN_AQI: QĐ 1459/QĐ-TCMT (2019), nồng độ µg/m³; PM dùng TB 24h, O3 lấy max(1h, 8h), CO/NO2/SO2 dùng 1h.
+- US EPA: bảng 2024; PM TB 24h, O3/CO TB 8h, NO2/SO2 1h; khí đổi từ µg/m³ sang ppb/ppm ở 25°C.
+"""
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+from timestamps import parse_timestamps
+
+
+logger = logging.getLogger("aqi")
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+AQI_STATE_PATH = os.path.join(BASE_DIR, "aqi_trailing_window.csv")
+
+# chất -> cột nồng độ (µg/m³) trong dữ liệu Open-Meteo CAMS
+POLLUTANT_COLUMNS = {
+    "pm2_5": "pm2_5_cams",
+    "pm10": "pm10_cams",
+    "o3": "ozone_cams",
+    "no2": "nitrogen_dioxide_cams",
+    "so2": "sulphur_dioxide_cams",
+    "co": "carbon_monoxide_cams",
+}
+POLLUTANTS = list(POLLUTANT_COLUMNS)
+# Số giờ nồng độ thô giữ lại giữa các lần chạy: phải phủ được đầu batch sau
+# (past_days tối đa 7 ngày của ETL) cộng thêm cửa sổ 24h
+STATE_HOURS = 10 * 24
+
+# Khối lượng mol (g/mol) để đổi µg/m³ -> ppb: ppb = µg/m³ * 24.45 / M
+MOLAR_MASS = {"o3": 48.00, "no2": 46.01, "so2": 64.07, "co": 28.01}
+
+# --- VN_AQI: nồng độ tại các mức I = 0, 50, 100, 150, 200, 300, 400, 500 ---
+VN_INDEX = np.array([0, 50, 100, 150, 200, 300, 400, 500], dtype=float)
+VN_BREAKPOINTS = {
+    "o3_1h": [0, 160, 200, 300, 400, 800, 1000, 1200],
+    "o3_8h": [0, 100, 120, 170, 210, 400],
+    "no2": [0, 100, 200, 700, 1200, 2350, 3100, 3850],
+    "so2": [0, 125, 350, 550, 800, 1600, 2100, 2630],
+    "co": [0, 10000, 30000, 45000, 60000, 90000, 120000, 150000],
+    "pm10": [0, 50, 150, 250, 350, 420, 500, 600],
+    "pm2_5": [0, 25, 50, 80, 150, 250, 350, 500],
+}
+
+# --- US EPA: (C_lo, C_hi) cho các mức I = 0-50, 51-100, 101-150, 151-200, 201-300, 301-500 ---
+US_INDEX_LO = np.array([0, 51, 101, 151, 201, 301], dtype=float)
+US_INDEX_HI = np.array([50, 100, 150, 200, 300, 500], dtype=float)
+US_BREAKPOINTS = {
+    "pm2_5": ([0.0, 9.1, 35.5, 55.5, 125.5, 225.5], [9.0, 35.4, 55.4, 125.4, 225.4, 325.4]),   # µg/m³, 24h
+    "pm10": ([0, 55, 155, 255, 355, 425], [54, 154, 254, 354, 424, 604]),                       # µg/m³, 24h
+    "o3": ([0.0, 0.055, 0.071, 0.086, 0.106], [0.054, 0.070, 0.085, 0.105, 0.200]),           # ppm, 8h
+    "co": ([0.0, 4.5, 9.5, 12.5, 15.5, 30.5], [4.4, 9.4, 12.4, 15.4, 30.4, 50.4]),             # ppm, 8h
+    "so2": ([0, 36, 76, 186, 305, 605], [35, 75, 185, 304, 604, 1004]),                         # ppb, 1h
+    "no2": ([0, 54, 101, 361, 650, 1250], [53, 100, 360, 649, 1249, 2049]),                     # ppb, 1h
+}
+# Số chữ số thập phân EPA dùng để cắt (truncate) nồng độ trước khi tra bảng
+US_DECIMALS = {"pm2_5": 1, "pm10": 0, "o3": 3, "co": 1, "so2": 0, "no2": 0}
+
+
+# --- TRA BẢNG BREAKPOINT ---
+
+def _interpolate(conc: np.ndarray, c_lo: np.ndarray, c_hi: np.ndarray, i_lo: np.ndarray, i_hi: np.ndarray) -> np.ndarray:
+    """I = (I_hi - I_lo) / (C_hi - C_lo) * (C - C_lo) + I_lo, đoạn được chọn bằng searchsorted trên C_lo."""
+    idx = np.clip(np.searchsorted(c_lo, conc, side="right") - 1, 0, len(c_lo) - 1)
+    out = i_lo[idx] + (i_hi[idx] - i_lo[idx]) / (c_hi[idx] - c_lo[idx]) * (conc - c_lo[idx])
+    # Vượt breakpoint cao nhất -> lấy mức cao nhất của bảng
+    out = np.where(conc > c_hi[-1], i_hi[-1], out)
+    return np.where(np.isnan(conc) | (conc < 0), np.nan, out)
+
+
+def vn_sub_index(conc, key: str) -> np.ndarray:
+    bp = np.asarray(VN_BREAKPOINTS[key], dtype=float)
+    index = VN_INDEX[:len(bp)]
+    return _interpolate(np.asarray(conc, dtype=float), bp[:-1], bp[1:], index[:-1], index[1:])
+
+
+def us_sub_index(conc, key: str) -> np.ndarray:
+    c_lo, c_hi = (np.asarray(a, dtype=float) for a in US_BREAKPOINTS[key])
+    scale = 10.0 ** US_DECIMALS[key]
+    # Cắt bớt chữ số như EPA quy định (cộng epsilon để tránh lỗi làm tròn số thực, vd 0.07 * 1000 = 69.999...)
+    conc = np.floor(np.asarray(conc, dtype=float) * scale + 1e-6) / scale
+    n = len(c_lo)
+    return _interpolate(conc, c_lo, c_hi, US_INDEX_LO[:n], US_INDEX_HI[:n])
+
+
+# --- TRUNG BÌNH TRƯỢT THEO TRẠM ---
+
+def _rolling_mean(work: pd.DataFrame, cols: list, hours: int, min_periods: int) -> np.ndarray:
+    """
+    Trung bình trượt theo thời gian `hours` giờ cho từng location_id.
+    `work` phải được sắp theo (location_id, datetime) để thứ tự kết quả khớp với thứ tự dòng.
+    """
+    rolled = (
+        work.set_index("datetime")
+        .groupby("location_id", sort=False)[cols]
+        .rolling(f"{hours}h", min_periods=min_periods)
+        .mean()
+    )
+    return rolled.to_numpy(dtype=float, copy=True)
+
+
+def _dominant(sub: np.ndarray, names: list) -> tuple[np.ndarray, np.ndarray]:
+    """AQI tổng = max các chỉ số phụ; trả thêm tên chất chi phối (None nếu không có chỉ số nào)."""
+    filled = np.where(np.isnan(sub), -1.0, sub)
+    idx = filled.argmax(axis=1)
+    overall = filled[np.arange(len(sub)), idx]
+    has_value = overall >= 0
+    main = np.where(has_value, np.asarray(names, dtype=object)[idx], None)
+    return np.where(has_value, np.round(overall), np.nan), main
+
+
+def aqi_columns() -> list:
+    cols = ["aqi_vn", "aqi_vn_main", "aqi_us", "aqi_us_main"]
+    cols += [f"aqi_vn_{p}" for p in POLLUTANTS] + [f"aqi_us_{p}" for p in POLLUTANTS]
+    return cols
+
+
+def compute_aqi_frame(work: pd.DataFrame) -> pd.DataFrame:
+    """
+    Tính toàn bộ cột AQI cho `work` (đã sắp theo location_id, datetime).
+    Trả về DataFrame các cột AQI, cùng thứ tự dòng với `work`.
+    """
+    conc = {p: work[c].to_numpy(dtype=float) for p, c in POLLUTANT_COLUMNS.items()}
+    mean24 = _rolling_mean(work, [POLLUTANT_COLUMNS["pm2_5"], POLLUTANT_COLUMNS["pm10"]], 24, 18)
+    mean8 = _rolling_mean(work, [POLLUTANT_COLUMNS["o3"], POLLUTANT_COLUMNS["co"]], 8, 6)
+    # Cửa sổ bắt đầu trước giờ đầu tiên có dữ liệu của trạm -> chưa đủ lịch sử, bỏ giá trị
+    history = (work["datetime"] - work.groupby("location_id")["datetime"].transform("min")).to_numpy()
+    mean24[history < np.timedelta64(23, "h")] = np.nan
+    mean8[history < np.timedelta64(7, "h")] = np.nan
+    pm25_24h, pm10_24h = mean24[:, 0], mean24[:, 1]
+    o3_8h, co_8h = mean8[:, 0], mean8[:, 1]
+
+    vn = {
+        "pm2_5": vn_sub_index(pm25_24h, "pm2_5"),
+        "pm10": vn_sub_index(pm10_24h, "pm10"),
+        # O3: lấy max của chỉ số 1h và 8h (bảng 8h chỉ định nghĩa tới mức 300)
+        "o3": np.fmax(vn_sub_index(conc["o3"], "o3_1h"), vn_sub_index(o3_8h, "o3_8h")),
+        "no2": vn_sub_index(conc["no2"], "no2"),
+        "so2": vn_sub_index(conc["so2"], "so2"),
+        "co": vn_sub_index(conc["co"], "co"),
+    }
+    us = {
+        "pm2_5": us_sub_index(pm25_24h, "pm2_5"),
+        "pm10": us_sub_index(pm10_24h, "pm10"),
+        "o3": us_sub_index(o3_8h * 24.45 / MOLAR_MASS["o3"] / 1000, "o3"),
+        "co": us_sub_index(co_8h * 24.45 / MOLAR_MASS["co"] / 1000, "co"),
+        "so2": us_sub_index(conc["so2"] * 24.45 / MOLAR_MASS["so2"], "so2"),
+        "no2": us_sub_index(conc["no2"] * 24.45 / MOLAR_MASS["no2"], "no2"),
+    }
+
+    out = {}
+    out["aqi_vn"], out["aqi_vn_main"] = _dominant(np.column_stack([vn[p] for p in POLLUTANTS]), POLLUTANTS)
+    out["aqi_us"], out["aqi_us_main"] = _dominant(np.column_stack([us[p] for p in POLLUTANTS]), POLLUTANTS)
+    for p in POLLUTANTS:
+        out[f"aqi_vn_{p}"] = np.round(vn[p])
+    for p in POLLUTANTS:
+        out[f"aqi_us_{p}"] = np.round(us[p])
+    return pd.DataFrame(out, index=work.index)[aqi_columns()]
+
+
+# --- CỬA SỔ CUỐI GIỮA CÁC LẦN CHẠY ---
+
+def _load_trailing_window(state_path: str) -> pd.DataFrame | None:
+    if not state_path or not os.path.exists(state_path):
+        return None
+    state = pd.read_csv(state_path)
+    state["datetime"] = parse_timestamps(state["datetime"], naive_tz="Asia/Bangkok", tz="Asia/Bangkok")
+    return state
+
+
+def _save_trailing_window(state: pd.DataFrame | None, batch: pd.DataFrame, state_path: str):
+    """
+    Gộp state cũ với batch (batch thắng khi trùng giờ), giữ STATE_HOURS giờ cuối của từng trạm
+    (trạm không có trong batch giữ nguyên state) rồi lưu cho lần chạy sau.
+    """
+    cols = ["location_id", "datetime", *POLLUTANT_COLUMNS.values()]
+    merged = pd.concat([state[cols], batch[cols]], ignore_index=True) if state is not None else batch[cols].copy()
+    merged["datetime"] = pd.to_datetime(merged["datetime"], utc=True)
+    merged = merged.drop_duplicates(["location_id", "datetime"], keep="last")
+    last = merged.groupby("location_id")["datetime"].transform("max")
+    tail = merged[merged["datetime"] > last - pd.Timedelta(hours=STATE_HOURS)]
+    tail.sort_values(["location_id", "datetime"]).to_csv(state_path, index=False)
+
+
+def add_aqi_columns(df: pd.DataFrame, state_path: str | None = AQI_STATE_PATH) -> pd.DataFrame:
+    """
+    Bước transform: thêm các cột AQI vào `df` (giữ nguyên thứ tự dòng và index).
+    Nếu có `state_path`, các giờ trước đầu batch của từng trạm được lấy từ state đã lưu để
+    trung bình trượt 24h/8h không bị đứt ở đầu batch, rồi state được cập nhật.
+    Không có `state_path` (vd. backfill toàn bộ lịch sử): chỉ dùng dữ liệu trong `df`.
+    """
+    if df is None or df.empty:
+        return df
+    missing = [c for c in POLLUTANT_COLUMNS.values() if c not in df.columns]
+    if missing:
+        logger.warning(f" -> Bỏ qua bước tính AQI: thiếu cột {missing}.")
+        return df
+
+    cols = ["location_id", "datetime", *POLLUTANT_COLUMNS.values()]
+    work = df[cols].copy()
+    work["_row"] = np.arange(len(df))
+
+    state = _load_trailing_window(state_path)
+    if state is not None and not state.empty:
+        batch_start = work.groupby("location_id")["datetime"].min()
+        before = state[state["location_id"].isin(batch_start.index)]
+        before = before[before["datetime"] < before["location_id"].map(batch_start)]
+        if not before.empty:
+            before = before[cols].copy()
+            before["_row"] = -1
+            work = pd.concat([before, work], ignore_index=True)
+
+    work = work.sort_values(["location_id", "datetime"], kind="stable").reset_index(drop=True)
+    result = compute_aqi_frame(work)
+
+    # Bỏ các dòng mượn từ cửa sổ cũ, đưa kết quả về đúng thứ tự dòng ban đầu
+    from_batch = work["_row"].to_numpy() >= 0
+    order = np.empty(len(df), dtype=np.int64)
+    order[work["_row"].to_numpy()[from_batch]] = np.flatnonzero(from_batch)
+    result = result.iloc[order].set_axis(df.index)
+
+    if state_path:
+        _save_trailing_window(state, df, state_path)
+
+    out = df.drop(columns=[c for c in aqi_columns() if c in df.columns])
+    out = pd.concat([out, result], axis=1)
+    logger.info(f" -> Đã tính AQI cho {len(df)} dòng (VN_AQI trung vị {np.nanmedian(out['aqi_vn']) if out['aqi_vn'].notna().any() else '-'}).")
+    return out
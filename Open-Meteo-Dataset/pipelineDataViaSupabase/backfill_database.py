@@ -3,15 +3,30 @@
 
 import pandas as pd
 import os
+import sys
 from sqlalchemy import create_engine
 from dotenv import load_dotenv
 import time
 
-def run_backfill(): 
+import profiling
+from rollups import rebuild_rollups
+from timestamps import parse_timestamps
+from aqi import add_aqi_columns
+
+def run_backfill():
     """
     Hàm chính thực hiện toàn bộ quá trình backfill history data
-    Tất cả logic backfill nằm trong hàm này
+    Trả về True nếu nạp dữ liệu thành công, False nếu ghi vào database lỗi.
+    Bước đang đo của --profile luôn được đóng lại, kể cả khi backfill lỗi.
     """
+    try:
+        return _backfill()
+    finally:
+        profiling.end_stage()
+
+
+def _backfill():
+    """Tất cả logic backfill nằm trong hàm này (xem run_backfill)."""
     # bắt đầu bấm giờ để đo thời gian backfill mất bao lâu
     start_time = time.time()
     print("=============================================")
@@ -20,6 +35,7 @@ def run_backfill():
     
     # GIAI ĐOẠN 1. Load biến môi trường từ file .env
     print("\n [Buớc 1/4]: Đang load biến môi trường từ file .env...")
+    profiling.step("Bước 1/4: Load .env")
     load_dotenv() # Load biến môi trường từ file .env
     db_url = os.getenv("DATABASE_URL")
     if not db_url:
@@ -29,6 +45,7 @@ def run_backfill():
     
     # GIAI ĐOẠN 2. Extract & Transform: Đọc và chuẩn bị dữ liệu từ file CSV
     print("\n [Buớc 2/4]: Đang đọc và chuẩn bị dữ liệu từ file CSV...")
+    profiling.step("Bước 2/4: Đọc + chuẩn hoá CSV lịch sử")
     
     historical_csv_file = "../hanoi_aq_weather_MERGED.csv"
     
@@ -39,12 +56,18 @@ def run_backfill():
     print(f" -> Đã đọc thành công {len(df_historical)} dòng dữ liệu từ file CSV.")
     
     # Biến đổi (Transform) nhỏ: chuẩn hóa cột datetime
-    # utc=True rất quan trọng để khớp với kiểu TIMESTAMPTZ của PostgreSQL
-    df_historical['datetime'] = pd.to_datetime(df_historical['datetime'], utc=True)
+    # Quy về UTC rất quan trọng để khớp với kiểu TIMESTAMPTZ của PostgreSQL
+    # parse_timestamps chỉ parse các chuỗi khác nhau (mỗi giờ một lần thay vì một lần cho mỗi trạm)
+    df_historical['datetime'] = parse_timestamps(df_historical['datetime'], naive_tz='UTC', tz='UTC')
     print(" -> Đã chuẩn hóa cột 'datetime'.")
+
+    # Tính AQI trên toàn bộ lịch sử (không dùng state của ETL: file CSV đã liền mạch từ đầu)
+    df_historical = add_aqi_columns(df_historical, state_path=None)
+    print(" -> Đã tính các cột AQI.")
     
     # GIAI ĐOẠN 3: Load dữ liệu vào database Supabase
     print("\n [Buớc 3/4]: Đang kết nối và nạp dữ liệu vào database Supabase...")
+    profiling.step("Bước 3/4: Nạp vào database + dựng lại rollup")
     try:
         engine = create_engine(db_url) # Tạo engine kết nối database
         
@@ -64,14 +87,24 @@ def run_backfill():
         )
         
         print(" -> Tải dữ liệu lên database supabase thành công.")
+
+        # Dữ liệu nạp bằng to_sql không đi qua upsert_data nên phải dựng lại rollup ngày/tháng cho khoảng vừa nạp
+        # (tương đương: python rollups.py rebuild --start ... --end ...)
+        print(" -> Đang dựng lại bảng rollup ngày/tháng cho khoảng thời gian vừa nạp...")
+        days_local = df_historical['datetime'].dt.tz_convert('Asia/Ho_Chi_Minh')
+        start_day = days_local.min().strftime('%Y-%m-%d')
+        end_day = (days_local.max() + pd.Timedelta(days=1)).strftime('%Y-%m-%d')
+        n_buckets = rebuild_rollups(engine, start_day, end_day)
+        print(f" -> Đã dựng lại rollup cho {n_buckets} bucket (trạm x ngày).")
         
     except Exception as e:
         print(f"\n ĐÃ XẢY RA LỖI TRONG QUÁ TRÌNH GHI VÀO DATABASE !!!")
         print(f" Chi tiết lỗi: {e}")
         # Dừng chương trình ngay lập tức nếu có lỗi
-        return # thoát khỏi hàm run_backfill
+        return False # thoát khỏi hàm run_backfill
     
     # GIAI ĐOẠN 4: Hoàn tất
+    profiling.end_stage()  # đóng bước 3/4 trước khi in tổng kết; run_backfill đóng lại lần nữa cũng không sao
     end_time = time.time() # Kết thúc bấm giờ
     duration = end_time - start_time
     
@@ -80,6 +113,7 @@ def run_backfill():
     print("      BACKFILL THÀNH CÔNG!                  ")
     print("=============================================")
     print(f" -> Tổng thời gian thực hiện: {duration:.2f} giây.")
+    return True
 
 # Điểm bắt đầu thực thi của script này
 # Cấu trúc `if __name__ == "__main__":` là một quy ước trong Python.
@@ -87,5 +121,6 @@ def run_backfill():
 # Điều này ngăn không cho code tự chạy nếu nó được import bởi một file khác.
 
 if __name__ == "__main__":
-    run_backfill() # Goi hàm chính để thực thi backfill
-    print("Hoàn tất quá trình backfill dữ liệu lịch sử vào database Supabase.")
\ No newline at end of file
+    ok = run_backfill() # Goi hàm chính để thực thi backfill
+    print("Hoàn tất quá trình backfill dữ liệu lịch sử vào database Supabase." if ok else "Backfill THẤT BẠI.")
+    sys.exit(0 if ok else 1)
\ No newline at end of file
@@ -0,0 +1,170 @@
+"""
+ĐIỂM CHẠY CHUNG CHO CÁC JOB CỦA PIPELINE
+    python cli.py fetch [--days 5]     # Open-Meteo -> file CSV           (csv_etl_realtime.py)
+    python cli.py upsert [--days 7]    # Open-Meteo -> Supabase           (etl_realtime.py)
+    python cli.py sync [--days 7]      # fetch một lần, ghi cả Supabase + CSV (etl_sync.py)
+    python cli.py sync --forecast-versions [--forecast-days 3]   # + kho dự báo theo phiên bản
+    python cli.py backfill             # nạp CSV lịch sử vào Supabase     (backfill_database.py)
+    python cli.py merge                # ghép AQ + weather + toạ độ       (../combineData.py)
+    python cli.py --import-profile sync   # chỉ đo thời gian import của lệnh, không chạy job
+    python cli.py --profile merge         # chạy job, đo CPU/bộ nhớ từng bước -> profiles/<thời điểm>/
+    python cli.py --profile --profile-dir /tmp/prof sync
+
+File này chỉ import thư viện chuẩn ở đầu module: pandas, SQLAlchemy, openmeteo_requests, requests,
+dotenv... được import bên trong từng lệnh, và logging chỉ được cấu hình khi lệnh thực sự chạy,
+nên `--help` hay lệnh sai cú pháp trả về ngay trên các runner cron/serverless nhỏ.
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATASET_DIR = os.path.dirname(BASE_DIR)
+
+# lệnh -> (module chứa job, thư mục chạy job)
+COMMAND_MODULES = {
+    "fetch": ("csv_etl_realtime", BASE_DIR),
+    "upsert": ("etl_realtime", BASE_DIR),
+    "sync": ("etl_sync", BASE_DIR),
+    # backfill_database.py đọc '../hanoi_aq_weather_MERGED.csv' tương đối so với thư mục này
+    "backfill": ("backfill_database", BASE_DIR),
+    # combineData.py đọc/ghi các file CSV tương đối so với Open-Meteo-Dataset/
+    "merge": ("combineData", DATASET_DIR),
+}
+
+
+# --- CÁC LỆNH (import nặng nằm bên trong từng hàm) ---
+
+def cmd_fetch(args) -> int:
+    import csv_etl_realtime
+    csv_etl_realtime.setup_logging()
+    rows = csv_etl_realtime.run_etl_to_csv(args.days if args.days is not None else csv_etl_realtime.NUM_PAST_DAYS)
+    return 0 if rows is not None else 1
+
+
+def cmd_upsert(args) -> int:
+    import etl_realtime
+    etl_realtime.setup_logging()
+    rows = etl_realtime.run_realtime_etl(args.days if args.days is not None else etl_realtime.NUM_PAST_DAYS)
+    return 0 if rows is not None else 1
+
+
+def cmd_sync(args) -> int:
+    import etl_sync
+    etl_sync.setup_logging()
+    ok = etl_sync.run_sync_etl(args.days if args.days is not None else etl_sync.NUM_PAST_DAYS,
+                               forecast_versions=args.forecast_versions,
+                               forecast_days=args.forecast_days if args.forecast_days is not None else etl_sync.FORECAST_DAYS)
+    return 0 if ok else 1
+
+
+def cmd_backfill(args) -> int:
+    import backfill_database
+    ok = backfill_database.run_backfill()
+    return 0 if ok else 1
+
+
+def cmd_merge(args) -> int:
+    if DATASET_DIR not in sys.path:
+        sys.path.insert(0, DATASET_DIR)
+    import combineData
+    combineData.main()
+    return 0
+
+
+COMMANDS = {
+    "fetch": (cmd_fetch, "Lấy dữ liệu gần đây từ Open-Meteo và nối vào file CSV"),
+    "upsert": (cmd_upsert, "Lấy dữ liệu gần đây từ Open-Meteo và upsert vào Supabase"),
+    "sync": (cmd_sync, "Fetch một lần, ghi song song vào Supabase và CSV"),
+    "backfill": (cmd_backfill, "Nạp file CSV lịch sử đã merge vào Supabase (chạy một lần)"),
+    "merge": (cmd_merge, "Ghép dữ liệu Air Quality + Weather + toạ độ trạm thành một file"),
+}
+
+
+# --- ĐO THỜI GIAN IMPORT ---
+
+def parse_importtime(stderr: str) -> list[tuple[int, int, str]]:
+    """Đọc output của `python -X importtime`: trả về [(self_us, cumulative_us, tên module có thụt lề)]."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        rows.append((int(self_us), int(cumulative_us), name.rstrip()))
+    return rows
+
+
+def import_profile(command: str, top: int = 20) -> list[tuple[int, int, str]]:
+    """
+    Import module của lệnh trong một tiến trình Python mới với `-X importtime`
+    (giống một lần cold start), in tổng thời gian và `top` module tốn thời gian nhất (cộng dồn).
+    """
+    module, workdir = COMMAND_MODULES[command]
+    code = f"import sys; sys.path[:0] = [{BASE_DIR!r}, {workdir!r}]; import cli; import {module}"
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                          cwd=workdir, capture_output=True, text=True)
+    if proc.returncode != 0:
+        print(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "import thất bại", file=sys.stderr)
+        return []
+
+    rows = parse_importtime(proc.stderr)
+    # Các module cấp cao nhất (không thụt lề) cộng lại = tổng thời gian import
+    total_us = sum(cum for _, cum, name in rows if not name.startswith(" " * 2))
+    own = next((cum for _, cum, name in rows if name.strip() == "cli"), 0)
+    job = next((cum for _, cum, name in rows if name.strip() == module), 0)
+
+    print(f"Import profile cho lệnh '{command}' (module {module}):")
+    print(f"  - Tổng thời gian import: {total_us / 1000:.1f} ms ({len(rows)} module)")
+    print(f"  - cli.py: {own / 1000:.1f} ms | {module}: {job / 1000:.1f} ms")
+    print(f"  - {top} module tốn thời gian nhất (cộng dồn, ms):")
+    for self_us, cumulative_us, name in sorted(rows, key=lambda r: r[1], reverse=True)[:top]:
+        print(f"      {cumulative_us / 1000:9.1f}  (tự thân {self_us / 1000:7.1f})  {name.strip()}")
+    return rows
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Chạy các job của pipeline chất lượng không khí Hà Nội.")
+    parser.add_argument("--import-profile", action="store_true",
+                        help="Chỉ đo và in thời gian import của lệnh (không chạy job)")
+    parser.add_argument("--profile", action="store_true",
+                        help="Profile từng bước của job (cProfile + tracemalloc)")
+    parser.add_argument("--profile-dir", metavar="DIR",
+                        help="Thư mục ghi báo cáo profile (mặc định profiles/<thời điểm>/)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    for name, (_, help_text) in COMMANDS.items():
+        p = sub.add_parser(name, help=help_text)
+        if name in ("fetch", "upsert", "sync"):
+            p.add_argument("--days", type=int, help="Số ngày quá khứ cần lấy (mặc định theo từng job)")
+        if name == "sync":
+            p.add_argument("--forecast-versions", action="store_true",
+                           help="Ghi thêm các giờ dự báo vào kho theo phiên bản (databaseForecastVersions.sql)")
+            p.add_argument("--forecast-days", type=int, help="Số ngày dự báo lấy về khi bật --forecast-versions")
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    if args.import_profile:
+        return 0 if import_profile(args.command) else 1
+
+    profiling = None
+    if args.profile:
+        import profiling
+        # Đường dẫn tương đối tính theo thư mục gọi lệnh, trước khi chdir sang thư mục của job
+        profiling.enable(os.path.abspath(args.profile_dir) if args.profile_dir else None)
+
+    _, workdir = COMMAND_MODULES[args.command]
+    os.chdir(workdir)
+    handler, _ = COMMANDS[args.command]
+    try:
+        return handler(args)
+    finally:
+        if profiling is not None:
+            report_path = profiling.finish()
+            print(f"Báo cáo profile: {report_path} (kèm stage_XX.prof và stacks.collapsed)")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -27,6 +27,24 @@ CREATE TABLE public.air_quality_forecast_data (
     sulphur_dioxide_cams REAL,
     ozone_cams REAL,
 
+    -- Chỉ số AQI tính ở bước transform (aqi.py): tổng, chất chi phối và chỉ số phụ từng chất
+    aqi_vn REAL,
+    aqi_vn_main TEXT,
+    aqi_us REAL,
+    aqi_us_main TEXT,
+    aqi_vn_pm2_5 REAL,
+    aqi_vn_pm10 REAL,
+    aqi_vn_o3 REAL,
+    aqi_vn_no2 REAL,
+    aqi_vn_so2 REAL,
+    aqi_vn_co REAL,
+    aqi_us_pm2_5 REAL,
+    aqi_us_pm10 REAL,
+    aqi_us_o3 REAL,
+    aqi_us_no2 REAL,
+    aqi_us_so2 REAL,
+    aqi_us_co REAL,
+
     -- Toạ độ (mới thêm)
     lat DOUBLE PRECISION,
     lon DOUBLE PRECISION,
@@ -37,3 +55,5 @@ CREATE TABLE public.air_quality_forecast_data (
 
 COMMENT ON TABLE public.air_quality_forecast_data IS 
 'Bảng tổng hợp dữ liệu khí tượng + chất lượng không khí (Open-Meteo) cho các địa điểm tại Hà Nội, bao gồm toạ độ lat/lon.';
+
+-- Nâng cấp bảng đã có dữ liệu (không xoá bảng): chạy databaseAqiColumns.sql
@@ -0,0 +1,19 @@
+-- Nâng cấp bảng air_quality_forecast_data đã có dữ liệu (KHÔNG xoá bảng): thêm các cột AQI do aqi.py tính.
+-- Chạy được nhiều lần (IF NOT EXISTS). Các dòng cũ có AQI sau khi backfill lại hoặc ETL lấp cột NULL.
+ALTER TABLE public.air_quality_forecast_data
+    ADD COLUMN IF NOT EXISTS aqi_vn REAL,
+    ADD COLUMN IF NOT EXISTS aqi_vn_main TEXT,
+    ADD COLUMN IF NOT EXISTS aqi_us REAL,
+    ADD COLUMN IF NOT EXISTS aqi_us_main TEXT,
+    ADD COLUMN IF NOT EXISTS aqi_vn_pm2_5 REAL,
+    ADD COLUMN IF NOT EXISTS aqi_vn_pm10 REAL,
+    ADD COLUMN IF NOT EXISTS aqi_vn_o3 REAL,
+    ADD COLUMN IF NOT EXISTS aqi_vn_no2 REAL,
+    ADD COLUMN IF NOT EXISTS aqi_vn_so2 REAL,
+    ADD COLUMN IF NOT EXISTS aqi_vn_co REAL,
+    ADD COLUMN IF NOT EXISTS aqi_us_pm2_5 REAL,
+    ADD COLUMN IF NOT EXISTS aqi_us_pm10 REAL,
+    ADD COLUMN IF NOT EXISTS aqi_us_o3 REAL,
+    ADD COLUMN IF NOT EXISTS aqi_us_no2 REAL,
+    ADD COLUMN IF NOT EXISTS aqi_us_so2 REAL,
+    ADD COLUMN IF NOT EXISTS aqi_us_co REAL;
@@ -0,0 +1,38 @@
+-- Kho dự báo theo phiên bản (tuỳ chọn, ghi bởi ForecastVersionSink / forecast_versions.py)
+-- Mỗi giá trị được ghi kèm issued_at (giờ UTC của lần fetch) và CHỈ khi khác phiên bản mới nhất
+-- của cùng (location_id, variable, datetime) -> các lần chạy không đổi không tốn thêm dòng.
+
+-- Bước 1: Toàn bộ các phiên bản
+CREATE TABLE IF NOT EXISTS public.air_quality_forecast_versions (
+    location_id BIGINT NOT NULL,
+    -- tên cột trong air_quality_forecast_data, vd. pm2_5_cams, temperature_2m
+    variable TEXT NOT NULL,
+    datetime TIMESTAMPTZ NOT NULL,     -- giờ được dự báo
+    issued_at TIMESTAMPTZ NOT NULL,    -- thời điểm phát hành (lần fetch)
+    value REAL NOT NULL,
+
+    -- Truy vấn "giá trị tại thời điểm T" (forecast_versions.values_as_of) dùng DISTINCT ON với
+    -- ORDER BY location_id DESC, variable DESC, datetime DESC, issued_at DESC: quét ngược khoá này, không sort.
+    -- Truy vấn luôn lọc theo location_id (bắt buộc) để chỉ đọc một khoảng của index.
+    CONSTRAINT air_quality_forecast_versions_pkey PRIMARY KEY (location_id, variable, datetime, issued_at)
+);
+
+-- Bước 2: Phiên bản mới nhất của mỗi khoá (tra cứu "latest" và so sánh khi mã hoá delta)
+CREATE TABLE IF NOT EXISTS public.air_quality_forecast_latest (
+    location_id BIGINT NOT NULL,
+    variable TEXT NOT NULL,
+    datetime TIMESTAMPTZ NOT NULL,
+    issued_at TIMESTAMPTZ NOT NULL,
+    value REAL NOT NULL,
+    n_versions INTEGER NOT NULL,       -- số phiên bản khác nhau đã ghi cho khoá này
+
+    CONSTRAINT air_quality_forecast_latest_pkey PRIMARY KEY (location_id, variable, datetime)
+);
+
+-- Xem lại toàn bộ một lần phát hành (vd. đánh giá skill theo lead time)
+CREATE INDEX IF NOT EXISTS air_quality_forecast_versions_issued_idx ON public.air_quality_forecast_versions (issued_at);
+
+COMMENT ON TABLE public.air_quality_forecast_versions IS
+'Các phiên bản dự báo theo thời điểm phát hành, chỉ lưu khi giá trị thay đổi so với phiên bản trước.';
+COMMENT ON TABLE public.air_quality_forecast_latest IS
+'Giá trị dự báo mới nhất của mỗi (location_id, variable, datetime).';
@@ -0,0 +1,45 @@
+-- Bảng tổng hợp (rollup) theo ngày / tháng cho từng trạm và từng chất ô nhiễm
+-- Được ETL cập nhật tăng dần sau mỗi lần upsert (chỉ tính lại các ngày/tháng bị chạm tới),
+-- dựng lại toàn bộ bằng: python rollups.py rebuild [--start YYYY-MM-DD] [--end YYYY-MM-DD]
+-- Ngày/tháng tính theo giờ Việt Nam (Asia/Ho_Chi_Minh).
+
+-- Bước 1: Rollup theo ngày
+CREATE TABLE IF NOT EXISTS public.air_quality_daily_rollup (
+    location_id BIGINT NOT NULL,
+    day DATE NOT NULL,
+    -- pm2_5 | pm10 | co | no2 | so2 | o3
+    pollutant TEXT NOT NULL,
+
+    n_hours INTEGER NOT NULL,          -- số giờ có giá trị
+    sum_value DOUBLE PRECISION,        -- tổng (trung bình = sum_value / n_hours)
+    min_value REAL,
+    max_value REAL,
+    n_exceed INTEGER NOT NULL,         -- số giờ vượt ngưỡng (xem EXCEEDANCE_THRESHOLDS trong rollups.py)
+
+    CONSTRAINT air_quality_daily_rollup_pkey PRIMARY KEY (location_id, day, pollutant)
+);
+
+-- Bước 2: Rollup theo tháng (month = ngày đầu tháng), tính lại từ rollup ngày
+CREATE TABLE IF NOT EXISTS public.air_quality_monthly_rollup (
+    location_id BIGINT NOT NULL,
+    month DATE NOT NULL,
+    pollutant TEXT NOT NULL,
+
+    n_days INTEGER NOT NULL,
+    n_hours INTEGER NOT NULL,
+    sum_value DOUBLE PRECISION,
+    min_value REAL,
+    max_value REAL,
+    n_exceed INTEGER NOT NULL,
+
+    CONSTRAINT air_quality_monthly_rollup_pkey PRIMARY KEY (location_id, month, pollutant)
+);
+
+-- Truy vấn theo khoảng thời gian cho nhiều trạm
+CREATE INDEX IF NOT EXISTS air_quality_daily_rollup_day_idx ON public.air_quality_daily_rollup (day);
+CREATE INDEX IF NOT EXISTS air_quality_monthly_rollup_month_idx ON public.air_quality_monthly_rollup (month);
+
+COMMENT ON TABLE public.air_quality_daily_rollup IS
+'Tổng hợp theo ngày (giờ VN) của air_quality_forecast_data: count/sum/min/max/số giờ vượt ngưỡng cho từng trạm và chất ô nhiễm.';
+COMMENT ON TABLE public.air_quality_monthly_rollup IS
+'Tổng hợp theo tháng, tính từ air_quality_daily_rollup.';
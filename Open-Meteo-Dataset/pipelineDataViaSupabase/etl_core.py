@@ -0,0 +1,633 @@
+"""
+LÕI ETL DÙNG CHUNG: FETCH MỘT LẦN, GHI RA NHIỀU ĐÍCH (SINK)
+- fetch_recent_data: gọi Open-Meteo (weather + air quality) cho toàn bộ trạm.
+- Sink: giao diện ghi dữ liệu (Postgres upsert, CSV, ...).
+- run_sinks: đưa cùng một DataFrame cho tất cả sink chạy song song,
+  mỗi sink có kết quả thành công/thất bại riêng.
+"""
+import logging
+import os
+import random
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timezone, timedelta
+
+import pandas as pd
+import openmeteo_requests
+from sqlalchemy import create_engine, text
+from dotenv import load_dotenv
+
+import profiling
+from adaptive_client import AdaptiveSession
+from aqi import AQI_STATE_PATH, add_aqi_columns
+from forecast_versions import write_versions
+from response_decoder import HourlyBlock, past_days_window
+from retry_queue import RetryQueue, RETRY_QUEUE_PATH
+from rollups import SOURCE_TABLE as ROLLUP_SOURCE_TABLE, refresh_rollups
+from timestamps import parse_timestamps
+
+
+logger = logging.getLogger("etl_core")
+
+
+def configure_logging(log_file_path: str, force: bool = False, fmt: str = "%(asctime)s [%(levelname)s] %(message)s"):
+    """Ghi log ra file + console. Gọi khi chạy job (không gọi lúc import module)."""
+    logging.basicConfig(
+        level=logging.INFO,
+        format=fmt,
+        handlers=[
+            logging.FileHandler(log_file_path, encoding="utf-8"),
+            logging.StreamHandler()
+        ],
+        force=force,
+    )
+
+
+# --- Hằng số toàn cục ---
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+METADATA_FILE_PATH = os.path.join(BASE_DIR, "../stations_metadata.csv")
+DB_TABLE_NAME = "air_quality_forecast_data"
+OUTPUT_CSV_FILE = os.path.join(BASE_DIR, "hanoi_realtime_data_updated.csv")
+VN_TZ = timezone(timedelta(hours=7))
+
+# OPENMETEO_BASE_URL (vd. http://127.0.0.1:8080 của mock_api_server.py) thay host cho cả hai API.
+# Đọc .env trước khi tính URL để giá trị đặt trong .env (như .env.example hướng dẫn) có hiệu lực
+load_dotenv()
+OPENMETEO_BASE_URL = os.getenv("OPENMETEO_BASE_URL", "").rstrip("/")
+WEATHER_URL = f"{OPENMETEO_BASE_URL or 'https://api.open-meteo.com'}/v1/forecast"
+AQ_URL = f"{OPENMETEO_BASE_URL or 'https://air-quality-api.open-meteo.com'}/v1/air-quality"
+WEATHER_VARIABLES = [
+    "temperature_2m", "relative_humidity_2m", "precipitation", "rain",
+    "wind_speed_10m", "wind_direction_10m", "pressure_msl", "boundary_layer_height"
+]
+AQ_VARIABLES = ["pm10", "pm2_5", "carbon_monoxide", "nitrogen_dioxide", "sulphur_dioxide", "ozone"]
+AQ_COLUMNS = [f"{v}_cams" for v in AQ_VARIABLES]
+
+# api -> (url, biến request, tên cột lưu, nhãn log)
+APIS = {
+    "weather": (WEATHER_URL, WEATHER_VARIABLES, WEATHER_VARIABLES, "THỜI TIẾT"),
+    "air_quality": (AQ_URL, AQ_VARIABLES, AQ_COLUMNS, "CHẤT LƯỢNG KHÔNG KHÍ"),
+}
+VALUE_COLUMNS = WEATHER_VARIABLES + AQ_COLUMNS
+
+
+# --- EXTRACT ---
+
+def read_metadata(metadata_path: str = METADATA_FILE_PATH) -> pd.DataFrame:
+    """Đọc file metadata các trạm (location_id, lat, lon, ...)."""
+    if not os.path.exists(metadata_path):
+        raise FileNotFoundError(f"Lỗi: Không tìm thấy file metadata '{metadata_path}'.")
+    return pd.read_csv(metadata_path)
+
+
+def _fetch_into_block(openmeteo, api: str, block: HourlyBlock, station_idx: int, lat, lon, time_params: dict) -> int:
+    """Gọi một API cho một trạm và ghi thẳng kết quả vào block. Trả về số bước giờ đã ghi."""
+    url, variables, columns, _ = APIS[api]
+    params = {
+        "latitude": lat, "longitude": lon,
+        "hourly": variables,
+        "timezone": "Asia/Bangkok",
+        **time_params
+    }
+    response = openmeteo.weather_api(url, params=params)[0]
+    return block.write(station_idx, response.Hourly(), columns)
+
+
+def _local_hour(epoch: int) -> str:
+    """Epoch giây -> chuỗi 'YYYY-MM-DDTHH:MM' theo giờ VN (định dạng start_hour/end_hour của Open-Meteo)."""
+    return datetime.fromtimestamp(epoch, tz=VN_TZ).strftime("%Y-%m-%dT%H:%M")
+
+
+def drain_retry_queue(openmeteo, queue: RetryQueue, window_start: int) -> list[pd.DataFrame]:
+    """
+    Gọi lại các (trạm, api, cửa sổ) đã thất bại ở các lần chạy trước và đã đến hạn retry.
+    Chỉ xử lý phần cửa sổ đã trôi ra khỏi cửa sổ `past_days` hiện tại: `end` được cắt về
+    `window_start`, phần còn lại do lần fetch chính lấy lại (nên các frame trả về không trùng khoá
+    với cửa sổ hiện tại).
+    Các entry cùng trạm + cùng cửa sổ được ghi chung vào một block nhỏ.
+    """
+    due = [e for e in queue.due() if e["start"] < window_start]
+    if not due:
+        return []
+    logger.info(f"  -> Đang xử lý {len(due)} entry trong hàng đợi retry...")
+
+    groups = {}
+    for entry in due:
+        end = min(entry["end"], window_start)
+        groups.setdefault((entry["location_id"], entry["start"], end), []).append(entry)
+
+    frames = []
+    for (loc_id, start, end), entries in groups.items():
+        lat, lon = entries[0]["lat"], entries[0]["lon"]
+        block = HourlyBlock([loc_id], [lat], [lon], VALUE_COLUMNS, start, (end - start) // 3600)
+        time_params = {"start_hour": _local_hour(start), "end_hour": _local_hour(end - 3600)}
+        for entry in entries:
+            try:
+                _fetch_into_block(openmeteo, entry["api"], block, 0, lat, lon, time_params)
+                queue.resolve(loc_id, entry["api"], start)
+                logger.info(f"     - Retry thành công: trạm {loc_id}, {entry['api']}, từ {_local_hour(start)} đến {_local_hour(end)}.")
+            except Exception as e:
+                queue.add_failure(loc_id, entry["api"], start, end, e)
+                logger.warning(f"     - Retry thất bại (lần {entry['attempts']}): trạm {loc_id}, {entry['api']}: {e}")
+        if block.filled.any():
+            frames.append(block.to_frame(tz="Asia/Bangkok"))
+
+    if len(frames) > 1:
+        # Cửa sổ của các lần chạy khác nhau có thể chồng lên nhau -> gộp về một dòng cho mỗi khoá
+        combined = pd.concat(frames, ignore_index=True)
+        frames = [combined.groupby(['location_id', 'datetime'], sort=False, as_index=False).first()[combined.columns]]
+    return frames
+
+
+def _fetch_station(openmeteo, block: HourlyBlock, station_idx: int, queue: RetryQueue,
+                   time_params: dict, window_end: int, failed_end: int) -> bool:
+    """
+    Gọi cả hai API cho một trạm, ghi kết quả vào block và cập nhật hàng đợi retry.
+    Một API lỗi không chặn API còn lại. Trả về True nếu lấy được ít nhất một loại dữ liệu.
+    """
+    loc_id, lat, lon = block.location_ids[station_idx], block.lats[station_idx], block.lons[station_idx]
+    logger.info(f"  -> Đang xử lý vị trí trạm ID: {loc_id} cho {time_params['past_days']} ngày qua...")
+    n_written = {}
+
+    # === 1. THỜI TIẾT (WEATHER FORECAST) + 2. CHẤT LƯỢNG KHÔNG KHÍ (AIR QUALITY) ===
+    for api, (_, _, _, label) in APIS.items():
+        try:
+            n_written[api] = _fetch_into_block(openmeteo, api, block, station_idx, lat, lon, time_params)
+            queue.resolve_covered(loc_id, api, block.start, window_end)
+            logger.info(f"   - Trạm {loc_id}: lấy dữ liệu {label.lower()} thành công.")
+        except Exception as e:
+            logger.warning(f"  - Cảnh báo: Lỗi khi lấy dữ liệu {label} cho trạm {loc_id}: {e}")
+            queue.add_failure(loc_id, api, block.start, failed_end, e, lat=float(lat), lon=float(lon))
+
+    if any(n_written.values()):
+        logger.info(f"    -> Thành công. Đã xử lý trạm {loc_id} ({max(n_written.values())} dòng).")
+        return True
+    logger.warning(f"    -> Thất bại: Không lấy được cả hai loại dữ liệu cho trạm {loc_id}.")
+    return False
+
+
+def fetch_recent_data(stations_df: pd.DataFrame, num_past_days: int = 7,
+                      retry_queue_path: str = RETRY_QUEUE_PATH,
+                      session: AdaptiveSession | None = None, max_workers: int = 8,
+                      forecast_days: int = 1, include_forecast: bool = False) -> pd.DataFrame | None:
+    """
+    Gọi API Open-Meteo để lấy dữ liệu `num_past_days` ngày gần nhất.
+    Thực hiện hai lệnh gọi API riêng biệt (weather + air quality), cả hai đều dùng `past_days`.
+    Các trạm được xử lý song song trên `max_workers` thread; số request đồng thời thực tế tới
+    từng host do AdaptiveSession điều chỉnh (AIMD + Retry-After + circuit breaker).
+    Giá trị của mọi trạm được ghi thẳng vào một HourlyBlock cấp phát sẵn (mỗi trạm một vùng dòng riêng),
+    DataFrame (đã xử lý timezone) chỉ được dựng một lần ở cuối.
+    Các lệnh gọi thất bại được ghi vào hàng đợi retry, lần chạy sau sẽ gọi lại trước.
+    Mặc định chỉ trả về các giờ <= hiện tại; `include_forecast` giữ cả các giờ dự báo phía sau.
+    """
+    logger.info("Bắt đầu hàm fetch_recent_data...")
+
+    openmeteo = openmeteo_requests.Client(session=session or AdaptiveSession())
+
+    start, n_steps = past_days_window(num_past_days, forecast_days=forecast_days)
+    block = HourlyBlock(
+        stations_df['location_id'].to_numpy(), stations_df['lat'].to_numpy(), stations_df['lon'].to_numpy(),
+        VALUE_COLUMNS, start, n_steps
+    )
+    now = time.time()
+    window_end = start + n_steps * 3600
+    # Entry retry chỉ cần phủ tới giờ hiện tại, phần dự báo sẽ được lấy ở lần chạy sau
+    failed_end = min(window_end, (int(now) // 3600 + 1) * 3600)
+
+    # === 0. XỬ LÝ HÀNG ĐỢI RETRY TRƯỚC ===
+    queue = RetryQueue(retry_queue_path)
+    repaired_frames = drain_retry_queue(openmeteo, queue, start)
+
+    time_params = {"past_days": num_past_days, "forecast_days": forecast_days}
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="fetch") as pool:
+        futures = [
+            pool.submit(_fetch_station, openmeteo, block, i, queue, time_params, window_end, failed_end)
+            for i in range(len(block.location_ids))
+        ]
+        n_ok_stations = sum(f.result() for f in futures)
+
+    queue.save()
+    if len(queue):
+        logger.info(f"  -> Hàng đợi retry còn {len(queue)} entry ('{retry_queue_path}').")
+
+    if not n_ok_stations and not repaired_frames:
+        logger.info("Không lấy được bất kỳ dữ liệu mới nào từ API.")
+        return None
+
+    # ⚠️ Lọc theo thời gian hiện tại (so sánh epoch nên không phụ thuộc múi giờ)
+    final_df = block.to_frame(tz="Asia/Bangkok", until=None if include_forecast else now)
+    if repaired_frames:
+        # Cửa sổ retry đã được cắt trước cửa sổ hiện tại; vẫn loại khoá trùng (giữ dòng của cửa sổ mới)
+        # vì upsert ON CONFLICT DO UPDATE không chấp nhận hai dòng cùng khoá trong một lệnh
+        final_df = pd.concat([final_df, *repaired_frames], ignore_index=True)
+        final_df = final_df.drop_duplicates(['location_id', 'datetime'], keep='first').reset_index(drop=True)
+        logger.info(f"  -> Đã bổ sung {sum(len(f) for f in repaired_frames)} dòng từ hàng đợi retry.")
+
+    logger.info(f"Hoàn tất fetch_recent_data: {n_ok_stations}/{len(block.location_ids)} trạm, tổng cộng {len(final_df)} dòng được lấy về.")
+    return final_df
+
+
+# --- LOAD: POSTGRES ---
+
+def get_db_engine():
+    """
+    Hàm này đọc chuỗi kết nối từ .env và tạo một SQLAlchemy engine
+    Nhiệm vụ duy nhất của function này là tạo  kết nối.
+    """
+    load_dotenv()
+    db_url = os.getenv("DATABASE_URL")
+    if not db_url:
+        raise ValueError("Lỗi: Không tìm thấy DATABASE_URL trong file .env")
+    logger.info(" Kết nối database được khởi tạo thành công.")
+    # pool_pre_ping giúp phát hiện connection dead và reconnect tự động
+    return create_engine(db_url, pool_pre_ping=True)
+
+
+def retry_execute(conn, query, retries=3, delay_base=1.0):
+    """
+    Thực thi truy vấn sql với cơ chế retry nếu gặp deadlock
+    """
+    last_exception = None
+    for attempt in range(retries):
+        try:
+            conn.execute(text(query))
+            return
+        except Exception as e:
+            last_exception = e
+            msg = str(e).lower()
+            if any(err in msg for err in ["deadlock detected", "could not obtain lock", "serialization failure"]):
+                wait = delay_base * (2 ** attempt) + random.random()
+                logger.warning(f"  Phát hiện Deadlock/lock - retry sau {wait:.1f}s (lần {attempt + 1}/{retries})...")
+                time.sleep(wait)
+            else:
+                logger.error(f"Lỗi SQL không thể retry: {e}")
+                raise
+    raise RuntimeError(f"Quá số lần retry do deadlock/lock. Lỗi cuối cùng: {last_exception}")
+
+
+def upsert_data(engine, df: pd.DataFrame, table_name: str, pipeline_id: str = None, refresh_rollup_tables: bool = False):
+    """
+    Ghi DataFrame vào PostgreSQL một cách nguyên tử (atomic), an toàn và hiệu quả,
+    sử dụng một transaction duy nhất. Tương thích với Supabase.
+    Nếu `refresh_rollup_tables`, các bucket ngày/tháng chứa dòng vừa chèn/cập nhật được tính lại
+    SAU khi COMMIT, trong một transaction riêng (xem rollups.py): lỗi rollup (vd. chưa tạo bảng rollup)
+    chỉ được log cảnh báo, không làm mất dữ liệu thô vừa ghi.
+    Trả về số dòng mới được chèn, hoặc None nếu transaction bị ROLLBACK.
+    """
+
+    if df is None or df.empty:
+        logger.warning(" Không có dữ liệu để thực hiện UpSert. Bỏ qua.")
+        return
+
+    # Chuẩn bị tên bảng tạm duy nhất
+    # Bao bọc bằng ngoặc kép để đảm bảo an toàn trong các câu lệnh SQL thô
+    temp_table_name_quoted = f'"temp_{table_name}_{uuid.uuid4().hex[:8]}"'
+    # pandas.to_sql cần tên không có ngoặc kép
+    temp_table_name_unquoted = temp_table_name_quoted.strip('"')
+
+    batch_id = pipeline_id or uuid.uuid4().hex[:6]
+    logger.info(f" [Pipeline {batch_id}] bắt đầu upsert {len(df)} dòng vào bảng '{table_name}' ...")
+
+    rows_inserted = None
+    touched = []
+
+    # Mở kết nối một lần duy nhất cho toàn bộ tác vụ
+    with engine.connect() as conn:
+        try:
+            # --- BẮT ĐẦU MỘT TRANSACTION DUY NHẤT ---
+            # Toàn bộ logic nghiệp vụ sẽ nằm trong khối này.
+            # Nó sẽ tự động COMMIT khi kết thúc thành công, hoặc ROLLBACK nếu có lỗi.
+            with conn.begin():
+
+                # Bảng tạo trước khi có các cột mới (vd. aqi_*, xem databaseAqiColumns.sql) -> bỏ các cột
+                # bảng chưa có thay vì làm hỏng cả lần upsert
+                table_cols = set(conn.execute(text(
+                    "SELECT column_name FROM information_schema.columns "
+                    "WHERE table_schema = 'public' AND table_name = :t"
+                ), {"t": table_name}).scalars())
+                missing_cols = [c for c in df.columns if table_cols and c.lower() not in table_cols]
+                if missing_cols:
+                    logger.warning(f"  Bảng '{table_name}' chưa có các cột {missing_cols} - bỏ qua khi upsert "
+                                   f"(chạy databaseAqiColumns.sql để thêm).")
+                    df = df.drop(columns=missing_cols)
+
+                # Bước A: Ghi dữ liệu vào bảng tạm
+                logger.info(f"  A. Ghi dữ liệu vào bảng tạm '{temp_table_name_unquoted}'...")
+                df.to_sql(
+                    temp_table_name_unquoted,
+                    conn, # Sử dụng connection của transaction hiện tại
+                    if_exists="replace",
+                    index=False,
+                    method='multi',
+                    chunksize=5000
+                )
+                logger.info("     -> Ghi vào bảng tạm thành công.")
+
+                # Bước B: Thực thi logic Upsert từ bảng tạm
+                logger.info("  B. Thực thi lệnh UPSERT...")
+
+                # Lấy danh sách cột từ DataFrame để đảm bảo khớp 100%
+                cols_quoted = ", ".join([f'"{c.lower()}"' for c in df.columns])
+
+                # Dòng đã tồn tại chỉ được lấp các cột đang NULL (vd. dữ liệu lấy lại từ hàng đợi retry),
+                # giá trị đã có không bao giờ bị ghi đè
+                value_cols = [c.lower() for c in df.columns if c.lower() not in ("location_id", "datetime")]
+                set_clause = ", ".join([f'"{c}" = COALESCE(t."{c}", EXCLUDED."{c}")' for c in value_cols])
+                where_clause = " OR ".join([f'(t."{c}" IS NULL AND EXCLUDED."{c}" IS NOT NULL)' for c in value_cols])
+
+                # Upsert với RETURNING: xmax = 0 nghĩa là dòng mới được INSERT, ngược lại là UPDATE
+                upsert_query = f"""
+                INSERT INTO public."{table_name}" AS t ({cols_quoted})
+                SELECT {cols_quoted} FROM {temp_table_name_quoted}
+                ON CONFLICT (location_id, datetime) DO UPDATE SET {set_clause}
+                WHERE {where_clause}
+                RETURNING (xmax = 0) AS inserted, location_id, datetime;
+                """
+                touched = conn.execute(text(upsert_query)).all()
+                rows_inserted = sum(row[0] for row in touched)
+                rows_filled = len(touched) - rows_inserted
+
+                logger.info(f" -> Lệnh Upsert đã được thực thi. {rows_inserted} dòng mới đã được chèn vào Supabase, {rows_filled} dòng được lấp giá trị thiếu.")
+
+                # Lưu ý: Bảng tạm (không phải là TEMP TABLE) được tạo trong transaction này
+                # sẽ bị rollback và biến mất nếu transaction thất bại.
+                # Nếu thành công, nó vẫn tồn tại cho đến khi bị dọn dẹp.
+
+            # Transaction kết thúc, COMMIT đã được gọi tự động.
+            logger.info("  ✅ Giao dịch Upsert hoàn tất và đã được COMMIT.")
+
+        except Exception:
+            # Log lỗi và thông báo về việc rollback tự động
+            logger.error("\n❌ Lỗi trong quá trình Upsert. Transaction đã được tự động ROLLBACK.", exc_info=True)
+            # Lỗi có thể xảy ra lúc COMMIT, sau khi rows_inserted đã được gán
+            rows_inserted = None
+
+        finally:
+            # --- BƯỚC C: DỌN DẸP ---
+            # Khối `finally` đảm bảo việc dọn dẹp luôn được thực thi,
+            # dù transaction ở trên thành công hay thất bại.
+            logger.info(f"  -> C. Dọn dẹp bảng tạm {temp_table_name_quoted}...")
+            try:
+                # Thực thi lệnh DROP TABLE trên cùng một connection
+                # Không cần transaction riêng cho lệnh này trong SQLAlchemy 2.x
+                conn.execute(text(f'DROP TABLE IF EXISTS {temp_table_name_quoted};'))
+                conn.commit() # Cần commit tường minh cho lệnh chạy ngoài `with conn.begin()`
+                logger.info("     -> Dọn dẹp bảng tạm thành công.")
+            except Exception as cleanup_e:
+                logger.warning(f"     -> Cảnh báo: Lỗi khi dọn dẹp bảng tạm: {cleanup_e}")
+
+    # Chỉ tính lại rollup cho các ngày/tháng có dòng thay đổi, sau khi dữ liệu thô đã được COMMIT
+    if refresh_rollup_tables and rows_inserted is not None and touched:
+        try:
+            with engine.begin() as conn:
+                refresh_rollups(conn, [row[1] for row in touched], [row[2] for row in touched])
+        except Exception:
+            logger.warning(" -> Cập nhật bảng rollup thất bại (dữ liệu thô đã được ghi). "
+                           "Chạy lại `python rollups.py rebuild` để đồng bộ rollup.", exc_info=True)
+
+    logger.info(f"🏁 [Pipeline {batch_id}] Hoàn tất upsert cho bảng '{table_name}'.\n")
+
+    # Trả về số dòng đã chèn để hàm chính có thể sử dụng
+    return rows_inserted
+
+
+# --- LOAD: CSV ---
+
+def append_to_csv(df_new: pd.DataFrame, csv_filepath: str) -> int:
+    """
+    Nối DataFrame mới vào file CSV đã có, xử lý trùng lặp và sắp xếp.
+    Nếu file chưa tồn tại, tạo file mới.
+    Trả về số lượng dòng mới thực sự được thêm vào.
+    """
+    if df_new is None or df_new.empty:
+        logger.info("Không có dữ liệu mới để ghi vào CSV. Bỏ qua.")
+        return 0
+
+    # Đảm bảo cột datetime trong dữ liệu mới là kiểu timezone-aware Asia/Bangkok
+    # (naive -> hiểu là giờ VN). Dữ liệu từ hàm fetch đã đúng kiểu nên chỉ tốn một lần tz_convert
+    df_new['datetime'] = parse_timestamps(df_new['datetime'], naive_tz='Asia/Bangkok', tz='Asia/Bangkok')
+
+    # Kiểm tra sự tồn tại của file CSV
+    if os.path.exists(csv_filepath):
+        logger.info(f"File '{csv_filepath}' đã tồn tại. Đang đọc dữ liệu cũ...")
+
+        # Đọc dữ liệu cũ, cột datetime để dạng chuỗi rồi parse bằng parse_timestamps
+        # (chỉ parse mỗi giờ một lần thay vì một lần cho mỗi trạm)
+        df_old = pd.read_csv(csv_filepath)
+
+        # Quan trọng: Gán múi giờ cho dữ liệu cũ để nó đồng bộ với dữ liệu mới
+        df_old['datetime'] = parse_timestamps(df_old['datetime'], naive_tz='Asia/Bangkok', tz='Asia/Bangkok')
+
+        # Gộp dữ liệu cũ và mới (bây giờ cả hai đều có kiểu dữ liệu datetime chuẩn)
+        combined_df = pd.concat([df_old, df_new], ignore_index=True)
+
+        logger.info("Đang loại bỏ các dòng trùng lặp, giữ lại dữ liệu mới nhất...")
+        # last() lấy giá trị không-NaN cuối cùng của từng cột: dữ liệu mới thắng,
+        # nhưng cột mà lần fetch mới không có (API lỗi) vẫn giữ giá trị cũ
+        final_df = combined_df.groupby(['location_id', 'datetime'], sort=False, as_index=False).last()
+        final_df = final_df[combined_df.columns]
+
+        rows_added = len(final_df) - len(df_old)
+    else:
+        logger.info(f"File '{csv_filepath}' chưa tồn tại. Sẽ tạo file mới.")
+        final_df = df_new
+        rows_added = len(final_df)
+
+    logger.info("Đang sắp xếp lại dữ liệu...")
+    final_df = final_df.sort_values(by=['location_id', 'datetime'])
+
+    logger.info(f"Đang ghi {len(final_df)} dòng vào '{csv_filepath}'...")
+    final_df.to_csv(csv_filepath, index=False, encoding='utf-8-sig', float_format='%.6f')
+
+    return rows_added
+
+
+# --- SINKS ---
+
+class Sink:
+    """
+    Giao diện chung cho một đích ghi dữ liệu.
+    Lớp con chỉ cần cài đặt `write(df)` và trả về số dòng mới được ghi.
+    Nếu ghi thất bại thì raise exception để run_sinks ghi nhận lỗi.
+    Sink có `include_forecast = True` nhận cả các giờ dự báo (sau thời điểm hiện tại),
+    các sink còn lại chỉ nhận các giờ đã qua.
+    """
+    name = "sink"
+    include_forecast = False
+
+    def write(self, df: pd.DataFrame) -> int:
+        raise NotImplementedError
+
+
+class PostgresSink(Sink):
+    """
+    Upsert vào bảng Postgres/Supabase (chỉ lấp cột NULL), kèm cập nhật bảng rollup ngày/tháng
+    sau khi COMMIT. Rollup lỗi chỉ bị log cảnh báo; `rollups=False` để tắt hẳn.
+    """
+    name = "postgres"
+
+    def __init__(self, table_name: str = DB_TABLE_NAME, engine=None, rollups: bool | None = None):
+        self.table_name = table_name
+        self.engine = engine
+        # Bảng rollup được định nghĩa trên bảng dữ liệu chính
+        self.rollups = (table_name == ROLLUP_SOURCE_TABLE) if rollups is None else rollups
+
+    def write(self, df: pd.DataFrame) -> int:
+        # Engine được tạo muộn để lỗi kết nối chỉ làm hỏng sink này
+        if self.engine is None:
+            self.engine = get_db_engine()
+        inserted = upsert_data(self.engine, df, self.table_name, refresh_rollup_tables=self.rollups)
+        if inserted is None:
+            raise RuntimeError(f"Upsert vào bảng '{self.table_name}' thất bại (đã ROLLBACK).")
+        return inserted
+
+
+class CsvSink(Sink):
+    """Nối dữ liệu vào một file CSV, loại bỏ trùng lặp theo (location_id, datetime)."""
+    name = "csv"
+
+    def __init__(self, csv_filepath: str = OUTPUT_CSV_FILE):
+        self.csv_filepath = csv_filepath
+
+    def write(self, df: pd.DataFrame) -> int:
+        return append_to_csv(df, self.csv_filepath)
+
+
+class ForecastVersionSink(Sink):
+    """Ghi các giá trị dự báo đã thay đổi thành phiên bản mới (xem forecast_versions.py)."""
+    name = "forecast_versions"
+    include_forecast = True
+
+    def __init__(self, engine=None, past_hours: int = 0):
+        self.engine = engine
+        # Số giờ trước thời điểm phát hành cũng được ghi phiên bản (0 = chỉ các giờ dự báo)
+        self.past_hours = past_hours
+
+    def write(self, df: pd.DataFrame) -> int:
+        if self.engine is None:
+            self.engine = get_db_engine()
+        return write_versions(self.engine, df, VALUE_COLUMNS, past_hours=self.past_hours)
+
+
+@dataclass
+class SinkResult:
+    """Kết quả ghi của một sink: thành công hay không, bao nhiêu dòng, mất bao lâu."""
+    name: str
+    ok: bool
+    rows: int = 0
+    duration: float = 0.0
+    error: str | None = None
+
+
+def _run_one_sink(sink: Sink, df: pd.DataFrame) -> SinkResult:
+    start_time = time.time()
+    try:
+        rows = sink.write(df)
+        return SinkResult(sink.name, True, rows or 0, time.time() - start_time)
+    except Exception as e:
+        logger.exception(f"Sink '{sink.name}' thất bại.")
+        return SinkResult(sink.name, False, 0, time.time() - start_time, str(e))
+
+
+def run_sinks(df: pd.DataFrame, sinks: list, forecast_df: pd.DataFrame | None = None) -> list[SinkResult]:
+    """
+    Đưa cùng một DataFrame cho tất cả sink, chạy song song trên các thread riêng.
+    Một sink chậm hoặc lỗi không chặn các sink còn lại.
+    Mỗi sink nhận một bản copy riêng vì một số sink (CSV) chỉnh sửa cột datetime tại chỗ.
+    Sink có include_forecast nhận `forecast_df` (gồm cả các giờ dự báo) nếu có.
+    """
+    if df is None or df.empty or not sinks:
+        return [SinkResult(sink.name, True) for sink in sinks]
+
+    def _input(sink):
+        return forecast_df if sink.include_forecast and forecast_df is not None else df
+
+    with ThreadPoolExecutor(max_workers=len(sinks), thread_name_prefix="sink") as pool:
+        futures = [pool.submit(_run_one_sink, sink, _input(sink).copy()) for sink in sinks]
+        results = [f.result() for f in futures]
+
+    for r in results:
+        status = "✅" if r.ok else "❌"
+        logger.info(f" {status} Sink '{r.name}': {r.rows} dòng mới trong {r.duration:.2f}s" + (f" - lỗi: {r.error}" if r.error else ""))
+    return results
+
+
+# --- Hàm điều phối chung ---
+
+def run_etl(sinks: list, num_past_days: int = 7, job_name: str = "ETL PIPELINE",
+            forecast_days: int = 1, stations_df: pd.DataFrame | None = None,
+            retry_queue_path: str = RETRY_QUEUE_PATH, aqi_state_path: str | None = AQI_STATE_PATH,
+            session: AdaptiveSession | None = None, stats: dict | None = None) -> list[SinkResult]:
+    """
+    Đọc metadata, fetch dữ liệu MỘT lần rồi ghi ra tất cả sink đã cấu hình.
+    Nếu có sink include_forecast (ForecastVersionSink), các giờ dự báo của `forecast_days` ngày
+    được giữ lại cho sink đó; AQI và các sink khác vẫn chỉ thấy các giờ đã qua.
+    `stations_df` (vd. các trạm của một shard) thay cho việc đọc metadata; `retry_queue_path` và
+    `aqi_state_path` cho phép mỗi shard có trạng thái riêng.
+    Nếu truyền `stats` (dict), hàm ghi vào đó rows_fetched, max_datetime và error (nếu job lỗi).
+    Trả về danh sách SinkResult (rỗng nếu job thất bại trước bước ghi).
+    """
+    logger.info("==================================================")
+    logger.info(f"BẮT ĐẦU {job_name} LÚC: {datetime.now()}")
+    logger.info("==================================================")
+    start_time = time.time()
+    results = []
+    stats = stats if stats is not None else {}
+    stats.update(rows_fetched=0, max_datetime=None, error=None)
+
+    try:
+        # Bước A: Đọc metadata
+        profiling.step("Bước 1/3: Đọc metadata")
+        if stations_df is None:
+            logger.info(f"\n [Bước 1/3] Đang đọc metadata từ '{METADATA_FILE_PATH}'...")
+            df_metadata = read_metadata()
+        else:
+            logger.info("\n [Bước 1/3] Dùng danh sách trạm được truyền vào...")
+            df_metadata = stations_df
+        logger.info(f" -> Đọc thành công thông tin của {len(df_metadata)} trạm.")
+
+        # Bước B: Lấy dữ liệu mới (Extract & Transform)
+        logger.info("\n [Bước 2/3] Đang lấy dữ liệu gần đây từ Open-Meteo...")
+        profiling.step("Bước 2/3: Fetch + decode Open-Meteo, tính AQI")
+        session = session or AdaptiveSession()
+        include_forecast = any(s.include_forecast for s in sinks)
+        recent_data_df = fetch_recent_data(df_metadata, num_past_days, retry_queue_path=retry_queue_path, session=session,
+                                           forecast_days=forecast_days, include_forecast=include_forecast) if len(df_metadata) else None
+        forecast_df = None
+        if include_forecast and recent_data_df is not None:
+            forecast_df = recent_data_df
+            recent_data_df = recent_data_df[recent_data_df["datetime"] <= pd.Timestamp.now(tz="UTC")].reset_index(drop=True)
+        for host, m in session.metrics().items():
+            logger.info(f" -> Upstream {host}: limit={m['limit']}, state={m['state']}, "
+                        f"ok={m['ok']}, lỗi={m['errors']}, 429={m['throttled']}, từ chối={m['rejected']}, "
+                        f"latency~{m['ewma_latency_s']}s")
+        if recent_data_df is not None and not recent_data_df.empty:
+            recent_data_df = add_aqi_columns(recent_data_df, state_path=aqi_state_path)
+            stats["rows_fetched"] = len(recent_data_df)
+            stats["max_datetime"] = recent_data_df["datetime"].max()
+
+        # Bước C: Ghi ra các sink (Load)
+        logger.info(f"\n [Bước 3/3] Đang ghi dữ liệu ra {len(sinks)} sink: {[s.name for s in sinks]}...")
+        profiling.step(f"Bước 3/3: Ghi ra sink {[s.name for s in sinks]}")
+        if recent_data_df is not None and not recent_data_df.empty:
+            results = run_sinks(recent_data_df, sinks, forecast_df)
+        else:
+            logger.info(" -> Không có dữ liệu mới để tải lên.")
+
+    except Exception as e:
+        logger.exception("ETL JOB THẤT BẠI !!!")
+        logger.warning(f"Lỗi: {e}")
+        stats["error"] = str(e)
+
+    finally:
+        profiling.end_stage()
+        end_time = time.time()
+        logger.info("\n==================================================")
+        logger.info(f"KẾT THÚC ETL JOB. TỔNG THỜI GIAN: {end_time - start_time:.2f} GIÂY.")
+        for r in results:
+            logger.info(f" -> Sink '{r.name}': {'thành công' if r.ok else 'THẤT BẠI'}, {r.rows} bản ghi mới.")
+        logger.info("==================================================")
+
+    return results
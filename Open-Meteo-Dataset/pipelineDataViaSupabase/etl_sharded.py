@@ -0,0 +1,301 @@
+# Mục đích: Chạy ETL theo shard cho nhiều vùng / hàng nghìn trạm.
+# - Metadata trạm có cột `region` (mặc định "hanoi"); khoá shard = "region:location_id".
+# - Trạm được chia cho các shard bằng rendezvous hashing: ổn định giữa các lần chạy, và khi đổi
+#   số shard thì chỉ những trạm đổi chủ mới bị di chuyển.
+# - Mỗi shard (một process, hoặc một host chạy lệnh `worker`) fetch phần trạm của mình, ghi kết quả,
+#   hàng đợi retry và watermark riêng trong SHARD_STATE_DIR. Watermark giới hạn cửa sổ fetch của lần sau
+#   (chỉ lấy lại từ ngày chứa watermark), trạm mới chuyển vào shard thì lấy đủ NUM_PAST_DAYS.
+# - Coordinator (`run`, `status`, `rebalance`) khởi chạy các worker, báo cáo tiến độ từng shard và đổi số shard.
+#
+# Ví dụ:
+#   python etl_sharded.py run --shards 4                       # 4 process trên máy này
+#   python etl_sharded.py worker --shard-id 2 --shards 4       # chạy shard 2 trên một host khác
+#   python etl_sharded.py status
+#   python etl_sharded.py rebalance --shards 6                 # xem trạm nào đổi shard rồi lưu plan mới
+
+import argparse
+import json
+import logging
+import os
+import hashlib
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import pandas as pd
+
+from etl_core import METADATA_FILE_PATH, DB_TABLE_NAME, VN_TZ, CsvSink, PostgresSink, read_metadata, run_etl, configure_logging
+from adaptive_client import AdaptiveSession
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SHARD_STATE_DIR = os.path.join(BASE_DIR, "shard_state")
+SHARD_PLAN_FILE = os.path.join(SHARD_STATE_DIR, "shard_plan.json")
+LOG_FILE_PATH = os.path.join(BASE_DIR, "etl_sharded.log")
+DEFAULT_REGION = "hanoi"
+NUM_PAST_DAYS = 7
+
+LOG_FORMAT = "%(asctime)s [%(levelname)s] %(processName)s %(message)s"
+
+logger = logging.getLogger("etl_sharded")
+
+
+# --- PHÂN CHIA SHARD ---
+
+def shard_key(region, location_id) -> str:
+    return f"{region}:{int(location_id)}"
+
+
+def owner_shard(key: str, shard_ids) -> int:
+    """
+    Rendezvous (highest-random-weight) hashing: shard có trọng số hash(shard, key) lớn nhất sở hữu key.
+    Trọng số phải là hash phi tuyến (blake2b): CRC32 tuyến tính theo XOR nên shard thắng phụ thuộc
+    vào các bit của key -> chia lệch hẳn với location_id liên tiếp.
+    """
+    return max(shard_ids, key=lambda s: int.from_bytes(hashlib.blake2b(f"{s}|{key}".encode(), digest_size=8).digest(), "big"))
+
+
+def assign_shards(stations_df: pd.DataFrame, num_shards: int) -> pd.Series:
+    """Trả về Series shard_id cho từng trạm (cùng index với stations_df)."""
+    regions = stations_df["region"] if "region" in stations_df.columns else pd.Series(DEFAULT_REGION, index=stations_df.index)
+    shard_ids = range(num_shards)
+    return pd.Series(
+        [owner_shard(shard_key(r, loc), shard_ids) for r, loc in zip(regions.fillna(DEFAULT_REGION), stations_df["location_id"])],
+        index=stations_df.index, name="shard_id"
+    )
+
+
+def load_plan(plan_path: str = SHARD_PLAN_FILE) -> dict | None:
+    if not os.path.exists(plan_path):
+        return None
+    with open(plan_path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_plan(num_shards: int, plan_path: str = SHARD_PLAN_FILE):
+    os.makedirs(os.path.dirname(plan_path), exist_ok=True)
+    with open(plan_path, "w", encoding="utf-8") as f:
+        json.dump({"num_shards": num_shards, "updated_at": datetime.now().isoformat()}, f, indent=2)
+
+
+# --- WATERMARK ---
+
+def shard_paths(shard_id: int, state_dir: str = SHARD_STATE_DIR) -> dict:
+    return {
+        "watermark": os.path.join(state_dir, f"shard_{shard_id}.json"),
+        "retry_queue": os.path.join(state_dir, f"shard_{shard_id}_retry_queue.jsonl"),
+        "csv": os.path.join(state_dir, f"shard_{shard_id}_data.csv"),
+        "log": os.path.join(state_dir, f"shard_{shard_id}.log"),
+        "aqi_state": os.path.join(state_dir, f"shard_{shard_id}_aqi_window.csv"),
+    }
+
+
+def read_watermark(shard_id: int, state_dir: str = SHARD_STATE_DIR) -> dict:
+    path = shard_paths(shard_id, state_dir)["watermark"]
+    if not os.path.exists(path):
+        return {"shard_id": shard_id, "status": "never_run"}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def incremental_past_days(previous: dict, location_ids, num_past_days: int = NUM_PAST_DAYS,
+                          now: datetime | None = None) -> int:
+    """
+    Số ngày `past_days` cần fetch cho shard: từ ngày (giờ VN) chứa watermark của lần chạy trước tới nay,
+    trong khoảng [1, num_past_days]. Chưa có watermark, hoặc shard có trạm chưa từng chạy
+    (vd. sau rebalance), thì lấy đủ num_past_days.
+    """
+    watermark = previous.get("watermark")
+    known = set(previous.get("location_ids") or [])
+    if not watermark or not set(int(x) for x in location_ids) <= known:
+        return num_past_days
+    today = (now or datetime.now(VN_TZ)).astimezone(VN_TZ).date()
+    watermark_day = pd.Timestamp(watermark).tz_convert(VN_TZ).date()
+    return max(1, min(num_past_days, (today - watermark_day).days + 1))
+
+
+def write_watermark(shard_id: int, state: dict, state_dir: str = SHARD_STATE_DIR):
+    path = shard_paths(shard_id, state_dir)["watermark"]
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False, indent=2, default=str)
+    os.replace(tmp_path, path)
+
+
+# --- WORKER ---
+
+def run_shard(shard_id: int, num_shards: int, sink_names=("csv",), metadata_path: str = METADATA_FILE_PATH,
+              state_dir: str = SHARD_STATE_DIR, num_past_days: int = NUM_PAST_DAYS, region: str | None = None) -> dict:
+    """
+    Chạy ETL cho các trạm thuộc shard `shard_id`/`num_shards` và cập nhật watermark của shard.
+    Cửa sổ fetch bắt đầu từ ngày chứa watermark (xem incremental_past_days).
+    Watermark (datetime lớn nhất đã ghi) chỉ tiến lên khi mọi sink đều thành công.
+    """
+    os.makedirs(state_dir, exist_ok=True)
+    paths = shard_paths(shard_id, state_dir)
+    previous = read_watermark(shard_id, state_dir)
+    state = {
+        "shard_id": shard_id, "num_shards": num_shards, "status": "running",
+        "started_at": datetime.now().isoformat(), "pid": os.getpid(),
+        "watermark": previous.get("watermark"), "location_ids": previous.get("location_ids", []),
+    }
+    write_watermark(shard_id, state, state_dir)
+    start_time = time.time()
+
+    try:
+        stations = read_metadata(metadata_path)
+        if region is not None and "region" in stations.columns:
+            stations = stations[stations["region"] == region]
+        stations = stations[assign_shards(stations, num_shards) == shard_id]
+        state["stations"] = len(stations)
+        past_days = incremental_past_days(previous, stations["location_id"], num_past_days)
+        state["past_days"] = past_days
+        logger.info(f"[Shard {shard_id}/{num_shards}] Xử lý {len(stations)} trạm, past_days={past_days}.")
+
+        sinks = []
+        if "csv" in sink_names:
+            sinks.append(CsvSink(paths["csv"]))
+        if "postgres" in sink_names:
+            sinks.append(PostgresSink(DB_TABLE_NAME))
+
+        session = AdaptiveSession()
+        stats = {}
+        results = run_etl(sinks, past_days, job_name=f"ETL SHARD {shard_id}/{num_shards}", stations_df=stations,
+                          retry_queue_path=paths["retry_queue"], aqi_state_path=paths["aqi_state"],
+                          session=session, stats=stats)
+
+        state["rows_fetched"] = stats["rows_fetched"]
+        state["sinks"] = {r.name: {"ok": r.ok, "rows": r.rows, "error": r.error} for r in results}
+        state["upstream"] = session.metrics()
+        if stats["error"]:
+            raise RuntimeError(stats["error"])
+        all_ok = all(r.ok for r in results)
+        if all_ok:
+            if stats["max_datetime"] is not None:
+                state["watermark"] = stats["max_datetime"].isoformat()
+            state["location_ids"] = sorted(set(state["location_ids"]) | {int(x) for x in stations["location_id"]})
+        state["status"] = "ok" if all_ok else "partial"
+    except Exception as e:
+        logger.exception(f"[Shard {shard_id}] THẤT BẠI")
+        state["status"] = "failed"
+        state["error"] = str(e)
+    finally:
+        state["finished_at"] = datetime.now().isoformat()
+        state["duration_s"] = round(time.time() - start_time, 2)
+        write_watermark(shard_id, state, state_dir)
+    return state
+
+
+def _worker_process(shard_id, num_shards, sink_names, metadata_path, state_dir, region):
+    """Entry point cho process con: mỗi shard log ra file riêng (force=True để bỏ handler kế thừa khi fork)."""
+    os.makedirs(state_dir, exist_ok=True)
+    configure_logging(shard_paths(shard_id, state_dir)["log"], force=True, fmt=LOG_FORMAT)
+    return run_shard(shard_id, num_shards, sink_names, metadata_path, state_dir, region=region)
+
+
+# --- COORDINATOR ---
+
+def run_all(num_shards: int, processes: int, sink_names, metadata_path: str, state_dir: str, region: str | None):
+    """Khởi chạy toàn bộ shard trên `processes` process của máy này rồi in báo cáo."""
+    logger.info(f"Khởi chạy {num_shards} shard trên {processes} process...")
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        futures = [
+            pool.submit(_worker_process, k, num_shards, sink_names, metadata_path, state_dir, region)
+            for k in range(num_shards)
+        ]
+        for f in futures:
+            f.result()
+    report_status(num_shards, state_dir)
+
+
+def report_status(num_shards: int, state_dir: str = SHARD_STATE_DIR) -> list[dict]:
+    """In tiến độ từng shard dựa trên file watermark."""
+    states = [read_watermark(k, state_dir) for k in range(num_shards)]
+    logger.info("==================================================")
+    logger.info(f"TRẠNG THÁI {num_shards} SHARD")
+    for s in states:
+        logger.info(
+            f" shard {s['shard_id']}: {s.get('status')}, trạm={s.get('stations', '-')}, "
+            f"dòng={s.get('rows_fetched', '-')}, watermark={s.get('watermark')}, "
+            f"kết thúc={s.get('finished_at', '-')}, {s.get('duration_s', '-')}s"
+        )
+    logger.info("==================================================")
+    return states
+
+
+def rebalance(new_num_shards: int, metadata_path: str, plan_path: str = SHARD_PLAN_FILE, apply: bool = True) -> pd.DataFrame:
+    """
+    So sánh phân chia hiện tại (theo shard_plan.json) với số shard mới, in số trạm bị di chuyển
+    và lưu plan mới. Watermark và hàng đợi retry cũ vẫn giữ nguyên; trạm chuyển sang shard mới
+    sẽ được lấy lại đủ `past_days` ở lần chạy kế tiếp.
+    """
+    plan = load_plan(plan_path)
+    old_num_shards = plan["num_shards"] if plan else 1
+    stations = read_metadata(metadata_path)
+    moves = pd.DataFrame({
+        "location_id": stations["location_id"],
+        "old_shard": assign_shards(stations, old_num_shards),
+        "new_shard": assign_shards(stations, new_num_shards),
+    })
+    moved = moves[moves["old_shard"] != moves["new_shard"]]
+    logger.info(f"Rebalance {old_num_shards} -> {new_num_shards} shard: {len(moved)}/{len(moves)} trạm đổi shard.")
+    logger.info(f" Số trạm mỗi shard mới: {moves['new_shard'].value_counts().sort_index().to_dict()}")
+    if apply:
+        save_plan(new_num_shards, plan_path)
+        logger.info(f" -> Đã lưu plan mới vào '{plan_path}'.")
+    return moved
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ETL Open-Meteo chạy theo shard.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    def add_common(p):
+        p.add_argument("--shards", type=int, default=None, help="Số shard (mặc định lấy từ shard_plan.json)")
+        p.add_argument("--metadata", default=METADATA_FILE_PATH)
+        p.add_argument("--state-dir", default=SHARD_STATE_DIR)
+
+    p_run = sub.add_parser("run", help="Chạy tất cả shard bằng nhiều process trên máy này")
+    add_common(p_run)
+    p_run.add_argument("--processes", type=int, default=None)
+    p_run.add_argument("--sink", action="append", choices=["csv", "postgres"], default=None)
+    p_run.add_argument("--region", default=None)
+
+    p_worker = sub.add_parser("worker", help="Chạy một shard (dùng khi mỗi host chạy một shard)")
+    add_common(p_worker)
+    p_worker.add_argument("--shard-id", type=int, required=True)
+    p_worker.add_argument("--sink", action="append", choices=["csv", "postgres"], default=None)
+    p_worker.add_argument("--region", default=None)
+
+    p_status = sub.add_parser("status", help="Báo cáo tiến độ từng shard")
+    add_common(p_status)
+
+    p_rebalance = sub.add_parser("rebalance", help="Đổi số shard")
+    add_common(p_rebalance)
+    p_rebalance.add_argument("--dry-run", action="store_true")
+
+    args = parser.parse_args()
+    configure_logging(LOG_FILE_PATH, fmt=LOG_FORMAT)
+    plan_path = os.path.join(args.state_dir, "shard_plan.json")
+    plan = load_plan(plan_path)
+    num_shards = args.shards or (plan["num_shards"] if plan else 1)
+
+    if args.command == "run":
+        # Plan luôn phản ánh số shard thực sự chạy để status/rebalance đọc đúng
+        if plan is None or plan["num_shards"] != num_shards:
+            if plan is not None:
+                logger.warning(f"Số shard đổi {plan['num_shards']} -> {num_shards}; cập nhật '{plan_path}'.")
+            save_plan(num_shards, plan_path)
+        run_all(num_shards, args.processes or num_shards, tuple(args.sink or ["csv"]), args.metadata, args.state_dir, args.region)
+    elif args.command == "worker":
+        run_shard(args.shard_id, num_shards, tuple(args.sink or ["csv"]), args.metadata, args.state_dir, region=args.region)
+    elif args.command == "status":
+        report_status(num_shards, args.state_dir)
+    elif args.command == "rebalance":
+        if args.shards is None:
+            parser.error("rebalance cần --shards")
+        rebalance(args.shards, args.metadata, plan_path, apply=not args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
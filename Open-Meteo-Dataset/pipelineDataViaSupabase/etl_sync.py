@@ -0,0 +1,48 @@
+# Mục đích: Fetch dữ liệu Open-Meteo MỘT lần rồi ghi đồng thời vào Supabase và file CSV.
+# Thay cho việc chạy cả etl_realtime.py và csv_etl_realtime.py (mỗi script tự fetch lại từ đầu).
+
+import logging
+import os
+import sys
+
+from etl_core import DB_TABLE_NAME, OUTPUT_CSV_FILE, PostgresSink, CsvSink, ForecastVersionSink, run_etl, configure_logging
+
+
+# --- Logging setup ---
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+LOG_FILE_PATH = os.path.join(BASE_DIR, "etl_sync.log")
+logger = logging.getLogger("etl_sync")
+
+
+def setup_logging():
+    """Cấu hình log file + console; gọi khi chạy job chứ không phải lúc import."""
+    configure_logging(LOG_FILE_PATH)
+
+
+# --- Hằng số toàn cục ---
+# Lấy số ngày lớn nhất trong hai pipeline cũ để cả hai sink đều đủ dữ liệu
+NUM_PAST_DAYS = 7
+# Số ngày dự báo lấy về khi bật kho dự báo theo phiên bản
+FORECAST_DAYS = 3
+
+
+def run_sync_etl(num_past_days: int = NUM_PAST_DAYS, forecast_versions: bool = False,
+                 forecast_days: int = FORECAST_DAYS):
+    """
+    Fetch một lần, ghi song song ra tất cả sink.
+    `forecast_versions`: ghi thêm các giờ dự báo vào kho theo phiên bản (forecast_versions.py).
+    Trả về True nếu có dữ liệu được ghi và mọi sink đều thành công; job lỗi hoặc không có
+    dữ liệu nào (danh sách kết quả rỗng) trả về False.
+    """
+    sinks = [PostgresSink(DB_TABLE_NAME), CsvSink(OUTPUT_CSV_FILE)]
+    if forecast_versions:
+        sinks.append(ForecastVersionSink())
+    results = run_etl(sinks, num_past_days=num_past_days, job_name="ETL PIPELINE (MULTI-SINK)",
+                      forecast_days=forecast_days if forecast_versions else 1)
+    return bool(results) and all(r.ok for r in results)
+
+
+#--- Điểm bắt đầu thực thi của script ---
+if __name__ == "__main__":
+    setup_logging()
+    sys.exit(0 if run_sync_etl() else 1)
@@ -0,0 +1,206 @@
+"""
+LƯU TRỮ DỰ BÁO THEO PHIÊN BẢN (xem databaseForecastVersions.sql)
+Bảng chính air_quality_forecast_data chỉ giữ giá trị đầu tiên của mỗi (location_id, datetime),
+nên không biết dự báo cho một giờ đã thay đổi thế nào qua các lần chạy. Module này (tuỳ chọn,
+qua ForecastVersionSink trong etl_core) ghi mỗi giá trị kèm thời điểm phát hành issued_at:
+- issued_at = giờ (UTC, làm tròn xuống) của lần fetch - API Open-Meteo không trả thời điểm chạy model
+  trong response hourly, nên mỗi lần fetch được coi là một phiên bản.
+- Mã hoá delta: một giá trị chỉ được ghi thành phiên bản mới khi khác giá trị mới nhất đã lưu
+  của cùng (location_id, variable, datetime); lần chạy không đổi gì không tốn thêm dòng nào.
+- air_quality_forecast_latest giữ giá trị mới nhất của mỗi khoá (tra cứu theo khoá chính),
+  đồng thời là bảng so sánh khi mã hoá delta.
+- "Giá trị đã biết tại thời điểm T": DISTINCT ON với ORDER BY giảm dần trên CẢ bốn cột của khoá chính
+  -> Postgres đọc ngược index khoá chính, không cần sort; kết quả được sắp lại tăng dần ở pandas.
+  Cả hai bảng đều có khoá bắt đầu bằng location_id nên CLI và values_as_of BẮT BUỘC có location:
+  lọc chỉ theo --start/--end không dùng được khoảng của index -> DISTINCT ON quét cả bảng phiên bản.
+
+    python forecast_versions.py latest --location 7441 --start 2025-01-01 --end 2025-01-02
+    python forecast_versions.py as-of 2025-01-01T06:00+07:00 --location 7441 --variables pm2_5_cams
+"""
+import argparse
+import logging
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+
+logger = logging.getLogger("forecast_versions")
+
+VERSION_TABLE = "air_quality_forecast_versions"
+LATEST_TABLE = "air_quality_forecast_latest"
+
+
+def issue_hour(now: datetime | None = None) -> pd.Timestamp:
+    """Thời điểm phát hành của một lần fetch: giờ UTC hiện tại, làm tròn xuống."""
+    return pd.Timestamp(now or datetime.now(timezone.utc)).tz_convert("UTC").floor("h")
+
+
+def to_long(df: pd.DataFrame, value_columns: list[str], issued_at: pd.Timestamp, past_hours: int = 0) -> pd.DataFrame:
+    """
+    Frame rộng của ETL -> dạng dài (location_id, variable, datetime, value).
+    Chỉ giữ các giờ từ issued_at - past_hours trở đi và bỏ giá trị NaN (NaN = không có dữ liệu,
+    không phải một phiên bản).
+    """
+    times = pd.to_datetime(df["datetime"], utc=True)
+    keep = (times >= issued_at - pd.Timedelta(hours=past_hours)).to_numpy()
+    rows, times = df[keep], times[keep]
+    columns = [c for c in value_columns if c in rows.columns]
+    values = rows[columns].to_numpy(dtype=np.float32)
+    r, c = np.nonzero(~np.isnan(values))
+    long_df = pd.DataFrame({
+        "location_id": rows["location_id"].to_numpy(dtype=np.int64)[r],
+        "variable": np.asarray(columns, dtype=object)[c],
+        "datetime": pd.DatetimeIndex(times)[r],
+        "value": values[r, c],
+    })
+    # Dòng lấy lại từ hàng đợi retry có thể trùng khoá với lần fetch chính -> giữ dòng sau
+    return long_df.drop_duplicates(["location_id", "variable", "datetime"], keep="last").reset_index(drop=True)
+
+
+def write_versions(engine, df: pd.DataFrame, value_columns: list[str], issued_at: pd.Timestamp | None = None,
+                   past_hours: int = 0) -> int:
+    """
+    Ghi các giá trị đã thay đổi so với bản mới nhất thành phiên bản mới (một transaction).
+    Bản có issued_at không mới hơn bản mới nhất đã lưu (chạy lại cùng giờ, chạy muộn) bị bỏ qua.
+    Trả về số giá trị được ghi thành phiên bản mới.
+    """
+    issued_at = issued_at if issued_at is not None else issue_hour()
+    long_df = to_long(df, value_columns, issued_at, past_hours)
+    if long_df.empty:
+        logger.info(" -> Không có giá trị dự báo nào để ghi phiên bản.")
+        return 0
+
+    with engine.begin() as conn:
+        conn.execute(text("""
+            CREATE TEMP TABLE IF NOT EXISTS _forecast_batch
+                (location_id BIGINT, variable TEXT, datetime TIMESTAMPTZ, value REAL) ON COMMIT DROP;
+            TRUNCATE _forecast_batch;
+        """))
+        conn.execute(
+            text("INSERT INTO _forecast_batch (location_id, variable, datetime, value) "
+                 "VALUES (:location_id, :variable, :datetime, :value)"),
+            long_df.astype({"value": float}).to_dict("records"),
+        )
+        # Chỉ các khoá có giá trị khác bản mới nhất mới sinh phiên bản, rồi bản mới nhất được cập nhật theo
+        n_changed = conn.execute(text(f"""
+            WITH changed AS (
+                INSERT INTO public.{VERSION_TABLE} (location_id, variable, datetime, issued_at, value)
+                SELECT b.location_id, b.variable, b.datetime, :issued_at, b.value
+                FROM _forecast_batch b
+                LEFT JOIN public.{LATEST_TABLE} l
+                  ON l.location_id = b.location_id AND l.variable = b.variable AND l.datetime = b.datetime
+                WHERE (l.issued_at IS NULL OR l.issued_at < :issued_at)
+                  AND l.value IS DISTINCT FROM b.value
+                ON CONFLICT DO NOTHING
+                RETURNING location_id, variable, datetime, issued_at, value
+            ), latest AS (
+                INSERT INTO public.{LATEST_TABLE} AS t (location_id, variable, datetime, issued_at, value, n_versions)
+                SELECT location_id, variable, datetime, issued_at, value, 1 FROM changed
+                ON CONFLICT (location_id, variable, datetime) DO UPDATE
+                SET issued_at = EXCLUDED.issued_at, value = EXCLUDED.value, n_versions = t.n_versions + 1
+                RETURNING 1
+            )
+            SELECT COUNT(*) FROM latest;
+        """), {"issued_at": issued_at.to_pydatetime()}).scalar()
+
+    logger.info(f" -> Phiên bản dự báo {issued_at:%Y-%m-%d %H:00} UTC: {n_changed}/{len(long_df)} giá trị thay đổi được ghi.")
+    return n_changed
+
+
+# --- TRUY VẤN ---
+
+def _filters(location_ids=None, start=None, end=None, variables=None) -> tuple[list[str], dict]:
+    conditions, params = [], {}
+    if location_ids is not None:
+        conditions.append("location_id = ANY(:location_ids)")
+        params["location_ids"] = [int(x) for x in location_ids]
+    if variables is not None:
+        conditions.append("variable = ANY(:variables)")
+        params["variables"] = list(variables)
+    if start is not None:
+        conditions.append("datetime >= :start")
+        params["start"] = pd.Timestamp(start).to_pydatetime()
+    if end is not None:
+        conditions.append("datetime < :end")
+        params["end"] = pd.Timestamp(end).to_pydatetime()
+    return conditions, params
+
+
+def _read(engine, query: str, params: dict, wide: bool) -> pd.DataFrame:
+    with engine.connect() as conn:
+        df = pd.DataFrame(conn.execute(text(query), params).mappings().all(),
+                          columns=["location_id", "variable", "datetime", "issued_at", "value"])
+    if not wide:
+        return df
+    # Dạng rộng giống bảng chính: một dòng cho mỗi (location_id, datetime), một cột cho mỗi biến
+    out = df.pivot(index=["location_id", "datetime"], columns="variable", values="value").reset_index()
+    out.columns.name = None
+    return out
+
+
+def latest_values(engine, location_ids=None, start=None, end=None, variables=None, wide: bool = False) -> pd.DataFrame:
+    """Giá trị mới nhất của mỗi (location_id, variable, datetime), đọc từ bảng latest theo khoá chính."""
+    conditions, params = _filters(location_ids, start, end, variables)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return _read(engine, f"""
+        SELECT location_id, variable, datetime, issued_at, value
+        FROM public.{LATEST_TABLE} {where}
+        ORDER BY location_id, variable, datetime;
+    """, params, wide)
+
+
+def values_as_of(engine, at, location_ids=None, start=None, end=None, variables=None, wide: bool = False) -> pd.DataFrame:
+    """
+    Giá trị của mỗi khoá như đã biết tại thời điểm `at`: phiên bản có issued_at <= at mới nhất.
+    Khoá chưa có phiên bản nào tại `at` không xuất hiện trong kết quả.
+    Bắt buộc có `location_ids` (ValueError nếu thiếu): khoá chính bắt đầu bằng location_id, lọc chỉ
+    theo start/end thì DISTINCT ON phải đi hết index của bảng phiên bản.
+    """
+    if not location_ids:
+        raise ValueError("values_as_of cần location_ids (truy vấn không theo trạm sẽ quét toàn bộ bảng phiên bản)")
+    conditions, params = _filters(location_ids, start, end, variables)
+    conditions.append("issued_at <= :at")
+    params["at"] = pd.Timestamp(at).to_pydatetime()
+    # Mọi cột đều DESC = đúng thứ tự quét ngược khoá chính (location_id, variable, datetime, issued_at),
+    # nên không có bước (incremental) sort; trộn ASC/DESC thì không index nào khớp
+    df = _read(engine, f"""
+        SELECT DISTINCT ON (location_id, variable, datetime)
+               location_id, variable, datetime, issued_at, value
+        FROM public.{VERSION_TABLE}
+        WHERE {' AND '.join(conditions)}
+        ORDER BY location_id DESC, variable DESC, datetime DESC, issued_at DESC;
+    """, params, wide)
+    return df if wide else df.iloc[::-1].reset_index(drop=True)
+
+
+def main():
+    from etl_core import get_db_engine
+
+    parser = argparse.ArgumentParser(description="Truy vấn kho dự báo theo phiên bản.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_latest = sub.add_parser("latest", help="Giá trị mới nhất")
+    p_as_of = sub.add_parser("as-of", help="Giá trị đã biết tại một thời điểm phát hành")
+    p_as_of.add_argument("at", help="Thời điểm (ISO, vd. 2025-01-01T06:00+07:00)")
+    for p in (p_latest, p_as_of):
+        p.add_argument("--location", type=int, nargs="+", required=True,
+                       help="location_id, bắt buộc (khoá chính bắt đầu bằng location_id, tra theo index)")
+        p.add_argument("--variables", nargs="*", help="Tên cột, vd. pm2_5_cams temperature_2m")
+        p.add_argument("--start", help="Giờ dự báo từ (bao gồm)")
+        p.add_argument("--end", help="Giờ dự báo đến (không bao gồm)")
+        p.add_argument("--wide", action="store_true", help="Mỗi biến một cột")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    engine = get_db_engine()
+    filters = dict(location_ids=args.location, start=args.start, end=args.end, variables=args.variables, wide=args.wide)
+    if args.command == "latest":
+        df = latest_values(engine, **filters)
+    else:
+        df = values_as_of(engine, args.at, **filters)
+    print(df.to_string(index=False) if not df.empty else "Không có dữ liệu.")
+
+
+if __name__ == "__main__":
+    main()
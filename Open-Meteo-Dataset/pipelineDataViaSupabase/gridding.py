@@ -0,0 +1,207 @@
+"""
+NỘI SUY LƯỚI Ô NHIỄM TOÀN THÀNH PHỐ (IDW) VỚI MA TRẬN TRỌNG SỐ ĐƯỢC CACHE
+- Toạ độ trạm cố định -> trọng số IDW từ trạm tới từng ô lưới không đổi giữa các giờ.
+  Ma trận thưa W (n_ô x n_trạm, mỗi ô giữ k trạm gần nhất, w = 1 / d^power) được tính một lần
+  và lưu trong grid_cache/; khoá cache là hash của (location_id, lat, lon) các trạm + cấu hình lưới,
+  nên chỉ bị tính lại khi tập trạm (hoặc lưới) thay đổi.
+- Render cả một giờ hoặc cả một ngày bằng MỘT phép nhân ma trận thưa x ma trận (trạm x giờ):
+      lưới = (W @ V) / (W @ M)
+  với V = giá trị (NaN -> 0), M = mặt nạ trạm có dữ liệu; trạm thiếu giá trị ở giờ nào
+  tự động bị loại khỏi ô đó và trọng số được chuẩn hoá lại.
+
+Chạy thử:
+    python gridding.py --csv hanoi_realtime_data_updated.csv --column pm2_5_cams --date 2025-10-01 --out pm25_grid.npz
+"""
+import argparse
+import hashlib
+import logging
+import os
+from dataclasses import dataclass, asdict
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from timestamps import parse_timestamps
+
+
+logger = logging.getLogger("gridding")
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+GRID_CACHE_DIR = os.path.join(BASE_DIR, "grid_cache")
+EARTH_RADIUS_KM = 6371.0
+
+
+@dataclass(frozen=True)
+class GridSpec:
+    """Lưới lat/lon đều; mặc định bao phủ Hà Nội với bước 0.01° (~1.1 km)."""
+    lat_min: float = 20.56
+    lat_max: float = 21.39
+    lon_min: float = 105.28
+    lon_max: float = 106.02
+    step: float = 0.01
+
+    @property
+    def lats(self) -> np.ndarray:
+        return np.round(np.arange(self.lat_min, self.lat_max + self.step / 2, self.step), 6)
+
+    @property
+    def lons(self) -> np.ndarray:
+        return np.round(np.arange(self.lon_min, self.lon_max + self.step / 2, self.step), 6)
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return len(self.lats), len(self.lons)
+
+
+def _haversine_km(lat1, lon1, lat2, lon2) -> np.ndarray:
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+def build_idw_weights(station_lats, station_lons, grid: GridSpec, k: int = 8, power: float = 2.0,
+                      max_distance_km: float | None = None, chunk_size: int = 4096) -> sparse.csr_matrix:
+    """
+    Ma trận thưa (n_ô x n_trạm) chứa trọng số IDW CHƯA chuẩn hoá của k trạm gần nhất mỗi ô.
+    Ô trùng vị trí trạm (d < 1 m) chỉ lấy đúng trạm đó.
+    """
+    station_lats = np.asarray(station_lats, dtype=float)
+    station_lons = np.asarray(station_lons, dtype=float)
+    n_stations = len(station_lats)
+    k = min(k, n_stations)
+    cell_lat, cell_lon = (a.ravel() for a in np.meshgrid(grid.lats, grid.lons, indexing="ij"))
+    n_cells = len(cell_lat)
+
+    rows, cols, vals = [], [], []
+    # Chia theo khối ô để ma trận khoảng cách (khối x trạm) không quá lớn khi lưới mịn
+    for start in range(0, n_cells, chunk_size):
+        stop = min(start + chunk_size, n_cells)
+        dist = _haversine_km(cell_lat[start:stop, None], cell_lon[start:stop, None], station_lats[None, :], station_lons[None, :])
+        nearest = np.argpartition(dist, k - 1, axis=1)[:, :k] if k < n_stations else np.broadcast_to(np.arange(n_stations), dist.shape)
+        d = np.take_along_axis(dist, nearest, axis=1)
+
+        w = 1.0 / np.maximum(d, 1e-3) ** power
+        exact = d < 1e-3
+        w = np.where(exact.any(axis=1, keepdims=True), exact.astype(float), w)
+        if max_distance_km is not None:
+            w = np.where(d <= max_distance_km, w, 0.0)
+
+        rows.append(np.repeat(np.arange(start, stop), k))
+        cols.append(nearest.ravel())
+        vals.append(w.ravel())
+
+    weights = sparse.csr_matrix(
+        (np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))),
+        shape=(n_cells, n_stations),
+    )
+    weights.eliminate_zeros()
+    return weights
+
+
+def _cache_key(stations: pd.DataFrame, grid: GridSpec, k: int, power: float, max_distance_km) -> str:
+    ordered = stations.sort_values("location_id")
+    h = hashlib.sha1()
+    h.update(ordered[["location_id", "lat", "lon"]].to_csv(index=False).encode())
+    h.update(repr((sorted(asdict(grid).items()), k, power, max_distance_km)).encode())
+    return h.hexdigest()[:16]
+
+
+class GridInterpolator:
+    """
+    Nội suy giá trị tại các trạm lên lưới. Thứ tự trạm cố định theo location_id tăng dần.
+    Ma trận trọng số được nạp từ cache nếu tập trạm và cấu hình lưới không đổi.
+    """
+
+    def __init__(self, stations: pd.DataFrame, grid: GridSpec = GridSpec(), k: int = 8, power: float = 2.0,
+                 max_distance_km: float | None = None, cache_dir: str | None = GRID_CACHE_DIR):
+        stations = stations.drop_duplicates("location_id").sort_values("location_id")
+        self.grid = grid
+        self.location_ids = stations["location_id"].to_numpy(dtype=np.int64)
+        self.key = _cache_key(stations, grid, k, power, max_distance_km)
+        self.cache_path = os.path.join(cache_dir, f"idw_{self.key}.npz") if cache_dir else None
+
+        self.weights = self._load_cache()
+        if self.weights is None:
+            logger.info(f" -> Tính ma trận trọng số IDW cho {len(stations)} trạm x {grid.shape[0] * grid.shape[1]} ô lưới...")
+            self.weights = build_idw_weights(stations["lat"], stations["lon"], grid, k, power, max_distance_km)
+            self._save_cache(cache_dir)
+
+    def _load_cache(self) -> sparse.csr_matrix | None:
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return None
+        with np.load(self.cache_path) as data:
+            if not np.array_equal(data["location_ids"], self.location_ids):
+                return None
+            logger.info(f" -> Dùng ma trận trọng số IDW đã cache: {self.cache_path}")
+            return sparse.csr_matrix((data["data"], data["indices"], data["indptr"]), shape=tuple(data["shape"]))
+
+    def _save_cache(self, cache_dir: str | None):
+        if not self.cache_path:
+            return
+        os.makedirs(cache_dir, exist_ok=True)
+        # Tập trạm / lưới đã đổi -> các ma trận cũ không còn dùng được
+        for name in os.listdir(cache_dir):
+            if name.startswith("idw_") and name.endswith(".npz") and name != os.path.basename(self.cache_path):
+                os.remove(os.path.join(cache_dir, name))
+        tmp_path = self.cache_path + ".tmp.npz"
+        np.savez(tmp_path, data=self.weights.data, indices=self.weights.indices, indptr=self.weights.indptr,
+                 shape=np.array(self.weights.shape), location_ids=self.location_ids)
+        os.replace(tmp_path, self.cache_path)
+
+    def render(self, values: np.ndarray) -> np.ndarray:
+        """
+        values: mảng (n_trạm x n_giờ) theo thứ tự self.location_ids (NaN = thiếu).
+        Trả về mảng (n_giờ, n_lat, n_lon); ô không có trạm nào có dữ liệu -> NaN.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        if values.ndim == 1:
+            values = values[:, None]
+        mask = ~np.isnan(values)
+        numerator = self.weights @ np.where(mask, values, 0.0)
+        denominator = self.weights @ mask.astype(np.float64)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            grids = np.where(denominator > 0, numerator / denominator, np.nan)
+        return grids.T.reshape(values.shape[1], *self.grid.shape)
+
+    def station_matrix(self, df: pd.DataFrame, column: str) -> tuple[pd.DatetimeIndex, np.ndarray]:
+        """Chuyển dữ liệu dạng dài (location_id, datetime, column) thành ma trận trạm x giờ."""
+        wide = df.pivot_table(index="location_id", columns="datetime", values=column, aggfunc="mean")
+        wide = wide.reindex(self.location_ids)
+        return pd.DatetimeIndex(wide.columns), wide.to_numpy(dtype=np.float64)
+
+    def render_frame(self, df: pd.DataFrame, column: str = "pm2_5_cams") -> tuple[pd.DatetimeIndex, np.ndarray]:
+        """Render tất cả các giờ có trong df bằng một phép nhân ma trận. Trả về (các giờ, lưới)."""
+        times, values = self.station_matrix(df, column)
+        return times, self.render(values)
+
+
+def main():
+    from etl_core import METADATA_FILE_PATH, OUTPUT_CSV_FILE, read_metadata
+
+    parser = argparse.ArgumentParser(description="Nội suy IDW giá trị trạm lên lưới lat/lon.")
+    parser.add_argument("--csv", default=OUTPUT_CSV_FILE, help="File dữ liệu giờ (location_id, datetime, ...)")
+    parser.add_argument("--column", default="pm2_5_cams")
+    parser.add_argument("--date", help="Ngày cần render (YYYY-MM-DD, giờ VN); mặc định: ngày mới nhất trong file")
+    parser.add_argument("--step", type=float, default=GridSpec.step, help="Bước lưới (độ)")
+    parser.add_argument("--k", type=int, default=8, help="Số trạm gần nhất cho mỗi ô")
+    parser.add_argument("--power", type=float, default=2.0)
+    parser.add_argument("--out", default="grid.npz")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    interpolator = GridInterpolator(read_metadata(METADATA_FILE_PATH), GridSpec(step=args.step), k=args.k, power=args.power)
+
+    df = pd.read_csv(args.csv, usecols=["location_id", "datetime", args.column])
+    df["datetime"] = parse_timestamps(df["datetime"], naive_tz="Asia/Bangkok", tz="Asia/Bangkok")
+    day = pd.Timestamp(args.date).date() if args.date else df["datetime"].max().date()
+    df = df[df["datetime"].dt.date == day]
+
+    times, grids = interpolator.render_frame(df, args.column)
+    np.savez_compressed(args.out, lats=interpolator.grid.lats, lons=interpolator.grid.lons,
+                        times=np.array(times.strftime("%Y-%m-%dT%H:%M%z"), dtype=str), grids=grids.astype(np.float32))
+    logger.info(f" -> Đã render {len(times)} giờ ({grids.shape[1]}x{grids.shape[2]} ô) ngày {day} vào '{args.out}'.")
+
+
+if __name__ == "__main__":
+    main()
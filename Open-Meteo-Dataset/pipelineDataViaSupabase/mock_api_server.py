@@ -0,0 +1,321 @@
+# Mục đích: Server HTTP giả lập Open-Meteo (/v1/forecast, /v1/air-quality) và OpenAQ (/v3/locations)
+# để chạy thử / load-test phần fetch (song song, retry, rate limit) mà không cần gọi API thật.
+#
+# - Open-Meteo: trả về payload FlatBuffers (size-prefixed) mà openmeteo_requests giải mã được.
+# - Chuỗi dữ liệu là tổng hợp nhưng xác định: cùng (lat, lon, biến, thời điểm) luôn cho cùng giá trị.
+# - Có thể cấu hình độ trễ, tỉ lệ lỗi 500 và tỉ lệ 429 (kèm Retry-After).
+#
+# Cách dùng:
+#   python mock_api_server.py --port 8080 --latency 0.2 --error-rate 0.05 --throttle-rate 0.1
+#   export OPENMETEO_BASE_URL=http://127.0.0.1:8080    # hoặc đặt trong .env
+#   export OPENAQ_BASE_URL=http://127.0.0.1:8080       # các notebook crawl OpenAQ đọc biến này
+#   python etl_sync.py
+
+import argparse
+import calendar
+import csv
+import json
+import os
+import random
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import flatbuffers
+import numpy as np
+
+from response_decoder import past_days_window, SECONDS_PER_DAY
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+METADATA_FILE_PATH = os.path.join(BASE_DIR, "../stations_metadata.csv")
+
+# Offset UTC (giây) của các timezone mà pipeline dùng
+TZ_OFFSETS = {"Asia/Bangkok": 7 * 3600, "Asia/Ho_Chi_Minh": 7 * 3600, "auto": 7 * 3600, "GMT": 0, "UTC": 0}
+
+# biến -> (giá trị nền, biên độ dao động theo ngày, giá trị nhỏ nhất)
+SERIES_PROFILES = {
+    "temperature_2m": (28.0, 4.0, None),
+    "relative_humidity_2m": (75.0, 15.0, 0.0),
+    "precipitation": (0.1, 0.3, 0.0),
+    "rain": (0.1, 0.3, 0.0),
+    "wind_speed_10m": (8.0, 3.0, 0.0),
+    "wind_direction_10m": (180.0, 170.0, 0.0),
+    "pressure_msl": (1010.0, 3.0, None),
+    "boundary_layer_height": (600.0, 400.0, 20.0),
+    "pm10": (60.0, 25.0, 0.0),
+    "pm2_5": (40.0, 20.0, 0.0),
+    "carbon_monoxide": (600.0, 200.0, 0.0),
+    "nitrogen_dioxide": (30.0, 10.0, 0.0),
+    "sulphur_dioxide": (15.0, 5.0, 0.0),
+    "ozone": (50.0, 30.0, 0.0),
+}
+
+
+# --- SINH DỮ LIỆU ---
+
+def synthetic_series(lat: float, lon: float, variable: str, t0: int, n_steps: int, interval: int = 3600) -> np.ndarray:
+    """
+    Chuỗi giá trị xác định cho (lat, lon, biến) tại các thời điểm t0, t0+interval, ...
+    Dao động hình sin theo chu kỳ ngày + nhiễu giả ngẫu nhiên băm từ (seed, giờ),
+    nên hai cửa sổ chồng nhau luôn trả về cùng giá trị cho cùng một giờ.
+    """
+    base, amp, floor = SERIES_PROFILES.get(variable, (10.0, 5.0, None))
+    seed = zlib.crc32(f"{lat:.4f},{lon:.4f},{variable}".encode())
+    t = t0 + np.arange(n_steps, dtype=np.int64) * interval
+    phase = (seed % 360) * np.pi / 180
+    noise = ((t // 3600) * 2654435761 + seed) % 2**32 / 2**32 - 0.5
+    values = base + amp * np.sin(2 * np.pi * t / SECONDS_PER_DAY + phase) + 0.3 * amp * noise
+    if floor is not None:
+        values = np.maximum(values, floor)
+    return values.astype(np.float32)
+
+
+def build_weather_api_response(lat: float, lon: float, timezone: str, utc_offset: int,
+                               t0: int, n_steps: int, variables: list, interval: int = 3600) -> bytes:
+    """
+    Dựng một WeatherApiResponse (FlatBuffers, có 4 byte độ dài ở đầu) chỉ có khối Hourly.
+    Slot theo schema openmeteo_sdk: WeatherApiResponse(latitude=0, longitude=1, utc_offset_seconds=6,
+    timezone=7, hourly=11), VariablesWithTime(time=0, time_end=1, interval=2, variables=3),
+    VariableWithValues(values=3).
+    """
+    series = [synthetic_series(lat, lon, v, t0, n_steps, interval) for v in variables]
+    builder = flatbuffers.Builder(1024 + sum(s.nbytes for s in series))
+
+    var_offsets = []
+    for values in series:
+        values_vec = builder.CreateNumpyVector(values)
+        builder.StartObject(13)
+        builder.PrependUOffsetTRelativeSlot(3, values_vec, 0)
+        var_offsets.append(builder.EndObject())
+
+    builder.StartVector(4, len(var_offsets), 4)
+    for off in reversed(var_offsets):
+        builder.PrependUOffsetTRelative(off)
+    variables_vec = builder.EndVector()
+
+    builder.StartObject(4)
+    builder.PrependInt64Slot(0, t0, 0)
+    builder.PrependInt64Slot(1, t0 + n_steps * interval, 0)
+    builder.PrependInt32Slot(2, interval, 0)
+    builder.PrependUOffsetTRelativeSlot(3, variables_vec, 0)
+    hourly = builder.EndObject()
+
+    tz_str = builder.CreateString(timezone)
+    builder.StartObject(15)
+    builder.PrependFloat32Slot(0, lat, 0.0)
+    builder.PrependFloat32Slot(1, lon, 0.0)
+    builder.PrependInt32Slot(6, utc_offset, 0)
+    builder.PrependUOffsetTRelativeSlot(7, tz_str, 0)
+    builder.PrependUOffsetTRelativeSlot(11, hourly, 0)
+    root = builder.EndObject()
+    builder.FinishSizePrefixed(root)
+    return bytes(builder.Output())
+
+
+def _parse_hour(value: str, utc_offset: int) -> int:
+    """'YYYY-MM-DDTHH:MM' hoặc 'YYYY-MM-DD' (giờ địa phương) -> epoch giây UTC."""
+    fmt = "%Y-%m-%dT%H:%M" if "T" in value else "%Y-%m-%d"
+    return calendar.timegm(time.strptime(value, fmt)) - utc_offset
+
+
+def resolve_window(params: dict, utc_offset: int) -> tuple[int, int]:
+    """Suy ra (t0, n_steps) từ past_days/forecast_days hoặc start_hour/end_hour hoặc start_date/end_date."""
+    if "start_hour" in params and "end_hour" in params:
+        t0 = _parse_hour(params["start_hour"], utc_offset)
+        t1 = _parse_hour(params["end_hour"], utc_offset) + 3600  # end_hour là bao gồm
+    elif "start_date" in params and "end_date" in params:
+        t0 = _parse_hour(params["start_date"], utc_offset)
+        t1 = _parse_hour(params["end_date"], utc_offset) + SECONDS_PER_DAY
+    else:
+        past_days = int(params.get("past_days", 0))
+        forecast_days = int(params.get("forecast_days", 7))
+        return past_days_window(past_days, forecast_days, utc_offset_seconds=utc_offset)
+    return t0, max((t1 - t0) // 3600, 0)
+
+
+def load_openaq_locations(metadata_path: str = METADATA_FILE_PATH) -> list[dict]:
+    """Danh sách location kiểu OpenAQ v3 dựng từ stations_metadata.csv (nếu có)."""
+    if not os.path.exists(metadata_path):
+        return []
+    locations = []
+    with open(metadata_path, encoding="utf-8-sig") as f:
+        for row in csv.DictReader(f):
+            locations.append({
+                "id": int(row["location_id"]),
+                "name": row["name"],
+                "locality": None,
+                "timezone": "Asia/Bangkok",
+                "country": {"id": 56, "code": "VN", "name": "Vietnam"},
+                "coordinates": {"latitude": float(row["lat"]), "longitude": float(row["lon"])},
+                "sensors": [],
+                "datetimeFirst": {"utc": row["start_date"]},
+                "datetimeLast": {"utc": row["end_date"]},
+            })
+    return locations
+
+
+# --- HTTP SERVER ---
+
+class MockApiHandler(BaseHTTPRequestHandler):
+    """Handler cho các route giả lập. Cấu hình lỗi/độ trễ nằm ở `self.server.config`."""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        if self.server.config.get("verbose"):
+            super().log_message(format, *args)
+
+    def _send(self, status: int, body: bytes, content_type: str, headers: dict | None = None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status: int, payload: dict, headers: dict | None = None):
+        self._send(status, json.dumps(payload, ensure_ascii=False).encode("utf-8"), "application/json", headers)
+
+    def _inject_faults(self) -> bool:
+        """Mô phỏng độ trễ / 429 / 500. Trả về True nếu đã trả response lỗi."""
+        cfg = self.server.config
+        self.server.count("requests")
+        delay = cfg["latency"] + random.uniform(0, cfg["jitter"])
+        if delay > 0:
+            time.sleep(delay)
+        roll = random.random()
+        if roll < cfg["throttle_rate"]:
+            self.server.count("throttled")
+            self._send_json(429, {"error": True, "reason": "Too many concurrent requests"},
+                            {"Retry-After": str(cfg["retry_after"])})
+            return True
+        if roll < cfg["throttle_rate"] + cfg["error_rate"]:
+            self.server.count("errors")
+            self._send_json(500, {"error": True, "reason": "Injected server error"})
+            return True
+        return False
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        try:
+            if url.path in ("/v1/forecast", "/v1/air-quality"):
+                if not self._inject_faults():
+                    self._handle_open_meteo(query)
+            elif url.path == "/v3/locations":
+                if not self._inject_faults():
+                    self._handle_openaq_locations(query)
+            elif url.path == "/stats":
+                self._send_json(200, self.server.stats())
+            else:
+                self._send_json(404, {"error": True, "reason": f"Unknown route {url.path}"})
+        except (ValueError, KeyError) as e:
+            self._send_json(400, {"error": True, "reason": str(e)})
+
+    def _handle_open_meteo(self, query: dict):
+        params = {k: v[-1] for k, v in query.items()}
+        # requests mã hoá list thành nhiều tham số `hourly=...`, API thật cũng chấp nhận dạng "a,b,c"
+        variables = [v for item in query.get("hourly", []) for v in item.split(",") if v]
+        if not variables:
+            raise ValueError("Thiếu tham số 'hourly'")
+        timezone = params.get("timezone", "GMT")
+        utc_offset = TZ_OFFSETS.get(timezone, 0)
+        t0, n_steps = resolve_window(params, utc_offset)
+
+        # Nhiều toạ độ cách nhau bằng dấu phẩy -> nhiều message nối tiếp, giống API thật
+        lats = [float(x) for x in params["latitude"].split(",")]
+        lons = [float(x) for x in params["longitude"].split(",")]
+        if len(lats) != len(lons):
+            raise ValueError("latitude và longitude phải có cùng số phần tử")
+        body = b"".join(
+            build_weather_api_response(lat, lon, timezone, utc_offset, t0, n_steps, variables)
+            for lat, lon in zip(lats, lons)
+        )
+        self.server.count("ok")
+        self._send(200, body, "application/octet-stream")
+
+    def _handle_openaq_locations(self, query: dict):
+        params = {k: v[-1] for k, v in query.items()}
+        locations = self.server.locations
+        if "bbox" in params:
+            min_lon, min_lat, max_lon, max_lat = (float(x) for x in params["bbox"].split(","))
+            locations = [
+                loc for loc in locations
+                if min_lat <= loc["coordinates"]["latitude"] <= max_lat
+                and min_lon <= loc["coordinates"]["longitude"] <= max_lon
+            ]
+        limit = int(params.get("limit", 100))
+        page = int(params.get("page", 1))
+        results = locations[(page - 1) * limit: page * limit]
+        self.server.count("ok")
+        self._send_json(200, {
+            "meta": {"name": "openaq-api", "website": "/", "page": page, "limit": limit, "found": len(locations)},
+            "results": results,
+        })
+
+
+class MockApiServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, config: dict):
+        super().__init__(address, MockApiHandler)
+        self.config = config
+        self.locations = load_openaq_locations(config.get("metadata_file", METADATA_FILE_PATH))
+        self._counts = {"requests": 0, "ok": 0, "errors": 0, "throttled": 0}
+        self._lock = threading.Lock()
+
+    def count(self, key: str):
+        with self._lock:
+            self._counts[key] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._counts)
+
+
+def start_server(host: str = "127.0.0.1", port: int = 0, **config) -> MockApiServer:
+    """
+    Khởi động server trên một thread nền (dùng trong script load-test).
+    port=0 để hệ điều hành chọn cổng trống; base URL là f"http://{host}:{server.server_port}".
+    """
+    cfg = {"latency": 0.0, "jitter": 0.0, "error_rate": 0.0, "throttle_rate": 0.0, "retry_after": 1, "verbose": False}
+    cfg.update(config)
+    server = MockApiServer((host, port), cfg)
+    threading.Thread(target=server.serve_forever, name="mock-api", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Server giả lập Open-Meteo / OpenAQ cho load-test offline.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.0, help="Độ trễ cố định mỗi request (giây)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Độ trễ ngẫu nhiên thêm vào, 0..jitter (giây)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Tỉ lệ request trả về 500")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Tỉ lệ request trả về 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="Giá trị header Retry-After cho 429 (giây)")
+    parser.add_argument("--seed", type=int, default=None, help="Seed cho việc chọn request bị lỗi")
+    parser.add_argument("--verbose", action="store_true", help="In log từng request")
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        random.seed(args.seed)
+    server = MockApiServer((args.host, args.port), {
+        "latency": args.latency, "jitter": args.jitter, "error_rate": args.error_rate,
+        "throttle_rate": args.throttle_rate, "retry_after": args.retry_after, "verbose": args.verbose,
+    })
+    print(f"Mock API đang chạy tại http://{args.host}:{server.server_port}")
+    print(f"  export OPENMETEO_BASE_URL=http://{args.host}:{server.server_port}")
+    print(f"  export OPENAQ_BASE_URL=http://{args.host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"\nDừng server. Thống kê: {server.stats()}")
+
+
+if __name__ == "__main__":
+    main()
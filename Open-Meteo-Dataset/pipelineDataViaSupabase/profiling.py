@@ -0,0 +1,207 @@
+"""
+CHẾ ĐỘ PROFILE THEO TỪNG BƯỚC (--profile)
+- Mỗi bước đánh số của job ("Bước 1/3", print_step(...) trong combineData.py, ...) gọi step(tên):
+  bước trước được đóng lại, bước mới bắt đầu với cProfile + tracemalloc riêng.
+- Khi chưa enable() thì step()/end_stage() không làm gì, nên có thể gọi ở mọi nơi.
+- finish() ghi vào thư mục output:
+    report.txt          thời gian wall/CPU, đỉnh bộ nhớ (tracemalloc), top hàm theo cumulative,
+                        top dòng code cấp phát bộ nhớ, kích thước các DataFrame trong hàm đang chạy bước đó
+    stage_XX.prof       dữ liệu cProfile thô của từng bước (mở bằng snakeviz / pstats)
+    stacks.collapsed    stack dạng "bước;hàm;hàm con <micro giây>" cho flamegraph.pl / speedscope
+Lưu ý: cProfile chỉ đo luồng gọi step(); thời gian trong ThreadPoolExecutor (fetch song song)
+hiện ra dưới dạng chờ trong concurrent.futures, còn tracemalloc đo cấp phát của mọi luồng.
+"""
+import cProfile
+import io
+import os
+import pstats
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+PROFILE_DIR = os.path.join(BASE_DIR, "profiles")
+
+_profiler = None
+
+
+def _fmt_bytes(n: float) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if abs(n) < 1024 or unit == "GB":
+            return f"{n:.1f} {unit}"
+        n /= 1024
+
+
+def _label(func) -> str:
+    filename, line, name = func
+    if filename == "~":
+        return name
+    return f"{os.path.basename(filename)}:{name}:{line}"
+
+
+def collapsed_stacks(stats: pstats.Stats, root: str, min_us: int = 1) -> list[str]:
+    """
+    Dựng stack dạng collapsed từ đồ thị gọi hàm của cProfile. Thời gian của một hàm được chia cho
+    các đường gọi theo tỉ lệ thời gian cộng dồn mà mỗi hàm gọi (caller) đóng góp.
+    """
+    entries = stats.stats
+    callees = {}
+    for func, (_, _, _, _, callers) in entries.items():
+        for caller, edge in callers.items():
+            callees.setdefault(caller, []).append((func, edge[3]))
+
+    lines = []
+
+    def walk(func, stack, path_time):
+        _, _, tt, ct, _ = entries[func]
+        frames = stack + [_label(func)]
+        own_us = int(tt * (path_time / ct) * 1e6) if ct > 0 else 0
+        if own_us >= min_us:
+            lines.append(f"{';'.join(frames)} {own_us}")
+        for callee, edge_ct in callees.get(func, []):
+            child_time = path_time * (edge_ct / ct) if ct > 0 else 0.0
+            if callee in visiting or callee[0] == __file__ or child_time * 1e6 < min_us:
+                continue
+            visiting.add(callee)
+            walk(callee, frames, child_time)
+            visiting.discard(callee)
+
+    # Bỏ các hàm của chính profiler (step/begin/end) khỏi stack
+    roots = [f for f, (_, _, _, _, callers) in entries.items() if not callers and f[0] != __file__]
+    for func in roots:
+        visiting = {func}
+        walk(func, [root], entries[func][3])
+    return lines
+
+
+class StageProfiler:
+    def __init__(self, output_dir: str, top_functions: int = 15, top_allocations: int = 10):
+        self.output_dir = output_dir
+        self.top_functions = top_functions
+        self.top_allocations = top_allocations
+        self.stages = []
+        self.current = None
+        self.started_tracemalloc = False
+
+    def begin(self, name: str, frame=None):
+        self.end()
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracemalloc = True
+        tracemalloc.reset_peak()
+        stage = {
+            "index": len(self.stages) + 1,
+            "name": name,
+            "frame": frame,
+            "snapshot": tracemalloc.take_snapshot(),
+            "mem_start": tracemalloc.get_traced_memory()[0],
+            "wall_start": time.perf_counter(),
+            "cpu_start": time.process_time(),
+            "profile": cProfile.Profile(),
+        }
+        self.current = stage
+        stage["profile"].enable()
+
+    def end(self):
+        stage = self.current
+        if stage is None:
+            return
+        stage["profile"].disable()
+        stage["wall"] = time.perf_counter() - stage.pop("wall_start")
+        stage["cpu"] = time.process_time() - stage.pop("cpu_start")
+        current, peak = tracemalloc.get_traced_memory()
+        stage["mem_peak"] = peak - stage["mem_start"]
+        stage["mem_delta"] = current - stage["mem_start"]
+        # Loại cấp phát của chính tracemalloc/profiler (do take_snapshot) khỏi danh sách
+        ignore = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+        after = tracemalloc.take_snapshot().filter_traces(ignore)
+        stage["allocations"] = after.compare_to(stage.pop("snapshot").filter_traces(ignore), "lineno")[:self.top_allocations]
+        stage["frames"] = self._frame_sizes(stage.pop("frame"))
+        self.stages.append(stage)
+        self.current = None
+
+    @staticmethod
+    def _frame_sizes(frame) -> list[tuple[str, tuple, int]]:
+        """Kích thước (shape, bộ nhớ deep) của các DataFrame là biến cục bộ trong hàm chạy bước."""
+        pd = sys.modules.get("pandas")
+        if frame is None or pd is None:
+            return []
+        sizes = []
+        for name, value in list(frame.f_locals.items()):
+            if isinstance(value, pd.DataFrame):
+                sizes.append((name, value.shape, int(value.memory_usage(deep=True).sum())))
+        return sizes
+
+    def write(self) -> str:
+        self.end()
+        os.makedirs(self.output_dir, exist_ok=True)
+        out = io.StringIO()
+        out.write(f"PROFILE {datetime.now():%Y-%m-%d %H:%M:%S} - {' '.join(sys.argv)}\n\n")
+        out.write(f"{'#':>3}  {'wall (s)':>9}  {'cpu (s)':>8}  {'peak mem':>10}  {'net mem':>10}  bước\n")
+        for s in self.stages:
+            out.write(f"{s['index']:>3}  {s['wall']:9.3f}  {s['cpu']:8.3f}  {_fmt_bytes(s['mem_peak']):>10}  "
+                      f"{_fmt_bytes(s['mem_delta']):>10}  {s['name']}\n")
+
+        collapsed = []
+        for s in self.stages:
+            out.write(f"\n{'=' * 70}\n[{s['index']}] {s['name']}\n{'=' * 70}\n")
+            out.write(f"wall {s['wall']:.3f}s | cpu {s['cpu']:.3f}s | peak {_fmt_bytes(s['mem_peak'])} | net {_fmt_bytes(s['mem_delta'])}\n")
+            if s["frames"]:
+                out.write("\nDataFrame:\n")
+                for name, shape, nbytes in s["frames"]:
+                    out.write(f"  {name:<28} {str(shape):<18} {_fmt_bytes(nbytes)}\n")
+            out.write("\nCấp phát bộ nhớ nhiều nhất (tracemalloc):\n")
+            for diff in s["allocations"]:
+                out.write(f"  {_fmt_bytes(diff.size_diff):>10}  {diff.count_diff:>8} khối  {diff.traceback[0]}\n")
+
+            stats = pstats.Stats(s["profile"], stream=out)
+            stats.dump_stats(os.path.join(self.output_dir, f"stage_{s['index']:02d}.prof"))
+            out.write("\nTop hàm (cumulative):\n")
+            stats.sort_stats("cumulative").print_stats(self.top_functions)
+            collapsed += collapsed_stacks(stats, f"{s['index']:02d} {s['name']}".replace(";", ","))
+
+        with open(os.path.join(self.output_dir, "stacks.collapsed"), "w", encoding="utf-8") as f:
+            f.write("\n".join(collapsed) + "\n")
+        report_path = os.path.join(self.output_dir, "report.txt")
+        with open(report_path, "w", encoding="utf-8") as f:
+            f.write(out.getvalue())
+        if self.started_tracemalloc:
+            tracemalloc.stop()
+        return report_path
+
+
+# --- API dùng trong các job (không làm gì nếu chưa enable) ---
+
+def enable(output_dir: str | None = None) -> StageProfiler:
+    global _profiler
+    output_dir = output_dir or os.path.join(PROFILE_DIR, datetime.now().strftime("%Y%m%d_%H%M%S"))
+    _profiler = StageProfiler(output_dir)
+    return _profiler
+
+
+def is_enabled() -> bool:
+    return _profiler is not None
+
+
+def step(name: str, caller_depth: int = 1):
+    """Kết thúc bước đang đo (nếu có) và bắt đầu bước `name`. `caller_depth`: số frame phía trên
+    tới hàm chứa các biến DataFrame của job (1 = hàm gọi step, 2 = nếu gọi qua print_step...)."""
+    if _profiler is not None:
+        _profiler.begin(name, sys._getframe(caller_depth))
+
+
+def end_stage():
+    if _profiler is not None:
+        _profiler.end()
+
+
+def finish() -> str | None:
+    """Ghi báo cáo và tắt profile. Trả về đường dẫn report.txt (None nếu chưa enable)."""
+    global _profiler
+    if _profiler is None:
+        return None
+    report_path = _profiler.write()
+    _profiler = None
+    return report_path
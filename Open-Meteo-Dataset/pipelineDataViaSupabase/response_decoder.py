@@ -0,0 +1,95 @@
+"""
+GIẢI MÃ RESPONSE OPEN-METEO VÀO MỘT KHỐI NUMPY CẤP PHÁT SẴN
+- Toàn bộ run (mọi trạm x mọi giờ x mọi biến) dùng chung một mảng 2D.
+- Vị trí dòng được tính bằng số học từ Time()/Interval(): dòng = trạm * n_steps + bước giờ.
+- DataFrame chỉ được tạo MỘT lần ở cuối, không merge/concat theo từng trạm.
+"""
+import time
+
+import numpy as np
+import pandas as pd
+
+
+SECONDS_PER_DAY = 86400
+VN_UTC_OFFSET_SECONDS = 7 * 3600
+
+
+def past_days_window(num_past_days: int, forecast_days: int = 1,
+                     utc_offset_seconds: int = VN_UTC_OFFSET_SECONDS, now: float | None = None):
+    """
+    Tính cửa sổ thời gian mà Open-Meteo trả về cho `past_days` + `forecast_days`
+    khi request với timezone địa phương: từ 0h (giờ địa phương) của `num_past_days` ngày trước
+    đến 0h của ngày sau ngày dự báo cuối cùng.
+    Trả về (start_epoch_utc, số bước giờ).
+    """
+    now = time.time() if now is None else now
+    local_midnight = (int(now) + utc_offset_seconds) // SECONDS_PER_DAY * SECONDS_PER_DAY
+    start = local_midnight - utc_offset_seconds - num_past_days * SECONDS_PER_DAY
+    n_steps = (num_past_days + forecast_days) * 24
+    return start, n_steps
+
+
+class HourlyBlock:
+    """
+    Khối giá trị (n_stations * n_steps, n_columns) được cấp phát một lần, khởi tạo NaN.
+    Mỗi response chỉ ghi các mảng biến của nó vào đúng lát cắt dòng/cột, không tạo DataFrame trung gian.
+    """
+
+    def __init__(self, location_ids, lats, lons, columns, start: int, n_steps: int,
+                 interval: int = 3600, dtype=np.float32):
+        self.location_ids = np.asarray(location_ids)
+        self.lats = np.asarray(lats, dtype=np.float64)
+        self.lons = np.asarray(lons, dtype=np.float64)
+        self.columns = list(columns)
+        self.col_index = {c: i for i, c in enumerate(self.columns)}
+        self.start = int(start)
+        self.n_steps = int(n_steps)
+        self.interval = int(interval)
+
+        n_rows = len(self.location_ids) * self.n_steps
+        self.values = np.full((n_rows, len(self.columns)), np.nan, dtype=dtype)
+        # Đánh dấu các dòng đã có ít nhất một response ghi vào (tương đương outer merge cũ)
+        self.filled = np.zeros(n_rows, dtype=bool)
+
+    def write(self, station_idx: int, hourly, columns) -> int:
+        """
+        Ghi các biến của một khối Hourly (thứ tự trùng với `columns`) cho trạm `station_idx`.
+        Phần nằm ngoài cửa sổ của khối bị cắt bỏ. Trả về số bước giờ đã ghi.
+        """
+        interval = hourly.Interval()
+        if interval != self.interval:
+            raise ValueError(f"Interval {interval}s không khớp với khối ({self.interval}s).")
+
+        t0 = hourly.Time()
+        offset = (t0 - self.start) // interval
+        n = (hourly.TimeEnd() - t0) // interval
+        lo, hi = max(offset, 0), min(offset + n, self.n_steps)
+        if hi <= lo:
+            return 0
+
+        base = station_idx * self.n_steps
+        rows = slice(base + lo, base + hi)
+        src = slice(lo - offset, hi - offset)
+        for i, col in enumerate(columns):
+            self.values[rows, self.col_index[col]] = hourly.Variables(i).ValuesAsNumpy()[src]
+        self.filled[rows] = True
+        return hi - lo
+
+    def to_frame(self, tz: str = "Asia/Bangkok", until: float | None = None) -> pd.DataFrame:
+        """
+        Dựng DataFrame cuối cùng: datetime, các cột giá trị, location_id, lat, lon.
+        Chỉ giữ các dòng đã được ghi và (nếu có) có thời điểm <= `until` (epoch giây).
+        """
+        rows = np.flatnonzero(self.filled)
+        station_idx, step = np.divmod(rows, self.n_steps)
+        epoch = self.start + step.astype(np.int64) * self.interval
+        if until is not None:
+            keep = epoch <= until
+            rows, station_idx, epoch = rows[keep], station_idx[keep], epoch[keep]
+
+        df = pd.DataFrame(self.values[rows], columns=self.columns)
+        df.insert(0, "datetime", pd.to_datetime(epoch, unit="s", utc=True).tz_convert(tz))
+        df["location_id"] = self.location_ids[station_idx]
+        df["lat"] = self.lats[station_idx]
+        df["lon"] = self.lons[station_idx]
+        return df
@@ -0,0 +1,128 @@
+"""
+HÀNG ĐỢI RETRY BỀN VỮNG CHO CÁC LẦN FETCH THẤT BẠI
+- Mỗi entry = (location_id, api, cửa sổ thời gian [start, end) theo epoch giây), khoá theo
+  (location_id, api, start): trạm lỗi liên tục chỉ kéo dài `end` của entry thay vì sinh thêm
+  một entry mới mỗi giờ.
+- Lưu dạng JSON-lines cạnh file log, mỗi dòng một entry.
+- Lần chạy sau lấy các entry đã đến hạn (next_eligible <= now) để gọi lại đúng phần bị thiếu,
+  thất bại tiếp thì lùi thời gian theo cấp số nhân (exponential backoff).
+"""
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+
+logger = logging.getLogger("retry_queue")
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+RETRY_QUEUE_PATH = os.path.join(BASE_DIR, "fetch_retry_queue.jsonl")
+
+
+class RetryQueue:
+    """
+    Hàng đợi các (location_id, api, start, end) fetch thất bại, kèm số lần thử và thời điểm được thử lại.
+    Gọi save() sau khi cập nhật để ghi xuống file. An toàn khi nhiều thread fetch cùng cập nhật.
+    """
+
+    def __init__(self, path: str = RETRY_QUEUE_PATH, base_delay: float = 300.0,
+                 max_delay: float = 6 * 3600.0, max_attempts: int = 10):
+        self.path = path
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+        self.entries = {}
+        self._lock = threading.RLock()
+        self._load()
+
+    @staticmethod
+    def _key(location_id, api, start):
+        return (int(location_id), str(api), int(start))
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding="utf-8") as f:
+            for line_no, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                    key = self._key(entry["location_id"], entry["api"], entry["start"])
+                    entry["end"] = int(entry["end"])
+                except (ValueError, KeyError) as e:
+                    logger.warning(f"  - Bỏ qua dòng {line_no} hỏng trong '{self.path}': {e}")
+                    continue
+                # File cũ có thể có nhiều entry cùng start khác end -> gộp thành một, giữ end xa nhất
+                if key in self.entries:
+                    entry["end"] = max(entry["end"], self.entries[key]["end"])
+                    entry["attempts"] = max(entry.get("attempts", 0), self.entries[key].get("attempts", 0))
+                self.entries[key] = entry
+
+    def save(self):
+        """Ghi toàn bộ hàng đợi ra file (ghi file tạm rồi os.replace để không bị hỏng giữa chừng)."""
+        tmp_path = f"{self.path}.tmp"
+        with self._lock, open(tmp_path, "w", encoding="utf-8") as f:
+            for entry in self.entries.values():
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, self.path)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add_failure(self, location_id, api, start, end, error, now: float | None = None, **extra):
+        """
+        Ghi nhận một lần thất bại: tạo entry mới hoặc tăng số lần thử và lùi hạn thử lại.
+        Entry cùng (location_id, api, start) đã có thì được kéo dài tới `end` mới (nếu xa hơn).
+        `extra` (vd. lat/lon) được lưu kèm entry để lần sau gọi lại không cần metadata.
+        """
+        now = time.time() if now is None else now
+        key = self._key(location_id, api, start)
+        with self._lock:
+            return self._add_failure(key, int(end), error, now, extra)
+
+    def _add_failure(self, key, end, error, now, extra):
+        entry = self.entries.get(key) or {
+            "location_id": key[0], "api": key[1], "start": key[2], "end": end,
+            "attempts": 0, "first_failed": now,
+        }
+        entry["end"] = max(entry["end"], end)
+        entry.update(extra)
+        entry["attempts"] += 1
+        entry["last_error"] = str(error)[:500]
+
+        if entry["attempts"] >= self.max_attempts:
+            logger.error(f"  - Bỏ entry retry {key} sau {entry['attempts']} lần thất bại: {entry['last_error']}")
+            self.entries.pop(key, None)
+            return None
+
+        delay = min(self.base_delay * 2 ** (entry["attempts"] - 1), self.max_delay)
+        entry["next_eligible"] = now + delay * (1 + 0.1 * random.random())
+        self.entries[key] = entry
+        return entry
+
+    def due(self, now: float | None = None) -> list[dict]:
+        """Các entry đã đến hạn thử lại, cũ nhất trước."""
+        now = time.time() if now is None else now
+        with self._lock:
+            ready = [e for e in self.entries.values() if e.get("next_eligible", 0) <= now]
+        return sorted(ready, key=lambda e: e["start"])
+
+    def resolve(self, location_id, api, start):
+        """Xoá entry sau khi đã lấy lại dữ liệu thành công."""
+        with self._lock:
+            self.entries.pop(self._key(location_id, api, start), None)
+
+    def resolve_covered(self, location_id, api, start, end) -> int:
+        """Xoá mọi entry của (location_id, api) nằm trọn trong cửa sổ [start, end) vừa fetch thành công."""
+        with self._lock:
+            covered = [
+                k for k, e in self.entries.items()
+                if k[0] == int(location_id) and k[1] == api and k[2] >= start and e["end"] <= end
+            ]
+            for k in covered:
+                del self.entries[k]
+        return len(covered)
@@ -0,0 +1,168 @@
+"""
+BẢNG ROLLUP THEO NGÀY / THÁNG (xem databaseRollups.sql)
+- Sau khi upsert_data COMMIT dữ liệu giờ, nó gọi refresh_rollups() trong một transaction RIÊNG
+  với các khoá (location_id, datetime) vừa được chèn/cập nhật: chỉ các ngày chứa các giờ đó được
+  tính lại từ bảng giờ (quét theo khoá chính, mỗi bucket một khoảng 24 giờ), rồi các tháng tương
+  ứng được tính lại từ rollup ngày.
+- Việc cập nhật này chỉ là best-effort: nếu lỗi (vd. chưa tạo bảng rollup), transaction rollup bị
+  ROLLBACK, upsert_data chỉ log cảnh báo và dữ liệu giờ vẫn được giữ -> rollup có thể bị lệch.
+- Khi refresh lỗi, hoặc sau backfill / sửa dữ liệu ngoài ETL: dựng lại bằng
+    python rollups.py rebuild [--start 2023-01-01] [--end 2024-01-01]
+"""
+import argparse
+import logging
+
+import pandas as pd
+from sqlalchemy import text
+
+
+logger = logging.getLogger("rollups")
+
+SOURCE_TABLE = "air_quality_forecast_data"
+DAILY_TABLE = "air_quality_daily_rollup"
+MONTHLY_TABLE = "air_quality_monthly_rollup"
+ROLLUP_TZ = "Asia/Ho_Chi_Minh"
+
+# chất -> (cột trong bảng giờ, ngưỡng µg/m³ để đếm số giờ vượt)
+# Ngưỡng theo QCVN 05:2023/BTNMT: trung bình 1h cho khí, trung bình 24h cho bụi (áp lên từng giờ)
+EXCEEDANCE_THRESHOLDS = {
+    "pm2_5": ("pm2_5_cams", 50.0),
+    "pm10": ("pm10_cams", 100.0),
+    "co": ("carbon_monoxide_cams", 30000.0),
+    "no2": ("nitrogen_dioxide_cams", 200.0),
+    "so2": ("sulphur_dioxide_cams", 350.0),
+    "o3": ("ozone_cams", 200.0),
+}
+
+
+def _pollutant_values_sql() -> str:
+    rows = [f"('{p}', d.{col}, {threshold})" for p, (col, threshold) in EXCEEDANCE_THRESHOLDS.items()]
+    return ",\n                ".join(rows)
+
+
+def _recompute_buckets(conn):
+    """Tính lại các ngày trong bảng tạm _rollup_days, rồi các tháng chứa chúng."""
+    conn.execute(text(f"""
+        DELETE FROM public.{DAILY_TABLE} r
+        USING _rollup_days k
+        WHERE r.location_id = k.location_id AND r.day = k.day;
+    """))
+    conn.execute(text(f"""
+        INSERT INTO public.{DAILY_TABLE}
+            (location_id, day, pollutant, n_hours, sum_value, min_value, max_value, n_exceed)
+        SELECT k.location_id, k.day, v.pollutant,
+               COUNT(*), SUM(v.value), MIN(v.value), MAX(v.value),
+               COUNT(*) FILTER (WHERE v.value > v.threshold)
+        FROM _rollup_days k
+        JOIN public.{SOURCE_TABLE} d
+          ON d.location_id = k.location_id
+         AND d.datetime >= (k.day::timestamp AT TIME ZONE '{ROLLUP_TZ}')
+         AND d.datetime < ((k.day + 1)::timestamp AT TIME ZONE '{ROLLUP_TZ}')
+        CROSS JOIN LATERAL (VALUES
+                {_pollutant_values_sql()}
+        ) AS v(pollutant, value, threshold)
+        WHERE v.value IS NOT NULL
+        GROUP BY k.location_id, k.day, v.pollutant;
+    """))
+
+    conn.execute(text("""
+        CREATE TEMP TABLE IF NOT EXISTS _rollup_months (location_id BIGINT, month DATE) ON COMMIT DROP;
+        TRUNCATE _rollup_months;
+        INSERT INTO _rollup_months
+        SELECT DISTINCT location_id, date_trunc('month', day)::date FROM _rollup_days;
+    """))
+    conn.execute(text(f"""
+        DELETE FROM public.{MONTHLY_TABLE} r
+        USING _rollup_months k
+        WHERE r.location_id = k.location_id AND r.month = k.month;
+    """))
+    conn.execute(text(f"""
+        INSERT INTO public.{MONTHLY_TABLE}
+            (location_id, month, pollutant, n_days, n_hours, sum_value, min_value, max_value, n_exceed)
+        SELECT k.location_id, k.month, r.pollutant,
+               COUNT(*), SUM(r.n_hours), SUM(r.sum_value), MIN(r.min_value), MAX(r.max_value), SUM(r.n_exceed)
+        FROM _rollup_months k
+        JOIN public.{DAILY_TABLE} r
+          ON r.location_id = k.location_id
+         AND r.day >= k.month
+         AND r.day < (k.month + INTERVAL '1 month')::date
+        GROUP BY k.location_id, k.month, r.pollutant;
+    """))
+
+
+def _create_days_table(conn):
+    conn.execute(text("""
+        CREATE TEMP TABLE IF NOT EXISTS _rollup_days (location_id BIGINT, day DATE) ON COMMIT DROP;
+        TRUNCATE _rollup_days;
+    """))
+
+
+def refresh_rollups(conn, location_ids, datetimes) -> int:
+    """
+    Tính lại các bucket ngày/tháng chứa các dòng (location_id, datetime) vừa thay đổi.
+    upsert_data gọi hàm này sau khi dữ liệu giờ đã COMMIT, trong transaction riêng (`conn` của
+    engine.begin()); lỗi chỉ bị log cảnh báo, khi đó chạy `python rollups.py rebuild` để đồng bộ lại.
+    Trả về số bucket ngày đã tính lại.
+    """
+    if len(location_ids) == 0:
+        return 0
+    keys = pd.DataFrame({
+        "location_id": pd.Series(location_ids, dtype="int64").to_numpy(),
+        "day": pd.to_datetime(pd.Series(datetimes), utc=True).dt.tz_convert(ROLLUP_TZ).dt.date.to_numpy(),
+    }).drop_duplicates()
+
+    _create_days_table(conn)
+    conn.execute(
+        text("INSERT INTO _rollup_days (location_id, day) VALUES (:location_id, :day)"),
+        keys.to_dict("records"),
+    )
+    _recompute_buckets(conn)
+    logger.info(f" -> Đã cập nhật rollup cho {len(keys)} bucket ngày (trạm x ngày).")
+    return len(keys)
+
+
+def rebuild_rollups(engine, start: str | None = None, end: str | None = None) -> int:
+    """
+    Dựng lại rollup cho mọi ngày có dữ liệu trong [start, end) (mặc định: toàn bộ bảng giờ).
+    Dùng sau backfill hoặc khi sửa dữ liệu trực tiếp trong database.
+    """
+    conditions, params = [], {}
+    if start:
+        conditions.append(f"datetime >= (CAST(:start AS date)::timestamp AT TIME ZONE '{ROLLUP_TZ}')")
+        params["start"] = start
+    if end:
+        conditions.append(f"datetime < (CAST(:end AS date)::timestamp AT TIME ZONE '{ROLLUP_TZ}')")
+        params["end"] = end
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    with engine.begin() as conn:
+        _create_days_table(conn)
+        conn.execute(text(f"""
+            INSERT INTO _rollup_days
+            SELECT DISTINCT location_id, (datetime AT TIME ZONE '{ROLLUP_TZ}')::date
+            FROM public.{SOURCE_TABLE} {where};
+        """), params)
+        n_days = conn.execute(text("SELECT COUNT(*) FROM _rollup_days")).scalar()
+        _recompute_buckets(conn)
+
+    logger.info(f" -> Đã dựng lại rollup cho {n_days} bucket ngày (trạm x ngày).")
+    return n_days
+
+
+def main():
+    from etl_core import get_db_engine
+
+    parser = argparse.ArgumentParser(description="Quản lý bảng rollup ngày/tháng.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_rebuild = sub.add_parser("rebuild", help="Dựng lại rollup từ bảng dữ liệu giờ")
+    p_rebuild.add_argument("--start", help="Ngày bắt đầu (YYYY-MM-DD, giờ VN), mặc định: toàn bộ")
+    p_rebuild.add_argument("--end", help="Ngày kết thúc, không bao gồm (YYYY-MM-DD)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    if args.command == "rebuild":
+        rebuild_rollups(get_db_engine(), args.start, args.end)
+
+
+if __name__ == "__main__":
+    main()
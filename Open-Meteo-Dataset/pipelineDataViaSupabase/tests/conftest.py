@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Các module của pipeline được import theo kiểu script (cùng thư mục), không phải package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
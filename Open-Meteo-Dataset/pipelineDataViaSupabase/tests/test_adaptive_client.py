@@ -0,0 +1,44 @@
+import pytest
+
+from adaptive_client import CircuitOpenError, HostLimiter
+
+
+def _open_circuit(limiter: HostLimiter):
+    for _ in range(limiter.failure_threshold):
+        probe = limiter.acquire()
+        limiter.release("error", probe=probe)
+    assert limiter.state == "open"
+
+
+def test_stale_request_finishing_in_half_open_keeps_probe_slot():
+    limiter = HostLimiter("example.org", initial_limit=8, failure_threshold=2, reset_timeout=0.0)
+    # Request gửi đi khi mạch còn đóng, kết thúc muộn
+    stale = limiter.acquire()
+    assert stale is False
+    _open_circuit(limiter)
+
+    probe = limiter.acquire()
+    assert probe is True and limiter.state == "half_open"
+
+    limiter.release("ok", probe=stale)
+    assert limiter.probe_in_flight
+    assert limiter.state == "half_open"
+    with pytest.raises(CircuitOpenError):
+        limiter.acquire()
+
+    limiter.release("ok", probe=probe)
+    assert not limiter.probe_in_flight
+    assert limiter.state == "closed"
+
+
+def test_stale_error_in_half_open_does_not_reopen_circuit():
+    limiter = HostLimiter("example.org", initial_limit=8, failure_threshold=2, reset_timeout=0.0)
+    stale = limiter.acquire()
+    _open_circuit(limiter)
+    probe = limiter.acquire()
+
+    limiter.release("error", probe=stale)
+    assert limiter.state == "half_open" and limiter.probe_in_flight
+
+    limiter.release("error", probe=probe)
+    assert limiter.state == "open" and not limiter.probe_in_flight
@@ -0,0 +1,34 @@
+import pandas as pd
+import pytest
+
+from etl_sharded import assign_shards
+
+
+N_STATIONS = 10_000
+
+
+@pytest.fixture(scope="module")
+def stations():
+    # location_id liên tiếp: trường hợp làm CRC32 chia lệch
+    return pd.DataFrame({"location_id": range(1, N_STATIONS + 1)})
+
+
+@pytest.mark.parametrize("num_shards", [2, 3, 4, 5, 6, 8])
+def test_shards_are_balanced(stations, num_shards):
+    counts = assign_shards(stations, num_shards).value_counts()
+    expected = N_STATIONS / num_shards
+    assert len(counts) == num_shards
+    assert counts.max() <= expected * 1.1
+    assert counts.min() >= expected * 0.9
+
+
+@pytest.mark.parametrize("old, new", [(3, 4), (4, 5), (5, 6), (7, 8)])
+def test_adding_a_shard_moves_about_one_nth(stations, old, new):
+    before = assign_shards(stations, old)
+    after = assign_shards(stations, new)
+    moved = before != after
+    # Chỉ các trạm chuyển sang shard mới, và khoảng 1/new số trạm
+    assert set(after[moved]) == {new - 1}
+    assert abs(moved.mean() - 1 / new) <= 0.02
+    # Mọi shard cũ đều nhường trạm, không chỉ một shard
+    assert set(before[moved]) == set(range(old))
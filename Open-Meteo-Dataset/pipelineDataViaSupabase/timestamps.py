@@ -0,0 +1,73 @@
+"""
+PARSE CỘT THỜI GIAN NHANH
+- Mỗi timestamp lặp lại một lần cho mỗi trạm (30+ lần), nên chỉ parse các chuỗi KHÁC NHAU
+  (pd.factorize) rồi ánh xạ ngược lại bằng mảng chỉ số.
+- Dùng định dạng cố định thay vì để pandas tự đoán, theo đúng các biến thể có trong các file CSV:
+    2022-08-02 00:00:00+07:00   (có offset, +07:00 hoặc +00:00, có thể trộn lẫn)
+    2022-08-02 00:00:00         (naive -> gán múi giờ `naive_tz`)
+    2022-08-02T00:00:00Z / ...T...+07:00   (ISO có chữ T / Z)
+  Chuỗi không khớp các dạng trên mới rơi về parser ISO8601 chung của pandas.
+"""
+import numpy as np
+import pandas as pd
+
+
+FMT_WITH_OFFSET = "%Y-%m-%d %H:%M:%S%z"
+FMT_NAIVE = "%Y-%m-%d %H:%M:%S"
+# Offset ở cuối chuỗi sau phần giờ: '...HH:MM[:SS[.fff]]+07:00' / '+0700' (Z đã được đổi thành +00:00)
+OFFSET_SUFFIX = r"\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?\s*[+-]\d{2}:?\d{2}$"
+
+
+def _parse_unique(uniques: pd.Series, naive_tz: str) -> pd.DatetimeIndex:
+    """Parse một tập chuỗi không trùng nhau, trả về DatetimeIndex theo UTC (cùng thứ tự)."""
+    s = uniques.str.strip().str.replace("T", " ", regex=False).str.replace("Z", "+00:00", regex=False)
+    lengths = s.str.len().to_numpy()
+    result = np.full(len(s), np.datetime64("NaT"), dtype="datetime64[ns]")
+
+    # 'YYYY-MM-DD HH:MM:SS+HH:MM' (25 ký tự): offset có thể khác nhau giữa các dòng, utc=True quy về UTC
+    mask = lengths == 25
+    if mask.any():
+        parsed = pd.to_datetime(s[mask], format=FMT_WITH_OFFSET, utc=True)
+        result[mask] = parsed.dt.tz_localize(None).to_numpy("datetime64[ns]")
+
+    # 'YYYY-MM-DD HH:MM:SS' (19 ký tự): naive, hiểu theo múi giờ `naive_tz`
+    mask_naive = lengths == 19
+    if mask_naive.any():
+        parsed = pd.to_datetime(s[mask_naive], format=FMT_NAIVE).dt.tz_localize(naive_tz).dt.tz_convert("UTC")
+        result[mask_naive] = parsed.dt.tz_localize(None).to_numpy("datetime64[ns]")
+
+    # Dạng khác (có phần giây lẻ, chỉ có ngày, ...): để parser ISO8601 xử lý.
+    # Chuỗi có offset (có thể trộn nhiều offset) parse với utc=True, chuỗi naive gán `naive_tz` riêng
+    rest = ~(mask | mask_naive)
+    if rest.any():
+        has_offset = s.str.contains(OFFSET_SUFFIX, regex=True).to_numpy()
+        aware, naive = rest & has_offset, rest & ~has_offset
+        if aware.any():
+            parsed = pd.to_datetime(s[aware], format="ISO8601", utc=True)
+            result[aware] = parsed.dt.tz_localize(None).to_numpy("datetime64[ns]")
+        if naive.any():
+            parsed = pd.to_datetime(s[naive], format="ISO8601").dt.tz_localize(naive_tz).dt.tz_convert("UTC")
+            result[naive] = parsed.dt.tz_localize(None).to_numpy("datetime64[ns]")
+
+    return pd.DatetimeIndex(result).tz_localize("UTC")
+
+
+def parse_timestamps(values, naive_tz: str = "UTC", tz: str = "UTC") -> pd.Series:
+    """
+    Parse một cột thời gian (chuỗi hoặc datetime) thành Series timezone-aware theo `tz`.
+    - Chuỗi naive được hiểu theo `naive_tz` (mặc định UTC, giống pd.to_datetime(..., utc=True)).
+    - Giá trị thiếu -> NaT. Chuỗi sai định dạng -> ValueError.
+    """
+    series = values if isinstance(values, pd.Series) else pd.Series(values)
+
+    if pd.api.types.is_datetime64_any_dtype(series.dtype):
+        if series.dt.tz is None:
+            series = series.dt.tz_localize(naive_tz)
+        return series.dt.tz_convert(tz)
+
+    codes, uniques = pd.factorize(series)
+    parsed = _parse_unique(pd.Series(uniques, dtype="string"), naive_tz)
+    if tz != "UTC":
+        parsed = parsed.tz_convert(tz)
+    # codes = -1 cho giá trị thiếu -> NaT
+    return pd.Series(parsed.take(codes, allow_fill=True, fill_value=pd.NaT), index=series.index, name=series.name)
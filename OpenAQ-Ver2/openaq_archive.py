@@ -0,0 +1,230 @@
+"""
+ĐỊNH DẠNG LƯU TRỮ GỌN CHO DỮ LIỆU OPENAQ THÔ (hanoi_air_quality_data_raw/)
+Mỗi dòng CSV thô lặp lại location_id, sensors_id, location, lat, lon, parameter, units dạng text.
+File archive (một file <location_id>.oqa cho mỗi trạm) lưu:
+  - bảng từ điển các tổ hợp (sensors_id, location, lat, lon, parameter, units) khác nhau trong header JSON,
+    mỗi dòng đo chỉ giữ một mã uint16 trỏ vào bảng này;
+  - thời gian dạng int64 số giờ kể từ epoch (UTC) - dữ liệu OpenAQ đều tròn giờ;
+  - giá trị dạng float32.
+Các dòng được sắp theo (parameter, giờ), header ghi khoảng dòng của từng parameter, nên lọc theo
+parameter là một lát cắt liền và lọc theo thời gian là searchsorted trên cột giờ (không quét, không parse text).
+
+Bố cục file:  b"OQA1" | uint32 độ dài header | header JSON (đệm tới bội số 64 byte) | các cột nhị phân
+Đọc bằng np.memmap: chỉ những trang của lát cắt được đọc thực sự được nạp vào bộ nhớ.
+
+    python openaq_archive.py convert [--raw hanoi_air_quality_data_raw] [--out hanoi_air_quality_data_archive]
+    python openaq_archive.py info
+    python openaq_archive.py verify      # so sánh archive với CSV gốc
+"""
+import argparse
+import glob
+import json
+import os
+import struct
+
+import numpy as np
+import pandas as pd
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+RAW_DIR = os.path.join(BASE_DIR, "hanoi_air_quality_data_raw")
+ARCHIVE_DIR = os.path.join(BASE_DIR, "hanoi_air_quality_data_archive")
+
+MAGIC = b"OQA1"
+ALIGN = 64
+RAW_COLUMNS = ["location_id", "sensors_id", "location", "datetime", "lat", "lon", "parameter", "units", "value"]
+KEY_COLUMNS = ["sensors_id", "location", "lat", "lon", "parameter", "units"]
+COLUMN_DTYPES = {"hour": "<i8", "value": "<f4", "key": "<u2"}
+
+
+def _to_epoch_hours(values) -> np.ndarray:
+    """Timestamp / chuỗi ISO -> số giờ kể từ epoch (UTC)."""
+    ts = pd.to_datetime(pd.Series(values), utc=True, format="ISO8601")
+    return ts.dt.tz_localize(None).to_numpy("datetime64[h]").astype(np.int64)
+
+
+# --- GHI ---
+
+def write_station_archive(df: pd.DataFrame, path: str) -> dict:
+    """Ghi các dòng đo của MỘT location (cột như CSV thô) thành file archive. Trả về header."""
+    location_ids = df["location_id"].unique()
+    if len(location_ids) != 1:
+        raise ValueError(f"Mỗi file archive chỉ chứa một location, nhận được {list(location_ids)}")
+
+    hours = _to_epoch_hours(df["datetime"])
+    # Bảng từ điển: mỗi tổ hợp cột lặp lại -> một mã
+    key_codes, keys = pd.MultiIndex.from_frame(df[KEY_COLUMNS]).factorize()
+    if len(keys) > np.iinfo(np.uint16).max:
+        raise ValueError("Quá nhiều tổ hợp sensor/parameter cho một location (tối đa 65535).")
+    key_table = keys.to_frame(index=False, name=KEY_COLUMNS)
+    parameter_of_key = key_table["parameter"].to_numpy()
+
+    # Sắp theo (parameter, giờ) để lọc parameter = lát cắt liền, lọc thời gian = searchsorted
+    parameters = sorted(set(parameter_of_key))
+    param_rank = pd.Index(parameters).get_indexer(parameter_of_key)[key_codes]
+    order = np.lexsort((key_codes, hours, param_rank))
+    hours, key_codes, param_rank = hours[order], key_codes[order], param_rank[order]
+    values = df["value"].to_numpy(dtype=np.float32)[order]
+    bounds = np.searchsorted(param_rank, np.arange(len(parameters) + 1))
+
+    columns = {"hour": hours.astype(COLUMN_DTYPES["hour"]),
+               "value": values.astype(COLUMN_DTYPES["value"]),
+               "key": key_codes.astype(COLUMN_DTYPES["key"])}
+    header = {
+        "version": 1,
+        "location_id": int(location_ids[0]),
+        "n_rows": int(len(df)),
+        "keys": {c: key_table[c].tolist() for c in KEY_COLUMNS},
+        "parameters": {p: [int(bounds[i]), int(bounds[i + 1])] for i, p in enumerate(parameters)},
+        "columns": {},
+    }
+
+    # Tính offset cột sau khi biết độ dài header (header tự chứa offset -> lặp tới khi ổn định)
+    header_bytes = b""
+    for _ in range(3):
+        offset = -(-(len(MAGIC) + 4 + len(header_bytes)) // ALIGN) * ALIGN
+        for name, arr in columns.items():
+            header["columns"][name] = {"dtype": COLUMN_DTYPES[name], "offset": offset}
+            offset += -(-arr.nbytes // ALIGN) * ALIGN
+        new_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+        stable = len(new_bytes) == len(header_bytes)
+        header_bytes = new_bytes
+        if stable:
+            break
+    else:
+        raise RuntimeError("Không cố định được độ dài header archive.")
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC + struct.pack("<I", len(header_bytes)) + header_bytes)
+        for name, arr in columns.items():
+            f.write(b"\0" * (header["columns"][name]["offset"] - f.tell()))
+            f.write(arr.tobytes())
+    os.replace(tmp_path, path)
+    return header
+
+
+def convert(raw_dir: str = RAW_DIR, archive_dir: str = ARCHIVE_DIR) -> list[str]:
+    """Chuyển mọi thư mục <location_id>/ trong raw_dir (các file <id>_<năm>_H<n>.csv) thành <id>.oqa."""
+    written = []
+    for station_dir in sorted(glob.glob(os.path.join(raw_dir, "*"))):
+        files = sorted(glob.glob(os.path.join(station_dir, "*.csv")))
+        if not os.path.isdir(station_dir) or not files:
+            continue
+        df = pd.concat([pd.read_csv(f, encoding="utf-8-sig") for f in files], ignore_index=True)
+        path = os.path.join(archive_dir, f"{os.path.basename(station_dir)}.oqa")
+        write_station_archive(df, path)
+        csv_size = sum(os.path.getsize(f) for f in files)
+        print(f"  → {os.path.basename(path)}: {len(df):,} dòng, {csv_size / 1024:.0f} KB CSV -> {os.path.getsize(path) / 1024:.0f} KB")
+        written.append(path)
+    return written
+
+
+# --- ĐỌC ---
+
+class StationArchive:
+    """Đọc một file archive qua np.memmap; các cột chỉ được nạp khi truy cập."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"'{path}' không phải file archive OpenAQ.")
+            (header_len,) = struct.unpack("<I", f.read(4))
+            self.header = json.loads(f.read(header_len).decode("utf-8"))
+        self.location_id = self.header["location_id"]
+        self.n_rows = self.header["n_rows"]
+        self.parameters = list(self.header["parameters"])
+        self.keys = pd.DataFrame(self.header["keys"])
+        self.columns = {
+            name: np.memmap(path, dtype=spec["dtype"], mode="r", offset=spec["offset"], shape=(self.n_rows,))
+            for name, spec in self.header["columns"].items()
+        } if self.n_rows else {name: np.empty(0, dtype=spec["dtype"]) for name, spec in self.header["columns"].items()}
+
+    def row_ranges(self, parameters=None, start=None, end=None) -> list[tuple[int, int]]:
+        """Các khoảng dòng [a, b) khớp bộ lọc. start bao gồm, end không bao gồm (chuỗi/Timestamp, UTC nếu naive)."""
+        wanted = self.parameters if parameters is None else [p for p in self.parameters if p in set(parameters)]
+        start_h = _to_epoch_hours([start])[0] if start is not None else None
+        end_h = _to_epoch_hours([end])[0] if end is not None else None
+        hours = self.columns["hour"]
+        ranges = []
+        for p in wanted:
+            a, b = self.header["parameters"][p]
+            # Trong một parameter, cột giờ đã sắp tăng dần
+            lo = a + int(np.searchsorted(hours[a:b], start_h, side="left")) if start_h is not None else a
+            hi = a + int(np.searchsorted(hours[a:b], end_h, side="left")) if end_h is not None else b
+            if hi > lo:
+                ranges.append((lo, hi))
+        return ranges
+
+    def read(self, parameters=None, start=None, end=None) -> pd.DataFrame:
+        """Trả về frame dạng dài như CSV thô (datetime tz UTC, value float32) cho các dòng khớp bộ lọc."""
+        ranges = self.row_ranges(parameters, start, end)
+        idx = np.concatenate([np.arange(a, b) for a, b in ranges]) if ranges else np.empty(0, dtype=np.int64)
+        codes = np.asarray(self.columns["key"][idx]).astype(np.intp)
+        frame = {"location_id": np.full(len(idx), self.location_id, dtype=np.int64)}
+        for col in KEY_COLUMNS:
+            frame[col] = self.keys[col].to_numpy()[codes]
+        hours = np.asarray(self.columns["hour"][idx])
+        frame["datetime"] = pd.DatetimeIndex(hours.astype("datetime64[h]").astype("datetime64[ns]")).tz_localize("UTC")
+        frame["value"] = np.asarray(self.columns["value"][idx])
+        return pd.DataFrame(frame)[RAW_COLUMNS]
+
+
+def read_archive(archive_dir: str = ARCHIVE_DIR, location_ids=None, parameters=None, start=None, end=None) -> pd.DataFrame:
+    """Ghép kết quả đọc của nhiều trạm (mặc định: tất cả file .oqa trong archive_dir)."""
+    if location_ids is None:
+        paths = sorted(glob.glob(os.path.join(archive_dir, "*.oqa")))
+    else:
+        paths = [os.path.join(archive_dir, f"{loc}.oqa") for loc in location_ids]
+    frames = [StationArchive(p).read(parameters, start, end) for p in paths]
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=RAW_COLUMNS)
+
+
+def verify(raw_dir: str = RAW_DIR, archive_dir: str = ARCHIVE_DIR) -> bool:
+    """So sánh từng archive với CSV gốc (giá trị so sánh ở độ chính xác float32)."""
+    ok = True
+    for path in sorted(glob.glob(os.path.join(archive_dir, "*.oqa"))):
+        loc = os.path.splitext(os.path.basename(path))[0]
+        raw = pd.concat([pd.read_csv(f, encoding="utf-8-sig") for f in sorted(glob.glob(os.path.join(raw_dir, loc, "*.csv")))],
+                        ignore_index=True)
+        raw["datetime"] = pd.to_datetime(raw["datetime"], utc=True, format="ISO8601")
+        raw["value"] = raw["value"].astype(np.float32)
+        got = StationArchive(path).read()
+        sort_cols = ["parameter", "datetime", "sensors_id"]
+        raw = raw.sort_values(sort_cols).reset_index(drop=True)
+        got = got.sort_values(sort_cols).reset_index(drop=True)
+        try:
+            pd.testing.assert_frame_equal(raw[RAW_COLUMNS], got, check_dtype=False)
+            print(f"  ✓ {loc}: {len(got):,} dòng khớp")
+        except AssertionError as e:
+            ok = False
+            print(f"  ✗ {loc}: KHÔNG khớp - {str(e).splitlines()[0]}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chuyển / đọc / kiểm tra archive OpenAQ.")
+    parser.add_argument("--raw", default=RAW_DIR)
+    parser.add_argument("--out", default=ARCHIVE_DIR, help="Thư mục archive")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("convert", help="CSV thô -> một file .oqa cho mỗi trạm")
+    sub.add_parser("info", help="In kích thước và parameter của từng archive")
+    sub.add_parser("verify", help="So sánh archive với CSV thô")
+    args = parser.parse_args()
+
+    if args.command == "convert":
+        print(f"Chuyển '{args.raw}' -> '{args.out}'")
+        convert(args.raw, args.out)
+    elif args.command == "info":
+        for path in sorted(glob.glob(os.path.join(args.out, "*.oqa"))):
+            a = StationArchive(path)
+            counts = {p: b - s for p, (s, b) in a.header["parameters"].items()}
+            print(f"  {a.location_id}: {a.n_rows:,} dòng, {os.path.getsize(path) / 1024:.0f} KB, {counts}")
+    else:
+        raise SystemExit(0 if verify(args.raw, args.out) else 1)
+
+
+if __name__ == "__main__":
+    main()
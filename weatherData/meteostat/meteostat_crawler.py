@@ -0,0 +1,264 @@
+"""
+CRAWLER METEOSTAT TĂNG DẦN (thay cho CELL 3 của crawlFromLibMeteostat.ipynb)
+- Dữ liệu tham chiếu của mỗi trạm được lưu theo NĂM:
+    hanoi_weather_meteostat_ref_raw/chunks/<station_id>/<năm>.csv
+  kèm chunks/state.json ghi watermark (giờ cuối cùng có dữ liệu), các năm đã "đóng" và các năm
+  đã đóng mà Meteostat không có dữ liệu (empty_years, không có file chunk nhưng cũng không tải lại).
+- Mỗi lần refresh:
+    * năm đã đóng (đã tải sau khi năm kết thúc + CLOSE_GRACE_DAYS) -> bỏ qua, không gọi API;
+    * năm đang mở -> chỉ tải lại từ đầu THÁNG chứa watermark tới hiện tại (Meteostat hay bổ sung
+      dữ liệu trễ của vài ngày gần nhất), ghép vào chunk của năm đó.
+  Các trạm được tải song song (ThreadPoolExecutor).
+- File tổng weather_<id>_<tên>.csv (định dạng cũ, notebook/merge vẫn đọc như trước) được dựng lại
+  từ các chunk mà không cần gọi lại API.
+- Lần chạy đầu: nếu đã có file tổng cũ mà chưa có chunk, file đó được tách thành chunk theo năm
+  (không tải lại nhiều năm dữ liệu).
+
+    python meteostat_crawler.py refresh [--stations 48820 48825] [--workers 4]
+    python meteostat_crawler.py rebuild
+    python meteostat_crawler.py status
+"""
+import argparse
+import glob
+import json
+import logging
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import pandas as pd
+
+
+logger = logging.getLogger("meteostat_crawler")
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+OUTPUT_DIR = os.path.join(BASE_DIR, "hanoi_weather_meteostat_ref_raw")
+CHUNK_DIR = os.path.join(OUTPUT_DIR, "chunks")
+STATE_FILE = os.path.join(CHUNK_DIR, "state.json")
+STATION_MAPPING_FILE = os.path.join(BASE_DIR, "station_mapping_meteostat.csv")
+
+START_YEAR = 2022
+# Năm chỉ được coi là đóng khi đã tải sau ngày 1/1 năm sau + số ngày này
+CLOSE_GRACE_DAYS = 7
+
+# Cột Meteostat -> cột tham chiếu trong file (đúng thứ tự các file weather_<id>_<tên>.csv hiện có)
+REF_COLUMNS = {
+    "temp": "temp_ref", "rhum": "rhum_ref", "prcp": "prcp_ref",
+    "wdir": "wdir_ref", "wspd": "wspd_ref", "pres": "pres_ref",
+}
+
+_state_lock = threading.Lock()
+
+
+# --- TRẠNG THÁI / CHUNK ---
+
+def load_state(path: str = STATE_FILE) -> dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_state(state: dict, path: str = STATE_FILE):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def chunk_path(station_id: str, year: int, chunk_dir: str = CHUNK_DIR) -> str:
+    return os.path.join(chunk_dir, str(station_id), f"{year}.csv")
+
+
+def read_chunk(path: str) -> pd.DataFrame:
+    df = pd.read_csv(path, index_col="time", encoding="utf-8-sig")
+    df.index = pd.to_datetime(df.index, format="%Y-%m-%d %H:%M:%S")
+    return df
+
+
+def write_chunk(df: pd.DataFrame, path: str):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    df.to_csv(tmp_path, encoding="utf-8-sig", index_label="time")
+    os.replace(tmp_path, path)
+
+
+def _last_valid_time(df: pd.DataFrame):
+    valid = df.dropna(how="all")
+    return valid.index.max() if not valid.empty else None
+
+
+def combined_file_path(station_id: str, output_dir: str = OUTPUT_DIR) -> str:
+    """File tổng weather_<id>_<tên>.csv; giữ tên đã có (tên thật do notebook đặt), mặc định tên = id."""
+    existing = sorted(glob.glob(os.path.join(output_dir, f"weather_{station_id}_*.csv")))
+    if existing:
+        return existing[0]
+    return os.path.join(output_dir, f"weather_{station_id}_{station_id}.csv")
+
+
+def seed_chunks_from_combined(station_id: str, state: dict, output_dir: str = OUTPUT_DIR, chunk_dir: str = CHUNK_DIR) -> dict:
+    """Tách file tổng cũ thành chunk theo năm (chỉ khi trạm chưa có chunk nào)."""
+    station_state = state.get(str(station_id), {"closed_years": [], "watermark": None})
+    if glob.glob(os.path.join(chunk_dir, str(station_id), "*.csv")):
+        return station_state
+    combined = combined_file_path(station_id, output_dir)
+    if not os.path.exists(combined):
+        return station_state
+
+    df = read_chunk(combined)
+    for year, part in df.groupby(df.index.year):
+        write_chunk(part, chunk_path(station_id, year, chunk_dir))
+    watermark = _last_valid_time(df)
+    # Chưa biết file cũ được tải lúc nào -> coi các năm trước năm của watermark là đã đóng
+    station_state["closed_years"] = sorted(int(y) for y in df.index.year.unique() if watermark is not None and y < watermark.year)
+    station_state["watermark"] = watermark.strftime("%Y-%m-%dT%H:%M") if watermark is not None else None
+    logger.info(f"  - Trạm {station_id}: đã tách {os.path.basename(combined)} thành {df.index.year.nunique()} chunk năm.")
+    return station_state
+
+
+# --- TẢI DỮ LIỆU ---
+
+def fetch_hourly(station_id: str, start: datetime, end: datetime) -> pd.DataFrame:
+    """Gọi Meteostat Hourly cho [start, end] và đổi tên về các cột *_ref."""
+    from meteostat import Hourly
+
+    df = Hourly(str(station_id), start, end).fetch()
+    df = df.rename(columns=REF_COLUMNS).reindex(columns=list(REF_COLUMNS.values()))
+    df.index.name = "time"
+    return df
+
+
+def refresh_station(station_id: str, station_state: dict, now: datetime | None = None,
+                    chunk_dir: str = CHUNK_DIR, fetch=fetch_hourly) -> dict:
+    """
+    Cập nhật các chunk năm còn mở của một trạm. Trả về trạng thái mới của trạm
+    (closed_years, empty_years, watermark, updated_at, rows_fetched).
+    """
+    # Meteostat dùng datetime naive theo UTC
+    now = now or datetime.now(timezone.utc).replace(tzinfo=None, minute=0, second=0, microsecond=0)
+    closed = set(station_state.get("closed_years", []))
+    empty = set(station_state.get("empty_years", []))
+    watermark = station_state.get("watermark")
+    watermark = datetime.fromisoformat(watermark) if watermark else None
+    rows_fetched = 0
+
+    for year in range(START_YEAR, now.year + 1):
+        path = chunk_path(station_id, year, chunk_dir)
+        # Năm đã đóng: có chunk, hoặc đã ghi nhận là không có dữ liệu -> không gọi lại API
+        if year in closed and (os.path.exists(path) or year in empty):
+            continue
+
+        year_start, year_end = datetime(year, 1, 1), datetime(year, 12, 31, 23)
+        # Chỉ tải lại từ đầu tháng của watermark nếu watermark nằm trong năm này và chunk đã có
+        start = year_start
+        if watermark is not None and watermark.year == year and os.path.exists(path):
+            start = watermark.replace(day=1, hour=0)
+        end = min(year_end, now)
+        if start > end:
+            continue
+
+        new = fetch(station_id, start, end)
+        rows_fetched += len(new)
+        if os.path.exists(path):
+            old = read_chunk(path)
+            merged = pd.concat([old[old.index < start], new])
+        else:
+            merged = new
+        merged = merged[~merged.index.duplicated(keep="last")].sort_index()
+        if not merged.empty:
+            write_chunk(merged, path)
+
+        last = _last_valid_time(merged)
+        if last is not None and (watermark is None or last > watermark):
+            watermark = last
+        if now >= datetime(year + 1, 1, 1) + timedelta(days=CLOSE_GRACE_DAYS):
+            closed.add(year)
+            if merged.empty:
+                empty.add(year)
+        logger.info(f"  - Trạm {station_id} năm {year}: tải {start:%Y-%m-%d} -> {end:%Y-%m-%d %H:00}, {len(new)} giờ.")
+
+    return {
+        "closed_years": sorted(closed),
+        "empty_years": sorted(empty),
+        "watermark": watermark.strftime("%Y-%m-%dT%H:%M") if watermark is not None else None,
+        "updated_at": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "rows_fetched": rows_fetched,
+    }
+
+
+def rebuild_combined(station_id: str, output_dir: str = OUTPUT_DIR, chunk_dir: str = CHUNK_DIR) -> int:
+    """Dựng lại file weather_<id>_<tên>.csv từ các chunk năm (không gọi API). Trả về số giờ."""
+    paths = sorted(glob.glob(os.path.join(chunk_dir, str(station_id), "*.csv")))
+    paths = [p for p in paths if re.fullmatch(r"\d{4}\.csv", os.path.basename(p))]
+    if not paths:
+        return 0
+    df = pd.concat([read_chunk(p) for p in paths]).sort_index()
+    df = df[~df.index.duplicated(keep="last")]
+    target = combined_file_path(station_id, output_dir)
+    write_chunk(df, target)
+    logger.info(f"  - Trạm {station_id}: dựng lại {os.path.basename(target)} từ {len(paths)} chunk ({len(df)} giờ).")
+    return len(df)
+
+
+def read_station_ids(mapping_file: str = STATION_MAPPING_FILE) -> list[str]:
+    mapping = pd.read_csv(mapping_file, encoding="utf-8-sig", dtype={"assigned_weather_station_id": str})
+    return sorted(mapping["assigned_weather_station_id"].dropna().unique())
+
+
+def refresh_all(station_ids: list[str], workers: int = 4) -> dict:
+    """Seed chunk từ file cũ (nếu cần), tải song song các năm còn mở, lưu state và dựng lại file tổng."""
+    state = load_state()
+    for sid in station_ids:
+        state[str(sid)] = seed_chunks_from_combined(sid, state)
+    save_state(state)
+
+    def _run(sid):
+        try:
+            return sid, refresh_station(sid, state[str(sid)]), None
+        except Exception as e:
+            return sid, None, e
+
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(station_ids)))) as executor:
+        for sid, new_state, error in executor.map(_run, station_ids):
+            if error is not None:
+                # Giữ nguyên state cũ để lần sau tải lại đúng đoạn còn thiếu
+                logger.warning(f"  - Trạm {sid}: lỗi khi tải dữ liệu: {error}")
+                continue
+            with _state_lock:
+                state[str(sid)] = new_state
+                save_state(state)
+            rebuild_combined(sid)
+    return state
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tải tăng dần dữ liệu tham chiếu Meteostat theo chunk năm.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_refresh = sub.add_parser("refresh", help="Tải các năm còn mở và dựng lại file tổng")
+    p_refresh.add_argument("--stations", nargs="*", help="ID trạm Meteostat (mặc định: theo station_mapping_meteostat.csv)")
+    p_refresh.add_argument("--workers", type=int, default=4)
+    p_rebuild = sub.add_parser("rebuild", help="Dựng lại file tổng từ chunk, không gọi API")
+    p_rebuild.add_argument("--stations", nargs="*")
+    sub.add_parser("status", help="In watermark và các năm đã đóng của từng trạm")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    station_ids = getattr(args, "stations", None) or read_station_ids()
+
+    if args.command == "refresh":
+        logger.info(f"Bắt đầu refresh {len(station_ids)} trạm Meteostat: {station_ids}")
+        refresh_all(station_ids, args.workers)
+    elif args.command == "rebuild":
+        for sid in station_ids:
+            rebuild_combined(sid)
+    else:
+        for sid, s in sorted(load_state().items()):
+            print(f"{sid}: watermark={s.get('watermark')}, năm đã đóng={s.get('closed_years')}, "
+                  f"năm không có dữ liệu={s.get('empty_years', [])}, cập nhật={s.get('updated_at')}")
+
+
+if __name__ == "__main__":
+    main()